@@ -1,6 +1,12 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Medicine, ScanLog
+from .models import InventoryAlert, InventoryAlertRun, Medicine, ScanLog, ScanRollup, StockMovement
+from .pagination import EstimatedCountPaginator
+from .stats import get_inventory_stats
+
+# Edge length of the changelist QR thumbnails; rendered at twice the size
+# for high-density screens
+QR_THUMBNAIL_SIZE = 64
 
 
 @admin.register(Medicine)
@@ -26,6 +32,13 @@ class MedicineAdmin(admin.ModelAdmin):
         'expiry_date',
     )
 
+    # medicine_expiry_idx
+    date_hierarchy = 'expiry_date'
+
+    # Large catalogs: no second unfiltered COUNT(*), estimated total instead
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
     readonly_fields = (
         'qr_code_image',
         'created_at',
@@ -63,15 +76,22 @@ class MedicineAdmin(admin.ModelAdmin):
     )
 
     def qr_code_image(self, obj):
-        if obj.qr_code:
+        # A small rendition sized for the changelist, cached by the browser
+        # for as long as the payload (and so the versioned URL) is unchanged
+        if obj.qr_hash:
             return format_html(
-                '<img src="{}" width="120" height="120" />',
-                obj.qr_code.url
+                '<img src="{}" width="{}" height="{}" loading="lazy" decoding="async" />',
+                obj.get_qr_url(size=2 * QR_THUMBNAIL_SIZE), QR_THUMBNAIL_SIZE, QR_THUMBNAIL_SIZE,
             )
         return "No QR Code"
 
     qr_code_image.short_description = "QR Code"
 
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['inventory_stats'] = get_inventory_stats()
+        return super().changelist_view(request, extra_context=extra_context)
+
 
 @admin.register(ScanLog)
 class ScanLogAdmin(admin.ModelAdmin):
@@ -87,6 +107,17 @@ class ScanLogAdmin(admin.ModelAdmin):
         'timestamp',
     )
 
+    list_select_related = (
+        'user',
+        'medicine',
+    )
+
+    # scanlog_timestamp_idx
+    date_hierarchy = 'timestamp'
+
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
     search_fields = (
         'scanned_data',
         'user__username',
@@ -99,3 +130,151 @@ class ScanLogAdmin(admin.ModelAdmin):
         'timestamp',
         'user',
     )
+
+    def has_add_permission(self, request):
+        # Written by the scan views only; every field is read-only here
+        return False
+
+
+@admin.register(ScanRollup)
+class ScanRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        'day',
+        'medicine',
+        'user',
+        'recognized',
+        'count',
+    )
+
+    list_filter = (
+        'recognized',
+        'day',
+    )
+
+    list_select_related = (
+        'medicine',
+        'user',
+    )
+
+    # Leading column of unique_scan_rollup
+    date_hierarchy = 'day'
+
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    readonly_fields = (
+        'day',
+        'medicine',
+        'user',
+        'recognized',
+        'count',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(InventoryAlert)
+class InventoryAlertAdmin(admin.ModelAdmin):
+    list_display = (
+        'medicine',
+        'kind',
+        'window_days',
+        'expiry_date',
+        'stock',
+        'raised_at',
+    )
+
+    list_filter = (
+        'kind',
+        'window_days',
+    )
+
+    list_select_related = (
+        'medicine',
+    )
+
+    show_full_result_count = False
+
+    readonly_fields = (
+        'medicine',
+        'kind',
+        'window_days',
+        'expiry_date',
+        'stock',
+        'raised_at',
+        'updated_at',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(InventoryAlertRun)
+class InventoryAlertRunAdmin(admin.ModelAdmin):
+    list_display = (
+        'started_at',
+        'full',
+        'scanned',
+        'raised',
+        'cleared',
+    )
+
+    readonly_fields = (
+        'started_at',
+        'finished_at',
+        'full',
+        'threshold',
+        'windows',
+        'scanned',
+        'raised',
+        'cleared',
+    )
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = (
+        'timestamp',
+        'medicine',
+        'kind',
+        'quantity',
+        'stock_after',
+        'reference',
+        'user',
+    )
+
+    list_filter = (
+        'kind',
+        'timestamp',
+    )
+
+    list_select_related = (
+        'medicine',
+        'user',
+    )
+
+    # movement_timestamp_idx
+    date_hierarchy = 'timestamp'
+
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    search_fields = (
+        'reference',
+        'medicine__batch_number',
+    )
+
+    readonly_fields = (
+        'medicine',
+        'kind',
+        'quantity',
+        'stock_after',
+        'reference',
+        'user',
+        'timestamp',
+    )
+
+    def has_add_permission(self, request):
+        # Written by medicines.stock only, so the ledger matches the stock
+        return False
@@ -0,0 +1,148 @@
+# medicines/alerts.py
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .stats import get_low_stock_threshold
+
+# Rows changed shortly before the previous run started are read again, so a
+# transaction that was still open while it ran is never missed
+WATERMARK_OVERLAP = datetime.timedelta(minutes=5)
+
+
+def get_expiry_windows():
+    return tuple(sorted(getattr(settings, 'MEDICINE_EXPIRY_ALERT_WINDOWS', (30, 60, 90))))
+
+
+def classify(expiry_date, stock, today, windows, threshold):
+    """Return ``{kind: window_days}`` for the alerts a medicine should have open."""
+    from .models import InventoryAlert
+
+    alerts = {}
+    if expiry_date <= today:
+        alerts[InventoryAlert.EXPIRED] = None
+    else:
+        days_left = (expiry_date - today).days
+        for window in windows:
+            if days_left <= window:
+                alerts[InventoryAlert.EXPIRING] = window
+                break
+    if stock < threshold:
+        alerts[InventoryAlert.LOW_STOCK] = None
+    return alerts
+
+
+def _full_filter(today, windows, threshold):
+    # Two indexed range scans: medicine_expiry_idx and medicine_stock_idx
+    return Q(expiry_date__lte=today + datetime.timedelta(days=max(windows, default=0))) | Q(
+        stock__lt=threshold
+    )
+
+
+def _incremental_filter(last_run, today, windows):
+    # Rows edited since the last run (medicine_updated_idx) ...
+    lookup = Q(updated_at__gt=last_run.started_at - WATERMARK_OVERLAP)
+    # ... plus untouched rows whose expiry crossed a boundary as days passed
+    last_day = timezone.localdate(last_run.started_at)
+    if today > last_day:
+        for days in (0, *windows):
+            offset = datetime.timedelta(days=days)
+            lookup |= Q(expiry_date__gt=last_day + offset, expiry_date__lte=today + offset)
+    return lookup
+
+
+def _reconcile(rows, today, windows, threshold):
+    """Make the alert table match ``rows`` of ``(pk, expiry_date, stock)``."""
+    from .models import InventoryAlert
+
+    existing = {
+        (alert.medicine_id, alert.kind): alert
+        for alert in InventoryAlert.objects.filter(medicine_id__in=[row[0] for row in rows])
+    }
+    now = timezone.now()
+    to_create, to_update = [], []
+    for pk, expiry_date, stock in rows:
+        for kind, window in classify(expiry_date, stock, today, windows, threshold).items():
+            alert = existing.pop((pk, kind), None)
+            if alert is None:
+                to_create.append(InventoryAlert(
+                    medicine_id=pk, kind=kind, window_days=window,
+                    expiry_date=expiry_date, stock=stock,
+                ))
+            elif (alert.window_days, alert.expiry_date, alert.stock) != (window, expiry_date, stock):
+                alert.window_days, alert.expiry_date, alert.stock = window, expiry_date, stock
+                alert.updated_at = now
+                to_update.append(alert)
+
+    # Whatever is left no longer applies to its medicine
+    stale = [alert.pk for alert in existing.values()]
+    with transaction.atomic():
+        InventoryAlert.objects.bulk_create(to_create)
+        InventoryAlert.objects.bulk_update(to_update, ['window_days', 'expiry_date', 'stock', 'updated_at'])
+        InventoryAlert.objects.filter(pk__in=stale).delete()
+    return len(to_create), len(stale)
+
+
+def run_alerts(full=False, chunk_size=2000):
+    """
+    Refresh the InventoryAlert table and record the run.
+
+    A full run reads every medicine inside the largest expiry window or
+    below the reorder level. Otherwise only rows updated since the previous
+    run's watermark, and rows whose expiry date crossed a window boundary
+    since that day, are read. Either way rows stream in ``chunk_size``
+    batches and each batch costs a fixed handful of queries. Changing the
+    windows or the threshold forces a full run.
+    """
+    from .models import InventoryAlert, InventoryAlertRun, Medicine
+
+    started_at = timezone.now()
+    today = timezone.localdate(started_at)
+    windows = get_expiry_windows()
+    threshold = get_low_stock_threshold()
+    windows_key = ','.join(str(window) for window in windows)
+
+    last_run = InventoryAlertRun.objects.order_by('-started_at').first()
+    if last_run is None or (last_run.threshold, last_run.windows) != (threshold, windows_key):
+        full = True
+
+    if full:
+        lookup = _full_filter(today, windows, threshold)
+    else:
+        lookup = _incremental_filter(last_run, today, windows)
+    rows = Medicine.objects.filter(lookup).values_list('pk', 'expiry_date', 'stock')
+
+    scanned = raised = cleared = 0
+    chunk = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            created, deleted = _reconcile(chunk, today, windows, threshold)
+            scanned, raised, cleared = scanned + len(chunk), raised + created, cleared + deleted
+            chunk = []
+    if chunk:
+        created, deleted = _reconcile(chunk, today, windows, threshold)
+        scanned, raised, cleared = scanned + len(chunk), raised + created, cleared + deleted
+
+    if full:
+        # Alerts of medicines that fell outside both ranges were never read
+        max_expiry = today + datetime.timedelta(days=max(windows, default=0))
+        deleted, _ = InventoryAlert.objects.filter(
+            Q(kind__in=[InventoryAlert.EXPIRED, InventoryAlert.EXPIRING], medicine__expiry_date__gt=max_expiry)
+            | Q(kind=InventoryAlert.LOW_STOCK, medicine__stock__gte=threshold)
+        ).delete()
+        cleared += deleted
+
+    return InventoryAlertRun.objects.create(
+        started_at=started_at,
+        finished_at=timezone.now(),
+        full=full,
+        threshold=threshold,
+        windows=windows_key,
+        scanned=scanned,
+        raised=raised,
+        cleared=cleared,
+    )
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MedicinesConfig(AppConfig):
     name = "medicines"
+
+    def ready(self):
+        from . import signals  # noqa: F401
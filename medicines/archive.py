@@ -0,0 +1,327 @@
+# medicines/archive.py
+import datetime
+import gzip
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# (name, values_list lookup) of every archived ScanLog column; usernames and
+# batch numbers are copied so audits still read after users or medicines go
+COLUMNS = (
+    ('id', 'pk'),
+    ('timestamp', 'timestamp'),
+    ('user_id', 'user_id'),
+    ('user', 'user__username'),
+    ('medicine_id', 'medicine_id'),
+    ('batch_number', 'medicine__batch_number'),
+    ('recognized', 'recognized'),
+    ('scanned_data', 'scanned_data'),
+)
+HEADER = [name for name, _lookup in COLUMNS]
+
+FORMATS = ('jsonl', 'parquet')
+EXTENSIONS = {'jsonl': '.jsonl.gz', 'parquet': '.parquet'}
+
+# scanlogs-<first id>-<last id>-<earliest>-<latest>.<ext>; the time range in
+# the name lets readers skip segments without opening them
+SEGMENT_RE = re.compile(
+    r'^scanlogs-(?P<first_id>\d+)-(?P<last_id>\d+)-(?P<start>\d{8}T\d{6})-(?P<end>\d{8}T\d{6})'
+    r'(?P<ext>\.jsonl\.gz|\.parquet)$'
+)
+STAMP_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'MEDICINE_SCANLOG_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'scanlogs'))
+
+
+def get_retention_days():
+    return getattr(settings, 'MEDICINE_SCANLOG_RETENTION_DAYS', 365)
+
+
+def _pyarrow():
+    """Return ``(pyarrow, pyarrow.parquet)``, or None if pyarrow isn't installed."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+
+def resolve_format(fmt):
+    """Map ``auto`` to Parquet if pyarrow is available, else gzip JSONL."""
+    if fmt == 'auto':
+        return 'parquet' if _pyarrow() is not None else 'jsonl'
+    if fmt == 'parquet' and _pyarrow() is None:
+        raise ValueError("Parquet segments need pyarrow, which is not installed")
+    return fmt
+
+
+@dataclass(frozen=True)
+class Segment:
+    path: Path
+    first_id: int
+    last_id: int
+    # Whole seconds, UTC; ``end`` is rounded up so the range covers every row
+    start: datetime.datetime
+    end: datetime.datetime
+
+    @property
+    def format(self):
+        return 'parquet' if self.path.suffix == '.parquet' else 'jsonl'
+
+    def overlaps(self, since, until):
+        return (since is None or self.end >= since) and (until is None or self.start < until)
+
+
+def _stamp(value, round_up=False):
+    value = value.astimezone(datetime.timezone.utc)
+    if round_up and value.microsecond:
+        value += datetime.timedelta(seconds=1)
+    return value.strftime(STAMP_FORMAT)
+
+
+def _parse_stamp(value):
+    return datetime.datetime.strptime(value, STAMP_FORMAT).replace(tzinfo=datetime.timezone.utc)
+
+
+def list_segments(directory=None):
+    """Segments in ``directory``, oldest rows first; other files are ignored."""
+    directory = Path(directory or get_archive_dir())
+    if not directory.is_dir():
+        return []
+    segments = []
+    for path in directory.iterdir():
+        match = SEGMENT_RE.match(path.name)
+        if match:
+            segments.append(Segment(
+                path=path,
+                first_id=int(match['first_id']),
+                last_id=int(match['last_id']),
+                start=_parse_stamp(match['start']),
+                end=_parse_stamp(match['end']),
+            ))
+    return sorted(segments, key=lambda segment: segment.first_id)
+
+
+def _write_jsonl(path, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    with open(path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as out:
+            for row in rows:
+                row = dict(zip(HEADER, row))
+                # DjangoJSONEncoder would cut timestamps to milliseconds
+                row['timestamp'] = row['timestamp'].isoformat()
+                out.write((encoder.encode(row) + '\n').encode())
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _write_parquet(path, rows):
+    pa, pq = _pyarrow()
+    columns = list(zip(*rows))
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('user_id', pa.int64()),
+        ('user', pa.string()),
+        ('medicine_id', pa.int64()),
+        ('batch_number', pa.string()),
+        ('recognized', pa.bool_()),
+        ('scanned_data', pa.string()),
+    ])
+    table = pa.table(
+        [pa.array(values, type=schema.field(name).type) for name, values in zip(HEADER, columns)],
+        schema=schema,
+    )
+    pq.write_table(table, path, compression='zstd')
+    with open(path, 'rb') as written:
+        os.fsync(written.fileno())
+
+
+def write_segment(rows, directory, fmt):
+    """
+    Write ``rows`` (tuples in COLUMNS order, ascending id) to a new segment.
+
+    The file is written under a temporary name and renamed into place once
+    it is on disk, so a segment that exists is always complete.
+    """
+    timestamps = [row[1] for row in rows]
+    name = (
+        f"scanlogs-{rows[0][0]:012d}-{rows[-1][0]:012d}-"
+        f"{_stamp(min(timestamps))}-{_stamp(max(timestamps), round_up=True)}{EXTENSIONS[fmt]}"
+    )
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / name
+    partial = directory / f'.{name}.partial'
+    if fmt == 'parquet':
+        _write_parquet(partial, rows)
+    else:
+        _write_jsonl(partial, rows)
+    os.replace(partial, path)
+    return path
+
+
+@dataclass
+class ArchiveResult:
+    cutoff: datetime.datetime
+    rows: int = 0
+    segments: list = field(default_factory=list)
+    # Rows of an interrupted run's last segment deleted before starting
+    recovered: int = 0
+
+
+def _segment_rows(segment):
+    """``{id: timestamp}`` of every row in ``segment``."""
+    if segment.format == 'parquet':
+        _pa, pq = _pyarrow()
+        table = pq.read_table(segment.path, columns=['id', 'timestamp'])
+        return dict(zip(table.column('id').to_pylist(), table.column('timestamp').to_pylist()))
+    return {row['id']: row['timestamp'] for row in _read_jsonl(segment.path)}
+
+
+def _delete_rows(ids, delete_batch, pause):
+    from .models import ScanLog
+
+    deleted = 0
+    for start in range(0, len(ids), delete_batch):
+        with transaction.atomic():
+            deleted += ScanLog.objects.filter(pk__in=ids[start:start + delete_batch]).delete()[0]
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def _finish_interrupted_run(directory, delete_batch, pause):
+    """
+    Delete rows of the newest segment that are still in the table.
+
+    A run writes a segment only after the previous one's rows are gone, so
+    a crash can leave survivors of the newest segment alone. Archiving them
+    again would put their ids in two segments and audits would read them
+    twice. SQLite can hand the ids of deleted rows to new scans, so a row
+    only counts as a survivor if its timestamp matches the archived one.
+    """
+    from .models import ScanLog
+
+    segments = list_segments(directory)
+    if not segments:
+        return 0
+    archived = _segment_rows(segments[-1])
+    ids = list(archived)
+    survivors = []
+    for start in range(0, len(ids), delete_batch):
+        rows = ScanLog.objects.filter(
+            pk__in=ids[start:start + delete_batch], timestamp__lte=segments[-1].end,
+        ).values_list('pk', 'timestamp')
+        survivors.extend(pk for pk, timestamp in rows if timestamp == archived[pk])
+    return _delete_rows(survivors, delete_batch, pause)
+
+
+def archived_until(directory=None):
+    """
+    The last local day that may hold archived scans, or None.
+
+    ScanRollup rows for that day and earlier can't be rebuilt from the
+    ScanLog table, which has lost (some of) their scans.
+    """
+    segments = list_segments(directory)
+    if not segments:
+        return None
+    return timezone.localdate(max(segment.end for segment in segments))
+
+
+def archive_scanlogs(older_than, directory=None, fmt='auto', chunk_size=10000, delete_batch=1000,
+                     pause=0.0, dry_run=False):
+    """
+    Move scan logs older than ``older_than`` (a timedelta) into segment files.
+
+    Rows are read in primary key order, ``chunk_size`` at a time; each chunk
+    becomes one segment, and only once that file is safely on disk are its
+    rows deleted, ``delete_batch`` ids per transaction (sleeping ``pause``
+    seconds in between), so no write lock is held for long. An interrupted
+    run leaves every row either in the table or in a finished segment.
+    ScanRollup counters are kept, so scan analytics are unaffected, and
+    ``backfill_scan_rollups`` leaves the archived days alone. A run
+    first finishes the deletes of an interrupted one, so no scan ends up in
+    two segments.
+    """
+    from .models import ScanLog
+
+    fmt = resolve_format(fmt)
+    directory = Path(directory or get_archive_dir())
+    result = ArchiveResult(cutoff=timezone.now() - older_than)
+    old_rows = ScanLog.objects.filter(timestamp__lt=result.cutoff)
+    if dry_run:
+        result.rows = old_rows.count()
+        return result
+
+    result.recovered = _finish_interrupted_run(directory, delete_batch, pause)
+    lookups = [lookup for _name, lookup in COLUMNS]
+    last_pk = 0
+    while True:
+        rows = list(old_rows.filter(pk__gt=last_pk).order_by('pk').values_list(*lookups)[:chunk_size])
+        if not rows:
+            break
+        result.segments.append(write_segment(rows, directory, fmt))
+        ids = [row[0] for row in rows]
+        _delete_rows(ids, delete_batch, pause)
+        result.rows += len(rows)
+        last_pk = ids[-1]
+    return result
+
+
+def _read_jsonl(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            row = json.loads(line)
+            row['timestamp'] = parse_datetime(row['timestamp'])
+            yield row
+
+
+def _read_parquet(path, since, until):
+    pa, pq = _pyarrow()
+    filters = []
+    if since is not None:
+        filters.append(('timestamp', '>=', since))
+    if until is not None:
+        filters.append(('timestamp', '<', until))
+    table = pq.read_table(path, filters=filters or None)
+    yield from table.to_pylist()
+
+
+def iter_archived_scans(since=None, until=None, user=None, medicine=None, directory=None):
+    """
+    Yield archived scan logs as dicts with ``since <= timestamp < until``.
+
+    Segments whose time range lies outside the window are never opened;
+    ``user`` (username) and ``medicine`` (id) narrow the rows further.
+    Rows come in id order, one segment in memory at most.
+    """
+    for segment in list_segments(directory):
+        if not segment.overlaps(since, until):
+            continue
+        if segment.format == 'parquet':
+            rows = _read_parquet(segment.path, since, until)
+        else:
+            rows = _read_jsonl(segment.path)
+        for row in rows:
+            if since is not None and row['timestamp'] < since:
+                continue
+            if until is not None and row['timestamp'] >= until:
+                continue
+            if user is not None and row['user'] != user:
+                continue
+            if medicine is not None and row['medicine_id'] != medicine:
+                continue
+            yield row
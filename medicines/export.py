@@ -0,0 +1,252 @@
+# medicines/export.py
+import csv
+import datetime
+import zlib
+from dataclasses import dataclass
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Rows joined into one chunk of output; keeps per-chunk overhead low
+ROWS_PER_CHUNK = 500
+
+
+@dataclass(frozen=True)
+class Dataset:
+    model_name: str
+    # (header, values_list lookup) pairs, in output order
+    columns: tuple
+    ordering: str
+    # Field the since/until parameters filter on
+    date_field: str
+
+    @property
+    def header(self):
+        return [header for header, _lookup in self.columns]
+
+    def queryset(self):
+        from django.apps import apps
+
+        model = apps.get_model('medicines', self.model_name)
+        lookups = [lookup for _header, lookup in self.columns]
+        return model.objects.order_by(self.ordering).values_list(*lookups)
+
+
+DATASETS = {
+    'medicines': Dataset(
+        model_name='Medicine',
+        columns=(
+            ('id', 'id'), ('name', 'name'), ('generic_name', 'generic_name'),
+            ('manufacturer', 'manufacturer'), ('batch_number', 'batch_number'),
+            ('expiry_date', 'expiry_date'), ('price', 'price'), ('stock', 'stock'),
+            ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+        ),
+        ordering='pk',
+        date_field='updated_at',
+    ),
+    'scans': Dataset(
+        model_name='ScanLog',
+        columns=(
+            ('id', 'id'), ('timestamp', 'timestamp'), ('user', 'user__username'),
+            ('medicine_id', 'medicine_id'), ('recognized', 'recognized'),
+            ('scanned_data', 'scanned_data'),
+        ),
+        # Walks scanlog_timestamp_idx, with or without a date range
+        ordering='timestamp',
+        date_field='timestamp',
+    ),
+}
+
+
+def _parse_day(value, name):
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _parse_bool(value, name):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+def filter_rows(dataset_name, params):
+    """
+    Return the ordered ``values_list`` queryset for an export.
+
+    ``params`` maps filter names to strings, as they come from a query string
+    or the command line; unknown names are ignored and bad values raise
+    ValueError. ``since``/``until`` select whole days (``until`` inclusive)
+    on the dataset's date field.
+    """
+    dataset = DATASETS[dataset_name]
+    queryset = dataset.queryset()
+    lookups = {}
+
+    if params.get('since'):
+        lookups[f'{dataset.date_field}__gte'] = _parse_day(params['since'], 'since')
+    if params.get('until'):
+        until = _parse_day(params['until'], 'until') + datetime.timedelta(days=1)
+        lookups[f'{dataset.date_field}__lt'] = until
+
+    if dataset_name == 'medicines':
+        if params.get('manufacturer'):
+            lookups['manufacturer'] = params['manufacturer']
+        if params.get('expiry_from'):
+            lookups['expiry_date__gte'] = _parse_day(params['expiry_from'], 'expiry_from').date()
+        if params.get('expiry_to'):
+            lookups['expiry_date__lte'] = _parse_day(params['expiry_to'], 'expiry_to').date()
+    else:
+        if params.get('recognized'):
+            lookups['recognized'] = _parse_bool(params['recognized'], 'recognized')
+        if params.get('user'):
+            lookups['user__username'] = params['user']
+        if params.get('medicine'):
+            if not params['medicine'].isdigit():
+                raise ValueError("medicine must be a medicine id")
+            lookups['medicine_id'] = int(params['medicine'])
+
+    return queryset.filter(**lookups)
+
+
+class _Echo:
+    """A file-like object whose write() just returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _formatter(header, fmt):
+    """Return ``(preamble, format_row)``: the text before any row and a row-to-line function."""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        return writer.writerow(header), writer.writerow
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    return '', lambda row: encoder.encode(dict(zip(header, row))) + '\n'
+
+
+def iter_text(header, rows, fmt):
+    """Format ``rows`` as CSV or NDJSON, ROWS_PER_CHUNK lines per chunk."""
+    preamble, format_row = _formatter(header, fmt)
+    if preamble:
+        yield preamble
+    chunk = []
+    for row in rows:
+        chunk.append(format_row(row))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def aiter_rows(queryset, chunk_size):
+    """
+    Yield ``queryset``'s rows asynchronously, ``chunk_size`` per thread hop.
+
+    Like ``QuerySet.aiterator()``, but the database iterator is also created
+    in the worker thread: ``values_list()`` iterables run their query as soon
+    as they are iterated, which the async ORM would otherwise do in the event
+    loop. Every hop runs in the same thread, so a server-side cursor stays
+    usable between them.
+    """
+    rows = None
+
+    def next_chunk():
+        nonlocal rows
+        if rows is None:
+            rows = queryset.iterator(chunk_size=chunk_size)
+        return list(islice(rows, chunk_size))
+
+    while True:
+        chunk = await sync_to_async(next_chunk)()
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            break
+
+
+async def aiter_text(header, rows, fmt):
+    """``iter_text`` over an async iterator of rows."""
+    preamble, format_row = _formatter(header, fmt)
+    if preamble:
+        yield preamble
+    chunk = []
+    async for row in rows:
+        chunk.append(format_row(row))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _gzip_compressor():
+    return zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+
+def iter_gzip(chunks):
+    """Compress a stream of text chunks into a gzip stream as they arrive."""
+    compressor = _gzip_compressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiter_gzip(chunks):
+    compressor = _gzip_compressor()
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode()
+
+
+async def _aencode(chunks):
+    async for chunk in chunks:
+        yield chunk.encode()
+
+
+def stream_export(dataset_name, fmt, params, gzip=False, chunk_size=2000):
+    """
+    Return an iterator over the export's bytes, one chunk at a time.
+
+    Filters are validated up front (ValueError), before anything is sent.
+    Rows are read with ``values_list().iterator(chunk_size)``, so neither
+    model instances nor the full result set are ever held in memory; on
+    Postgres the rows come from a server-side cursor.
+    """
+    queryset = filter_rows(dataset_name, params)
+    header = DATASETS[dataset_name].header
+    chunks = iter_text(header, queryset.iterator(chunk_size=chunk_size), fmt)
+    return iter_gzip(chunks) if gzip else _encode(chunks)
+
+
+def astream_export(dataset_name, fmt, params, gzip=False, chunk_size=2000):
+    """
+    ``stream_export`` as an async iterator, for responses served over ASGI.
+
+    Django's ASGI handler reads a synchronous iterator to the end before
+    sending anything, so under ASGI the rows must come from an async
+    iterator (``aiter_rows``) for memory to stay flat.
+    """
+    queryset = filter_rows(dataset_name, params)
+    header = DATASETS[dataset_name].header
+    chunks = aiter_text(header, aiter_rows(queryset, chunk_size), fmt)
+    return aiter_gzip(chunks) if gzip else _aencode(chunks)
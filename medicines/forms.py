@@ -9,4 +9,41 @@ class MedicineForm(forms.ModelForm):
                   'expiry_date', 'price', 'stock', 'description']
         widgets = {
             'expiry_date': forms.DateInput(attrs={'type': 'date'}),
-        }
\ No newline at end of file
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            # Post back the values the form was rendered with, so changed_data
+            # holds what the user edited rather than what changed in the row
+            # (e.g. stock dispensed through the stock API) while it was open
+            for field in self.fields.values():
+                field.show_hidden_initial = True
+
+    def clean_stock(self):
+        stock = self.cleaned_data['stock']
+        if self.instance.pk is None or 'stock' not in self.changed_data:
+            return stock
+        name = self.add_initial_prefix('stock')
+        try:
+            shown = self.fields['stock'].to_python(self.data.get(name))
+        except forms.ValidationError:
+            shown = None
+        if shown != self.instance.stock:
+            # Show the current level next time, so saving again goes through
+            self.data = self.data.copy()
+            self.data[name] = self.instance.stock
+            raise forms.ValidationError(
+                "Stock changed to %(current)s while this form was open. "
+                "Check the new value and save again.",
+                code='stale', params={'current': self.instance.stock},
+            )
+        return stock
+
+
+class MedicineImportForm(MedicineForm):
+    """MedicineForm rules for bulk imports, where a known batch_number is an update."""
+
+    def validate_unique(self):
+        # Existing batch numbers are upserted by the importer, not rejected
+        pass
@@ -0,0 +1,146 @@
+# medicines/instrumentation.py
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger('medicines.slow_requests')
+
+# Bucket bounds for the per-request query count histogram
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# Statements kept per request for the slow request log
+MAX_RECORDED_QUERIES = 200
+
+
+@dataclass
+class RequestStats:
+    keep_sql: bool = False
+    queries: int = 0
+    sql_seconds: float = 0.0
+    statements: list = field(default_factory=list)
+    spans: dict = field(default_factory=dict)
+
+
+# Stats of the request being handled; contextvars follow the request into
+# the threads sync_to_async runs ORM calls in, where the connections live
+_current = contextvars.ContextVar('medicines_request_stats', default=None)
+
+
+def current_stats():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting queries and SQL time for the current
+    request. ``medicines.signals`` installs it on every new connection.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+        if stats.keep_sql and len(stats.statements) < MAX_RECORDED_QUERIES:
+            stats.statements.append((elapsed, sql))
+
+
+@contextmanager
+def span(name):
+    """
+    Time a block of work as ``name``.
+
+    Every span feeds the ``span.seconds`` histogram; inside a request it is
+    also added to that request's stats for the slow request log.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('span.seconds', elapsed, span=name)
+        stats = _current.get()
+        if stats is not None:
+            stats.spans[name] = stats.spans.get(name, 0.0) + elapsed
+
+
+def slow_request_threshold():
+    return getattr(settings, 'MEDICINE_SLOW_REQUEST_SECONDS', None)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record duration, query count and SQL time per URL name.
+
+    Feeds the ``http.request.seconds``, ``http.request.sql_seconds`` and
+    ``http.request.queries`` histograms and the ``http.requests`` counter,
+    all labelled by the resolved URL name so cardinality stays bounded.
+    Requests slower than ``MEDICINE_SLOW_REQUEST_SECONDS`` are logged with
+    their spans and slowest SQL statements. Works for sync and async views
+    without an extra thread hop. Place it first in MIDDLEWARE so session and
+    auth queries are counted too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    def start(self):
+        stats = RequestStats(keep_sql=slow_request_threshold() is not None)
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+
+        metrics.incr('http.requests', view=view, method=request.method, status=f'{response.status_code // 100}xx')
+        metrics.observe('http.request.seconds', elapsed, view=view)
+        metrics.observe('http.request.sql_seconds', stats.sql_seconds, view=view)
+        metrics.observe('http.request.queries', stats.queries, buckets=QUERY_COUNT_BUCKETS, view=view)
+
+        threshold = slow_request_threshold()
+        if threshold is not None and elapsed >= threshold:
+            slowest = sorted(stats.statements, key=lambda item: item[0], reverse=True)[:10]
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, spans %s\n%s",
+                request.method, request.path, view, elapsed * 1000, stats.queries,
+                stats.sql_seconds * 1000,
+                {name: round(seconds * 1000, 1) for name, seconds in stats.spans.items()},
+                '\n'.join(f'  {seconds * 1000:.1f} ms  {sql}' for seconds, sql in slowest),
+            )
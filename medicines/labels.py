@@ -0,0 +1,437 @@
+# medicines/labels.py
+import asyncio
+import atexit
+import multiprocessing
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .qr import build_payload, encode_modules, payload_hash
+
+FORMATS = ('pdf', 'png')
+CONTENT_TYPES = {'pdf': 'application/pdf', 'png': 'image/png'}
+
+# Encoded QR module matrices are cached under this prefix and the payload
+# hash, which covers qr.RENDER_VERSION; any label size scales from them
+QR_CACHE_PREFIX = 'medicines:qrmodules'
+
+
+@dataclass(frozen=True)
+class Paper:
+    width_mm: float
+    height_mm: float
+    columns: int
+    rows: int
+    margin_mm: float = 10.0
+    padding_mm: float = 2.0
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+
+PAPERS = {
+    # 24 labels of about 63 x 35 mm
+    'a4': Paper(210.0, 297.0, columns=3, rows=8),
+    # 24 labels of about 65 x 32 mm
+    'letter': Paper(215.9, 279.4, columns=3, rows=8),
+}
+
+
+def get_label_dpi():
+    return getattr(settings, 'MEDICINE_LABEL_DPI', 300)
+
+
+def get_label_workers():
+    return getattr(settings, 'MEDICINE_LABEL_WORKERS', None)
+
+
+def get_label_max_items():
+    return getattr(settings, 'MEDICINE_LABEL_MAX_ITEMS', 10000)
+
+
+def get_label_sync_max_items():
+    return getattr(settings, 'MEDICINE_LABEL_SYNC_MAX_ITEMS', 500)
+
+
+def get_label_qr_cache_ttl():
+    return getattr(settings, 'MEDICINE_LABEL_QR_CACHE_TTL', 86400)
+
+
+def select_medicines(params):
+    """
+    Return ``(pk, name, batch_number, expiry_date)`` rows to label, by id.
+
+    ``params`` takes the medicine filters of ``medicines.export.filter_rows``
+    plus ``ids`` (comma-separated) and ``reference``, which selects the
+    medicines received under that delivery reference in the stock ledger.
+    Bad values raise ValueError.
+    """
+    from .export import filter_rows
+    from .models import StockMovement
+
+    queryset = filter_rows('medicines', params)
+    if params.get('ids'):
+        ids = [value.strip() for value in params['ids'].split(',') if value.strip()]
+        if not all(value.isdigit() for value in ids):
+            raise ValueError("ids must be a comma-separated list of medicine ids")
+        queryset = queryset.filter(pk__in=[int(value) for value in ids])
+    if params.get('reference'):
+        queryset = queryset.filter(
+            pk__in=StockMovement.objects.filter(
+                kind=StockMovement.RECEIVE, reference=params['reference'],
+            ).values('medicine_id')
+        )
+    return queryset.values_list('pk', 'name', 'batch_number', 'expiry_date')
+
+
+def _px(mm, dpi):
+    return round(mm / 25.4 * dpi)
+
+
+def _geometry(paper, dpi):
+    """Return ``(width, height, margin, padding, cell_width, cell_height, qr_size)`` in pixels."""
+    width, height = _px(paper.width_mm, dpi), _px(paper.height_mm, dpi)
+    margin, padding = _px(paper.margin_mm, dpi), _px(paper.padding_mm, dpi)
+    cell_width = (width - 2 * margin) // paper.columns
+    cell_height = (height - 2 * margin) // paper.rows
+    # Leaves room for the text; modules stay well above 0.5 mm on either paper
+    return width, height, margin, padding, cell_width, cell_height, cell_height * 3 // 4
+
+
+@lru_cache(maxsize=8)
+def _font(size):
+    from PIL import ImageFont
+
+    return ImageFont.load_default(size=size)
+
+
+def _fit(draw, text, font, width):
+    """``text`` shortened with an ellipsis until it fits ``width`` pixels."""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    # Longest prefix that fits, by bisection: a few measurements, not one per character
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if draw.textlength(text[:middle] + '…', font=font) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + '…'
+
+
+def _wrap(draw, text, font, width, max_lines):
+    """Greedily break ``text`` into at most ``max_lines`` lines of ``width`` pixels."""
+    lines, words = [], text.split()
+    while words and len(lines) < max_lines - 1:
+        line = words.pop(0)
+        while words and draw.textlength(f"{line} {words[0]}", font=font) <= width:
+            line = f"{line} {words.pop(0)}"
+        lines.append(_fit(draw, line, font, width))
+    if words:
+        lines.append(_fit(draw, ' '.join(words), font, width))
+    return lines
+
+
+def render_page(job):
+    """
+    Compose one sheet of labels; runs in a worker process.
+
+    ``job`` is ``(paper, dpi, fmt, labels)`` with one ``(payload, name,
+    batch_number, expiry, modules)`` tuple per label, ``modules`` being the
+    cached ``qr.encode_modules`` result or None. Returns ``(page, encoded)``:
+    PNG bytes, or for PDF ``(width, height, deflated 1-bit rows)``, and
+    ``{payload: modules}`` for the QR codes that had to be encoded.
+    """
+    from PIL import Image, ImageDraw
+
+    paper, dpi, fmt, labels = job
+    width, height, margin, padding, cell_width, cell_height, qr_size = _geometry(paper, dpi)
+    text_x = padding + qr_size + padding
+    text_width = cell_width - text_x - padding
+    title_font, body_font = _font(max(cell_height // 9, 8)), _font(max(cell_height // 12, 8))
+
+    page = Image.new('1', (width, height), 1)
+    draw = ImageDraw.Draw(page)
+    encoded = {}
+    for index, (payload, name, batch_number, expiry, modules) in enumerate(labels):
+        left = margin + (index % paper.columns) * cell_width
+        top = margin + (index // paper.columns) * cell_height
+        if modules is None:
+            modules = encoded[payload] = encode_modules(payload)
+        count, data = modules
+        # Whole pixels per module keep the edges sharp
+        edge = count * max(1, qr_size // count)
+        qr = Image.frombytes('1', (count, count), data).resize((edge, edge), Image.Resampling.NEAREST)
+        page.paste(qr, (left + padding + (qr_size - edge) // 2, top + (cell_height - edge) // 2))
+
+        y = top + (cell_height - qr_size) // 2
+        for line in _wrap(draw, name, title_font, text_width, 2):
+            draw.text((left + text_x, y), line, font=title_font, fill=0)
+            y += title_font.size + padding // 2
+        y += padding
+        for line in (batch_number, f"EXP {expiry}"):
+            draw.text((left + text_x, y), _fit(draw, line, body_font, text_width), font=body_font, fill=0)
+            y += body_font.size + padding // 2
+
+    if fmt == 'pdf':
+        return (width, height, zlib.compress(page.tobytes(), 6)), encoded
+    buffer = BytesIO()
+    page.save(buffer, 'PNG', optimize=False, dpi=(dpi, dpi))
+    return buffer.getvalue(), encoded
+
+
+class PdfWriter:
+    """
+    Write a PDF of full-page 1-bit images one page at a time.
+
+    Pillow's PDF writer needs every page in memory before it writes any;
+    here each page's objects are emitted as soon as it is rendered and the
+    page tree, which only needs the page references, goes at the end.
+    """
+
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, dpi):
+        self.dpi = dpi
+        self.position = 0
+        self.offsets = {}
+        self.pages = []
+
+    def _emit(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        data = f"{number} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        data += b"\nendobj\n"
+        self.position += len(data)
+        return data
+
+    def header(self):
+        data = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.position += len(data)
+        return data
+
+    def page(self, width, height, deflated):
+        image = 3 + 3 * len(self.pages)
+        content, page = image + 1, image + 2
+        self.pages.append(page)
+        width_pt, height_pt = width * 72 / self.dpi, height * 72 / self.dpi
+        drawing = f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode()
+        return b''.join((
+            self._emit(image, (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode "
+                f"/Length {len(deflated)} >>"
+            ).encode(), deflated),
+            self._emit(content, f"<< /Length {len(drawing)} >>".encode(), drawing),
+            self._emit(page, (
+                f"<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+                f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {content} 0 R >>"
+            ).encode()),
+        ))
+
+    def trailer(self):
+        kids = ' '.join(f"{page} 0 R" for page in self.pages)
+        data = self._emit(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>".encode())
+        data += self._emit(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>".encode())
+        size = max(self.offsets) + 1
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        xref += [f"{self.offsets[number]:010d} 00000 n \n" for number in range(1, size)]
+        xref.append(f"trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\nstartxref\n{self.position}\n%%EOF\n")
+        return data + ''.join(xref).encode()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    The process pool shared by label requests in this process.
+
+    Workers are spawned, not forked, so they never inherit open database
+    connections or locks held by the web server's threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=get_label_workers(), mp_context=multiprocessing.get_context('spawn'),
+            )
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
+
+
+_modules_cache = None
+
+
+def get_modules_cache():
+    """
+    Process-local cache of QR module matrices, in front of Django's cache.
+
+    Created on first use, never in the workers, which read no settings.
+    """
+    global _modules_cache
+    if _modules_cache is None:
+        from .resolver import TTLCache
+
+        _modules_cache = TTLCache(
+            getattr(settings, 'MEDICINE_LABEL_QR_CACHE_SIZE', 20000), get_label_qr_cache_ttl(),
+        )
+    return _modules_cache
+
+
+def _qr_key(payload):
+    return f'{QR_CACHE_PREFIX}:{payload_hash(payload)[:32]}'
+
+
+def _jobs(rows, paper, dpi, fmt, copies, first_page, max_pages):
+    """One ``render_page`` job per sheet, with the QR codes already cached."""
+    from django.core.cache import cache
+
+    from .models import Medicine
+
+    local = get_modules_cache()
+
+    def job(labels):
+        keys = [_qr_key(label[0]) for label in labels]
+        found = {key: local.get(key) for key in keys}
+        missing = [key for key, modules in found.items() if modules is None]
+        if missing:
+            shared = cache.get_many(missing)
+            for key, modules in shared.items():
+                local.set(key, modules)
+            found.update(shared)
+        return paper, dpi, fmt, [(*label, found.get(key)) for label, key in zip(labels, keys)]
+
+    labels = []
+    page = 0
+    for pk, name, batch_number, expiry_date in rows:
+        payload = build_payload(Medicine(pk=pk, name=name, batch_number=batch_number))
+        for _ in range(copies):
+            labels.append((payload, name, batch_number, expiry_date.isoformat()))
+            if len(labels) < paper.per_page:
+                continue
+            page += 1
+            if page >= first_page:
+                yield job(labels)
+                if max_pages and page - first_page + 1 >= max_pages:
+                    return
+            labels = []
+    if labels and page + 1 >= first_page:
+        yield job(labels)
+
+
+def get_label_window(pool_workers=None):
+    """Sheets rendered ahead of the one being sent: two per worker."""
+    return 2 * (pool_workers or get_label_workers() or os.cpu_count() or 1)
+
+
+def _remember(encoded):
+    """Keep QR codes a worker had to encode, here and in Django's cache."""
+    from django.core.cache import cache
+
+    if not encoded:
+        return
+    local = get_modules_cache()
+    entries = {_qr_key(payload): modules for payload, modules in encoded.items()}
+    for key, modules in entries.items():
+        local.set(key, modules)
+    cache.set_many(entries, timeout=get_label_qr_cache_ttl())
+
+
+def iter_pages(rows, paper='a4', fmt='pdf', dpi=None, copies=1, first_page=1, max_pages=None, pool=None,
+               window=None):
+    """
+    Render label sheets for ``rows`` of ``(pk, name, batch_number, expiry_date)``.
+
+    ``copies`` labels are printed per medicine; ``first_page`` and
+    ``max_pages`` select a range of sheets without composing the others.
+    Pages are rendered in parallel on ``pool`` (the shared pool by default)
+    and yielded in order as they finish. At most ``window`` sheets are in
+    flight, so rows are read, and jobs built, only as fast as pages go out.
+    QR codes a worker had to encode are kept in this process and in
+    Django's cache, so a reprint only has to compose the sheets.
+    """
+    paper = PAPERS[paper]
+    pool = pool or get_pool()
+    window = window or get_label_window()
+    pending = deque()
+    for job in _jobs(rows, paper, dpi or get_label_dpi(), fmt, copies, first_page, max_pages):
+        pending.append(pool.submit(render_page, job))
+        if len(pending) >= window:
+            page, encoded = pending.popleft().result()
+            _remember(encoded)
+            yield page
+    while pending:
+        page, encoded = pending.popleft().result()
+        _remember(encoded)
+        yield page
+
+
+async def aiter_pages(rows, paper='a4', fmt='pdf', dpi=None, copies=1, pool=None, window=None):
+    """
+    ``iter_pages`` as an async iterator, for responses served over ASGI.
+
+    The event loop only awaits the workers; reading rows and the cache runs
+    in the ORM's thread, so no thread is held while sheets are composed.
+    """
+    paper = PAPERS[paper]
+    pool = pool or get_pool()
+    window = window or get_label_window()
+    jobs = _jobs(rows, paper, dpi or get_label_dpi(), fmt, copies, 1, None)
+    next_job = sync_to_async(lambda: next(jobs, None))
+    pending = deque()
+    while True:
+        while len(pending) < window:
+            job = await next_job()
+            if job is None:
+                break
+            pending.append(asyncio.wrap_future(pool.submit(render_page, job)))
+        if not pending:
+            return
+        page, encoded = await pending.popleft()
+        if encoded:
+            await sync_to_async(_remember)(encoded)
+        yield page
+
+
+def stream_labels(rows, paper='a4', fmt='pdf', dpi=None, copies=1, pool=None, window=None):
+    """
+    Return an iterator over the bytes of a label PDF, or of one PNG per page.
+
+    For PDF the document is written while the pages arrive, so the first
+    bytes go out as soon as the first sheet is done.
+    """
+    dpi = dpi or get_label_dpi()
+    pages = iter_pages(rows, paper, fmt, dpi, copies, pool=pool, window=window)
+    if fmt == 'png':
+        return pages
+
+    def pdf():
+        writer = PdfWriter(dpi)
+        yield writer.header()
+        for width, height, deflated in pages:
+            yield writer.page(width, height, deflated)
+        yield writer.trailer()
+    return pdf()
+
+
+async def astream_labels(rows, paper='a4', dpi=None, copies=1, pool=None, window=None):
+    """``stream_labels`` for PDF as an async iterator (see ``aiter_pages``)."""
+    dpi = dpi or get_label_dpi()
+    writer = PdfWriter(dpi)
+    yield writer.header()
+    async for width, height, deflated in aiter_pages(rows, paper, 'pdf', dpi, copies, pool=pool, window=window):
+        yield writer.page(width, height, deflated)
+    yield writer.trailer()
@@ -0,0 +1,54 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicines.archive import archive_scanlogs, get_archive_dir, get_retention_days
+
+
+class Command(BaseCommand):
+    help = (
+        "Move scan logs older than --older-than days into compressed segment files "
+        "(Parquet if pyarrow is installed, gzip JSONL otherwise) and delete them from "
+        "the database in small batches. Read them back with read_scan_archive. Scan "
+        "rollups are kept; backfill_scan_rollups can't rebuild archived days and skips them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=None, metavar='DAYS',
+            help="Archive scans older than this many days (default: MEDICINE_SCANLOG_RETENTION_DAYS)",
+        )
+        parser.add_argument('--directory', help="Segment directory (default: MEDICINE_SCANLOG_ARCHIVE_DIR)")
+        parser.add_argument('--format', choices=('auto', 'jsonl', 'parquet'), default='auto')
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Rows per segment file")
+        parser.add_argument('--delete-batch', type=int, default=1000, help="Rows deleted per transaction")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between delete batches")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows that would be archived")
+
+    def handle(self, *args, **options):
+        days = options['older_than'] if options['older_than'] is not None else get_retention_days()
+        if days < 1:
+            raise CommandError("--older-than must be at least 1 day")
+        try:
+            result = archive_scanlogs(
+                datetime.timedelta(days=days),
+                directory=options['directory'],
+                fmt=options['format'],
+                chunk_size=options['chunk_size'],
+                delete_batch=options['delete_batch'],
+                pause=options['pause'],
+                dry_run=options['dry_run'],
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        cutoff = result.cutoff.isoformat(timespec='seconds')
+        if options['dry_run']:
+            self.stdout.write(f"{result.rows} scans are older than {cutoff}.")
+            return
+        if result.recovered:
+            self.stdout.write(f"Deleted {result.recovered} already archived scans left by an interrupted run.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result.rows} scans older than {cutoff} into {len(result.segments)} "
+            f"segments in {options['directory'] or get_archive_dir()}."
+        ))
@@ -0,0 +1,72 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from medicines.archive import archived_until
+from medicines.models import ScanLog, ScanRollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild ScanRollup rows from the raw ScanLog table. Days that may hold archived "
+        "scans (see archive_scanlogs) are skipped, as their scans are no longer in the table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First day to rebuild (YYYY-MM-DD, default: all history)")
+        parser.add_argument('--until', help="Last day to rebuild (YYYY-MM-DD, default: today)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--archive-dir', help="Scan archive whose days are skipped (default: MEDICINE_SCANLOG_ARCHIVE_DIR)",
+        )
+
+    def parse_day(self, value, option):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"{option} must be a date in YYYY-MM-DD format")
+
+    def handle(self, *args, **options):
+        logs = ScanLog.objects.annotate(day=TruncDate('timestamp'))
+        rollups = ScanRollup.objects.all()
+        since = self.parse_day(options['since'], '--since') if options['since'] else None
+        until = self.parse_day(options['until'], '--until') if options['until'] else None
+        archived = archived_until(options['archive_dir'])
+        if archived is not None and (since is None or since <= archived):
+            since = archived + datetime.timedelta(days=1)
+            self.stdout.write(f"Scans up to {archived} are archived; rebuilding from {since} on.")
+            if until is not None and until < since:
+                self.stdout.write("Nothing to rebuild.")
+                return
+        if since:
+            logs = logs.filter(day__gte=since)
+            rollups = rollups.filter(day__gte=since)
+        if until:
+            logs = logs.filter(day__lte=until)
+            rollups = rollups.filter(day__lte=until)
+
+        groups = (
+            logs.values('day', 'medicine_id', 'recognized', 'user_id')
+            .annotate(count=Count('pk'))
+            .order_by()
+        )
+
+        created = 0
+        batch = []
+        with transaction.atomic():
+            deleted, _ = rollups.delete()
+            for group in groups.iterator(chunk_size=options['batch_size']):
+                batch.append(ScanRollup(**group))
+                if len(batch) >= options['batch_size']:
+                    ScanRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            ScanRollup.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Replaced {deleted} rollup rows with {created}."
+        ))
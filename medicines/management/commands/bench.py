@@ -0,0 +1,206 @@
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.test.runner import DiscoverRunner
+from django.urls import reverse
+from django.utils import timezone
+
+from medicines import synthetic
+from medicines.qr import build_payload, render
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with synthetic data, time the hot paths "
+        "through the test client and report p50/p95/p99 and query counts. "
+        "Results can be written as JSON and compared against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicines', type=int, default=5000)
+        parser.add_argument('--scans', type=int, default=20000)
+        parser.add_argument('--runs', type=int, default=50, help="Timed runs per case")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed runs per case")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cases', help="Comma-separated subset of cases to run")
+        parser.add_argument('--output', '-o', help="Write results to this JSON file")
+        parser.add_argument('--compare', help="JSON results of an earlier run to check for regressions")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help="Allowed relative p95 slowdown before a case counts as a regression",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            started = time.perf_counter()
+            medicines, users = synthetic.seed(
+                medicines=options['medicines'], scans=options['scans'], seed=options['seed'],
+            )
+            self.stdout.write(
+                f"Seeded {len(medicines)} medicines and {options['scans']} scans "
+                f"in {time.perf_counter() - started:.1f}s on {connection.vendor}."
+            )
+            cases = self.build_cases(medicines, users, random.Random(options['seed']))
+            if options['cases']:
+                wanted = {name.strip() for name in options['cases'].split(',')}
+                unknown = wanted - set(cases)
+                if unknown:
+                    raise CommandError(f"Unknown cases: {', '.join(sorted(unknown))}")
+                cases = {name: case for name, case in cases.items() if name in wanted}
+
+            results = {}
+            self.stdout.write(
+                f"{'case':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+            )
+            for name, case in cases.items():
+                results[name] = self.measure(case, options['warmup'], options['runs'])
+                self.stdout.write(
+                    f"{name:<22} {results[name]['p50_ms']:>8.2f} {results[name]['p95_ms']:>8.2f} "
+                    f"{results[name]['p99_ms']:>8.2f} {results[name]['queries']:>8}"
+                )
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        report = {'meta': self.meta(options), 'results': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+        if baseline is not None:
+            regressions = self.compare(baseline, report, options['tolerance'])
+            if regressions:
+                raise CommandError(f"{regressions} case(s) regressed against {options['compare']}")
+
+    def build_cases(self, medicines, users, rng):
+        """Return ``{name: callable}``; each call performs one request or operation."""
+        User = get_user_model()
+        admin = User.objects.create_superuser('bench-admin', 'bench-admin@example.com', None)
+        client = Client()
+        client.force_login(users[0])
+        admin_client = Client()
+        admin_client.force_login(admin)
+
+        medicine = rng.choice(medicines)
+        detail_url = reverse('medicine_detail', args=[medicine.pk])
+        etag = client.get(detail_url)['ETag']
+        first_page = client.get(reverse('medicine_list'))
+        cursor = first_page.context['page'].next_cursor if first_page.context else ''
+        misspelled = medicine.batch_number.replace('-', '')[:-1] + 'X'
+        editable = rng.choice(medicines)
+
+        def save_with_new_payload():
+            editable.name = f"{synthetic.STEMS[rng.randrange(len(synthetic.STEMS))]} {rng.randint(1, 999)}mg"
+            editable.save()
+
+        def post_scan(data):
+            return lambda: client.post(reverse('scan_medicine'), {'qr_data': data})
+
+        return {
+            'list': lambda: client.get(reverse('medicine_list')),
+            'list_next_page': lambda: client.get(reverse('medicine_list'), {'cursor': cursor}),
+            'list_search': lambda: client.get(reverse('medicine_list'), {'q': medicine.generic_name}),
+            'list_search_typo': lambda: client.get(reverse('medicine_list'), {'q': synthetic.typo(rng, medicine.name)}),
+            'detail': lambda: client.get(detail_url),
+            'detail_not_modified': lambda: client.get(detail_url, HTTP_IF_NONE_MATCH=etag),
+            'scan_qr': post_scan(build_payload(medicine)),
+            'scan_batch_number': post_scan(medicine.batch_number),
+            'scan_fuzzy': post_scan(misspelled),
+            'scan_miss': post_scan('ZZZZZZZZZZZZ'),
+            'medicine_save_qr': save_with_new_payload,
+            'qr_render_png': lambda: render(build_payload(medicine), 'png', rng.randint(100, 400)),
+            'admin_medicines': lambda: admin_client.get(reverse('admin:medicines_medicine_changelist')),
+            'admin_scanlogs': lambda: admin_client.get(reverse('admin:medicines_scanlog_changelist')),
+            'admin_scanrollups': lambda: admin_client.get(reverse('admin:medicines_scanrollup_changelist')),
+        }
+
+    def measure(self, case, warmup, runs):
+        for _ in range(warmup):
+            self.check_response(case())
+
+        timings = []
+        queries = []
+        for _ in range(runs):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                self.check_response(case())
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+
+        if len(timings) >= 2:
+            cuts = statistics.quantiles(timings, n=100, method='inclusive')
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = timings[0]
+        return {
+            'p50_ms': round(p50, 3),
+            'p95_ms': round(p95, 3),
+            'p99_ms': round(p99, 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'min_ms': round(min(timings), 3),
+            'queries': round(statistics.median(queries)),
+            'max_queries': max(queries),
+            'runs': runs,
+        }
+
+    def check_response(self, response):
+        status = getattr(response, 'status_code', None)
+        if status is not None and status >= 400:
+            raise CommandError(f"{response.request['PATH_INFO']} returned {status}")
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'cache': cache.__class__.__name__,
+            **{name: options[name] for name in ('medicines', 'scans', 'runs', 'warmup', 'seed')},
+        }
+
+    def compare(self, baseline, report, tolerance):
+        """Print the change against ``baseline`` per case; return the number of regressions."""
+        regressions = 0
+        self.stdout.write(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if before is None:
+                continue
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0
+            slower = change > tolerance
+            more_queries = result['queries'] > before['queries']
+            flag = ''
+            if slower or more_queries:
+                regressions += 1
+                flag = self.style.ERROR('  REGRESSION')
+            self.stdout.write(
+                f"{name:<22} p95 {before['p95_ms']:>8.2f} -> {result['p95_ms']:>8.2f} ({change:+.0%})  "
+                f"queries {before['queries']} -> {result['queries']}{flag}"
+            )
+        return regressions
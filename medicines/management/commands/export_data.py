@@ -0,0 +1,56 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicines.export import DATASETS, FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream a full CSV or NDJSON dump of medicines or scan history to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', '-o', default='-', help="File to write (default: stdout)")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output on the fly")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--since', help="First day (YYYY-MM-DD) by update time for medicines, scan time for scans")
+        parser.add_argument('--until', help="Last day (YYYY-MM-DD), inclusive")
+        parser.add_argument('--manufacturer', help="medicines: exact manufacturer")
+        parser.add_argument('--expiry-from', help="medicines: earliest expiry date (YYYY-MM-DD)")
+        parser.add_argument('--expiry-to', help="medicines: latest expiry date (YYYY-MM-DD)")
+        parser.add_argument('--recognized', help="scans: true or false")
+        parser.add_argument('--user', help="scans: username")
+        parser.add_argument('--medicine', help="scans: medicine id")
+
+    def handle(self, *args, **options):
+        params = {
+            name: options[name]
+            for name in ('since', 'until', 'manufacturer', 'expiry_from', 'expiry_to', 'recognized', 'user', 'medicine')
+            if options[name]
+        }
+        try:
+            content = stream_export(
+                options['dataset'], options['format'], params,
+                gzip=options['gzip'], chunk_size=options['chunk_size'],
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+        else:
+            output = open(options['output'], 'wb')
+        try:
+            written = 0
+            for chunk in content:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+            else:
+                output.flush()
+
+        if options['output'] != '-':
+            self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}."))
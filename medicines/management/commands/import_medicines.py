@@ -0,0 +1,222 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from medicines.forms import MedicineImportForm
+from medicines.models import Medicine, delete_qr_file, store_qr_files
+from medicines.ngram import index_medicines
+from medicines.qr import build_payload, payload_hash, qr_file_name, render_png
+from medicines.resolver import scan_resolver
+from medicines.search import search_index
+from medicines.stats import invalidate_inventory_stats
+from medicines.typeahead import typeahead_index
+
+# Columns overwritten when a batch_number already exists
+UPDATE_FIELDS = [
+    'name', 'generic_name', 'manufacturer', 'expiry_date',
+    'price', 'stock', 'description', 'updated_at',
+]
+
+
+def read_rows(path, fmt):
+    """Yield ``(line_number, row_dict)`` pairs without loading the whole file."""
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if fmt == 'csv':
+            reader = csv.DictReader(handle)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(handle, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield line_number, {'__error__': f'Invalid JSON: {exc}'}
+                    continue
+                if not isinstance(row, dict):
+                    row = {'__error__': 'Expected a JSON object'}
+                yield line_number, row
+
+
+class Command(BaseCommand):
+    help = "Import (upsert on batch_number) medicines from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row, or a JSONL file")
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help="Input format (default: guessed from the file extension)",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Processes used to render QR images (with MEDICINE_QR_STORE_FILES)",
+        )
+        parser.add_argument('--no-qr', action='store_true', help="Skip QR image rendering (QR hashes are still stored)")
+        parser.add_argument('--rejects', help="Write rejected rows and their errors to this JSONL file")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"File not found: {path}")
+        fmt = options['format'] or ('csv' if path.suffix.lower() == '.csv' else 'jsonl')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        rejects_file = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else None
+        executor = None
+        if not options['no_qr'] and store_qr_files() and options['workers'] > 1:
+            executor = ProcessPoolExecutor(max_workers=options['workers'])
+
+        started = time.monotonic()
+        imported = rejected = 0
+        batch = {}
+        try:
+            for line_number, row in read_rows(path, fmt):
+                medicine, errors = self.validate(row)
+                if errors:
+                    rejected += 1
+                    self.reject(rejects_file, line_number, row, errors)
+                    continue
+                # Later rows for the same batch_number win, like sequential saves
+                batch[medicine.batch_number] = medicine
+                if len(batch) >= batch_size:
+                    imported += self.flush(batch, executor, options['no_qr'])
+                    batch = {}
+                    self.progress(imported, rejected, started)
+            if batch:
+                imported += self.flush(batch, executor, options['no_qr'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if rejects_file is not None:
+                rejects_file.close()
+
+        invalidate_inventory_stats()
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} rows in {elapsed:.1f}s ({rate:.0f} rows/sec), rejected {rejected}."
+        ))
+
+    def validate(self, row):
+        if '__error__' in row:
+            return None, {'__all__': [row['__error__']]}
+        form = MedicineImportForm(data=row)
+        if not form.is_valid():
+            return None, form.errors.get_json_data()
+        return Medicine(**form.cleaned_data), None
+
+    def reject(self, rejects_file, line_number, row, errors):
+        if self.verbosity >= 2:
+            self.stderr.write(f"Line {line_number}: {json.dumps(errors)}")
+        if rejects_file is not None:
+            rejects_file.write(json.dumps({'line': line_number, 'row': row, 'errors': errors}) + '\n')
+
+    def progress(self, imported, rejected, started):
+        if self.verbosity >= 1:
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{imported} imported, {rejected} rejected ({imported / elapsed:.0f} rows/sec)"
+            )
+
+    def flush(self, batch, executor, skip_qr):
+        medicines = list(batch.values())
+        with transaction.atomic():
+            Medicine.objects.bulk_create(
+                medicines,
+                update_conflicts=True,
+                unique_fields=['batch_number'],
+                update_fields=UPDATE_FIELDS,
+            )
+            self.load_saved_state(medicines)
+            self.store_qr_hashes(medicines)
+            # bulk_create sends no post_save, so index the batch here
+            index_medicines(medicines)
+            transaction.on_commit(self.refresh_indexes)
+        # Images are rendered and stored after the upsert has committed, so
+        # the write lock isn't held for image encoding and media I/O
+        if not skip_qr:
+            self.render_qr_codes(medicines, executor)
+        return len(medicines)
+
+    def refresh_indexes(self):
+        # The in-process indexes follow the Medicine signals, which the
+        # upsert didn't send; they reload on their next lookup
+        search_index.clear()
+        typeahead_index.clear()
+        scan_resolver.clear()
+
+    def load_saved_state(self, medicines):
+        # Not every backend returns ids from an upsert, and updated rows need
+        # their current QR state anyway, so read both back in one query.
+        existing = {
+            batch_number: (pk, qr_code, qr_hash)
+            for batch_number, pk, qr_code, qr_hash in Medicine.objects.filter(
+                batch_number__in=[m.batch_number for m in medicines]
+            ).values_list('batch_number', 'pk', 'qr_code', 'qr_hash')
+        }
+        for medicine in medicines:
+            medicine.pk, medicine.qr_code, medicine.qr_hash = existing[medicine.batch_number]
+
+    def store_qr_hashes(self, medicines):
+        """
+        Point each row's QR version at its payload, rendered or not.
+
+        A stored image of an older payload is unlinked from its row and
+        deleted once no committed row points at it; ``render_qr_codes``
+        (or the next save) stores a new one.
+        """
+        changed = []
+        for medicine in medicines:
+            digest = payload_hash(build_payload(medicine))
+            if digest == medicine.qr_hash:
+                continue
+            if medicine.qr_code.name:
+                transaction.on_commit(partial(delete_qr_file, medicine.qr_code.name))
+                medicine.qr_code.name = ''
+            medicine.qr_hash = digest
+            changed.append(medicine)
+        Medicine.objects.bulk_update(changed, ['qr_code', 'qr_hash'])
+
+    def render_qr_codes(self, medicines, executor):
+        if not store_qr_files():
+            # Images are rendered on demand, the stored hash versions their URL
+            return
+        missing = [medicine for medicine in medicines if not medicine.qr_code]
+        if not missing:
+            return
+
+        payloads = [build_payload(medicine) for medicine in missing]
+        if executor is not None:
+            images = executor.map(render_png, payloads, chunksize=64)
+        else:
+            images = map(render_png, payloads)
+
+        storage = Medicine._meta.get_field('qr_code').storage
+        created = []
+        for medicine, png in zip(missing, images):
+            file_name = qr_file_name(medicine.qr_hash)
+            if not storage.exists(file_name):
+                file_name = storage.save(file_name, ContentFile(png))
+                created.append(file_name)
+            medicine.qr_code.name = file_name
+
+        try:
+            Medicine.objects.bulk_update(missing, ['qr_code'])
+        except Exception:
+            for name in created:
+                delete_qr_file(name)
+            raise
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from medicines.alerts import run_alerts
+
+
+class Command(BaseCommand):
+    help = (
+        "Raise and clear expiry and low-stock alerts. Only medicines changed since "
+        "the last run are read unless --full is given; schedule it e.g. every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Re-check every candidate medicine")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        run = run_alerts(full=options['full'], chunk_size=options['chunk_size'])
+        elapsed = (run.finished_at - run.started_at).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Full' if run.full else 'Incremental'} run: scanned {run.scanned} medicines, "
+            f"raised {run.raised} and cleared {run.cleared} alerts in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,132 @@
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.utils.crypto import get_random_string
+
+from medicines.models import Medicine
+from medicines.qr import build_payload
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare latency percentiles of running servers at a fixed concurrency, "
+        "e.g. the WSGI app under gunicorn against the ASGI app under uvicorn:\n"
+        "  gunicorn medicine_shop.wsgi -w 4 -b :8000\n"
+        "  uvicorn medicine_shop.asgi:application --workers 4 --port 8001\n"
+        "  manage.py loadtest --user admin wsgi=http://127.0.0.1:8000 asgi=http://127.0.0.1:8001"
+    )
+
+    ENDPOINTS = ('list', 'search', 'detail', 'scan')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'targets', nargs='+', metavar='NAME=URL',
+            help="Servers to compare, all sharing this project's database",
+        )
+        parser.add_argument('--user', required=True, help="Username to send requests as")
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and target")
+        parser.add_argument('--endpoints', default=','.join(self.ENDPOINTS))
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f"Expected NAME=URL, got {target!r}")
+            targets.append((name, url.rstrip('/')))
+
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(self.ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {options['user']!r}")
+        medicine = Medicine.objects.order_by('pk').first()
+        if medicine is None:
+            raise CommandError("The database has no medicines to request")
+
+        # Both servers read the same session table, so one login serves all
+        client = Client()
+        client.force_login(user)
+        csrf_token = get_random_string(32)
+        self.headers = {
+            'Cookie': (
+                f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+                f"{settings.CSRF_COOKIE_NAME}={csrf_token}"
+            ),
+            'X-CSRFToken': csrf_token,
+        }
+        self.timeout = options['timeout']
+
+        requests = {
+            'list': ('GET', '/', None),
+            'search': ('GET', '/?' + urllib.parse.urlencode({'q': medicine.name}), None),
+            'detail': ('GET', f'/medicine/{medicine.pk}/', None),
+            'scan': ('POST', '/scan/', urllib.parse.urlencode({'qr_data': build_payload(medicine)}).encode()),
+        }
+
+        self.stdout.write(
+            f"{'target':<10} {'endpoint':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'req/s':>8} {'errors':>7}"
+        )
+        for name, base_url in targets:
+            for endpoint in endpoints:
+                method, path, body = requests[endpoint]
+                result = self.run(base_url + path, method, body, options['concurrency'], options['requests'])
+                self.stdout.write(
+                    f"{name:<10} {endpoint:<8} {result['p50']:>8.1f} {result['p95']:>8.1f} "
+                    f"{result['p99']:>8.1f} {result['rps']:>8.0f} {result['errors']:>7}"
+                )
+
+    def fetch(self, url, method, body):
+        request = urllib.request.Request(url, data=body, method=method, headers=self.headers)
+        if body is not None:
+            request.add_header('Content-Type', 'application/x-www-form-urlencoded')
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                ok = response.status < 400
+        except urllib.error.HTTPError as error:
+            # The scan redirect is a 302; urllib follows it with a GET
+            ok = error.code < 400
+        except OSError:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    def run(self, url, method, body, concurrency, total):
+        # Warm up connections, caches and the search index before measuring
+        for _ in range(min(concurrency, total)):
+            self.fetch(url, method, body)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: self.fetch(url, method, body), range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(seconds * 1000 for seconds, ok in results if ok)
+        if len(latencies) >= 2:
+            cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = latencies[0] if latencies else float('nan')
+        return {
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'rps': total / elapsed,
+            'errors': sum(not ok for _seconds, ok in results),
+        }
@@ -0,0 +1,74 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicines.labels import FORMATS, PAPERS, get_label_window, iter_pages, select_medicines, stream_labels
+
+
+class Command(BaseCommand):
+    help = (
+        "Compose printable QR label sheets (PDF, or one PNG per sheet) for a selection "
+        "of medicines, e.g. a received shipment, across a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', required=True, help="PDF file, or prefix of the PNG files")
+        parser.add_argument('--format', choices=FORMATS, default='pdf')
+        parser.add_argument('--paper', choices=sorted(PAPERS), default='a4')
+        parser.add_argument('--dpi', type=int, default=None, help="Default: MEDICINE_LABEL_DPI")
+        parser.add_argument('--copies', type=int, default=1, help="Labels per medicine")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+        parser.add_argument('--ids', help="Comma-separated medicine ids")
+        parser.add_argument('--reference', help="Medicines received under this stock ledger reference")
+        parser.add_argument('--manufacturer', help="Exact manufacturer")
+        parser.add_argument('--expiry-from', help="Earliest expiry date (YYYY-MM-DD)")
+        parser.add_argument('--expiry-to', help="Latest expiry date (YYYY-MM-DD)")
+        parser.add_argument('--since', help="First day (YYYY-MM-DD) the medicine was updated")
+        parser.add_argument('--until', help="Last day (YYYY-MM-DD), inclusive")
+
+    def handle(self, *args, **options):
+        if options['copies'] < 1:
+            raise CommandError("--copies must be at least 1")
+        params = {
+            name: options[name]
+            for name in ('ids', 'reference', 'manufacturer', 'expiry_from', 'expiry_to', 'since', 'until')
+            if options[name]
+        }
+        try:
+            rows = select_medicines(params)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        started = time.perf_counter()
+        pool = ProcessPoolExecutor(
+            max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'),
+        )
+        window = get_label_window(options['workers'])
+        with pool:
+            rows = rows.iterator(chunk_size=2000)
+            if options['format'] == 'pdf':
+                written = pages = 0
+                with open(options['output'], 'wb') as output:
+                    for chunk in stream_labels(
+                        rows, options['paper'], 'pdf', options['dpi'], options['copies'], pool=pool, window=window,
+                    ):
+                        output.write(chunk)
+                        written += len(chunk)
+                        pages += 1
+                # Header and trailer chunks aside, every chunk is a sheet
+                pages = max(pages - 2, 0)
+                target = f"{options['output']} ({written} bytes)"
+            else:
+                pages = 0
+                for pages, sheet in enumerate(iter_pages(
+                    rows, options['paper'], 'png', options['dpi'], options['copies'], pool=pool, window=window,
+                ), start=1):
+                    with open(f"{options['output']}-{pages:03d}.png", 'wb') as output:
+                        output.write(sheet)
+                target = f"{options['output']}-*.png"
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {pages} label sheets to {target} in {time.perf_counter() - started:.2f}s."
+        ))
@@ -0,0 +1,46 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from medicines.archive import HEADER, iter_archived_scans
+from medicines.export import FORMATS, iter_text
+
+
+def _parse_day(value, name):
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"--{name} must be a date in YYYY-MM-DD format")
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+class Command(BaseCommand):
+    help = (
+        "Print archived scan logs for a date range as CSV or NDJSON, for audits. "
+        "Only segments overlapping the range are opened."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First day (YYYY-MM-DD)")
+        parser.add_argument('--until', help="Last day (YYYY-MM-DD), inclusive")
+        parser.add_argument('--user', help="Only scans by this username")
+        parser.add_argument('--medicine', type=int, help="Only scans of this medicine id")
+        parser.add_argument('--directory', help="Segment directory (default: MEDICINE_SCANLOG_ARCHIVE_DIR)")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+
+    def handle(self, *args, **options):
+        since = _parse_day(options['since'], 'since') if options['since'] else None
+        until = None
+        if options['until']:
+            until = _parse_day(options['until'], 'until') + datetime.timedelta(days=1)
+
+        scans = iter_archived_scans(
+            since=since, until=until, user=options['user'], medicine=options['medicine'],
+            directory=options['directory'],
+        )
+        rows = ([scan[name] for name in HEADER] for scan in scans)
+        chunks = iter_text(HEADER, rows, options['format'])
+        for chunk in chunks:
+            self.stdout.write(chunk, ending='')
+        self.stdout.flush()
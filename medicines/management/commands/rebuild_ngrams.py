@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from medicines.models import Medicine, MedicineNgram
+from medicines.ngram import NGRAM_FIELDS, index_medicines
+
+
+class Command(BaseCommand):
+    help = "Rebuild the trigram index used for fuzzy batch number and name suggestions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        MedicineNgram.objects.all().delete()
+        batch = []
+        total = 0
+        for medicine in Medicine.objects.only(*NGRAM_FIELDS).iterator(chunk_size=options['batch_size']):
+            batch.append(medicine)
+            if len(batch) >= options['batch_size']:
+                index_medicines(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            index_medicines(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {total} medicines ({MedicineNgram.objects.count()} trigrams)."
+        ))
@@ -0,0 +1,135 @@
+# medicines/metrics.py
+import bisect
+import re
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+_gauges = {}
+_histograms = {}
+
+# Upper bounds in seconds, suitable for request and span latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, value=1, **labels):
+    """Increment the process-local counter ``name`` for the given labels."""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    """Record the current value of something that goes up and down."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Add ``value`` to the histogram ``name``; ``buckets`` only counts on first use."""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        if histogram is None:
+            histogram = _histograms[_key(name, labels)] = {
+                'buckets': tuple(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+            }
+        index = bisect.bisect_left(histogram['buckets'], value)
+        if index < len(histogram['counts']):
+            histogram['counts'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def get_counter(name, **labels):
+    with _lock:
+        return _counters[_key(name, labels)]
+
+
+def get_gauge(name, **labels):
+    with _lock:
+        return _gauges.get(_key(name, labels))
+
+
+def counters():
+    """Return a ``{(name, labels): value}`` snapshot of every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def gauges():
+    with _lock:
+        return dict(_gauges)
+
+
+def get_histogram(name, **labels):
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        return None if histogram is None else dict(histogram, counts=list(histogram['counts']))
+
+
+def histograms():
+    with _lock:
+        return {key: dict(value, counts=list(value['counts'])) for key, value in _histograms.items()}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _metric_name(name):
+    return 'medicines_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    Return every metric in the Prometheus text exposition format.
+
+    Metric names get a ``medicines_`` prefix and dots become underscores;
+    counters end in ``_total``. Values are per process, so scrape each
+    worker or run a single one per target.
+    """
+    lines = []
+
+    def family(samples, metric_type, suffix=''):
+        for name in sorted({name for name, _labels in samples}):
+            metric = _metric_name(name) + suffix
+            lines.append(f'# TYPE {metric} {metric_type}')
+            for (sample_name, labels), value in sorted(samples.items()):
+                if sample_name == name:
+                    yield metric, labels, value
+
+    for metric, labels, value in family(counters(), 'counter', '_total'):
+        lines.append(f'{metric}{_format_labels(labels)} {_format_value(value)}')
+    for metric, labels, value in family(gauges(), 'gauge'):
+        lines.append(f'{metric}{_format_labels(labels)} {_format_value(value)}')
+    for metric, labels, histogram in family(histograms(), 'histogram'):
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            bucket_labels = labels + (('le', _format_value(float(bound))),)
+            lines.append(f'{metric}_bucket{_format_labels(bucket_labels)} {cumulative}')
+        lines.append(f'{metric}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+        lines.append(f'{metric}_sum{_format_labels(labels)} {_format_value(histogram["sum"])}')
+        lines.append(f'{metric}_count{_format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="medicine",
+            name="qr_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
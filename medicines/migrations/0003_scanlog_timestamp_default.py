@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 13:59
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0002_medicine_qr_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="scanlog",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
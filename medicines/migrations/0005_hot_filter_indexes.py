@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-18 14:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0004_scanrollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="medicine",
+            index=models.Index(
+                fields=["created_at", "id"], name="medicine_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="medicine",
+            index=models.Index(fields=["expiry_date"], name="medicine_expiry_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="medicine",
+            index=models.Index(fields=["stock"], name="medicine_stock_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="medicine",
+            index=models.Index(
+                fields=["manufacturer"], name="medicine_manufacturer_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="scanlog",
+            index=models.Index(fields=["timestamp"], name="scanlog_timestamp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="scanlog",
+            index=models.Index(
+                condition=models.Q(("recognized", False)),
+                fields=["timestamp"],
+                name="scanlog_unrecognized_ts_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 6.0 on 2026-10-18 14:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of medicines.ngram.NGRAM_FIELDS/extract_grams, so later
+# changes to the live trigram extraction don't change this migration
+NGRAM_FIELDS = ("batch_number", "name")
+
+
+def extract_grams(*values):
+    grams = set()
+    for value in values:
+        # RapidFuzz's default_process: lowercase, punctuation to spaces
+        text = "".join(
+            char if char.isalnum() else " " for char in (value or "")
+        ).lower()
+        for word in text.split():
+            padded = f"  {word} "
+            grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def build_ngrams(apps, schema_editor):
+    Medicine = apps.get_model("medicines", "Medicine")
+    MedicineNgram = apps.get_model("medicines", "MedicineNgram")
+    rows = []
+    for pk, *values in Medicine.objects.values_list("pk", *NGRAM_FIELDS).iterator():
+        rows.extend(
+            MedicineNgram(medicine_id=pk, gram=gram) for gram in extract_grams(*values)
+        )
+        if len(rows) >= 5000:
+            MedicineNgram.objects.bulk_create(rows)
+            rows = []
+    MedicineNgram.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0005_hot_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MedicineNgram",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("gram", models.CharField(max_length=3)),
+                (
+                    "medicine",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ngrams",
+                        to="medicines.medicine",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("gram", "medicine"), name="unique_medicine_ngram"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_ngrams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 6.0 on 2026-10-18 14:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0006_medicinengram"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InventoryAlert",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("expired", "Expired"),
+                            ("expiring", "Expiring soon"),
+                            ("low_stock", "Below reorder level"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "window_days",
+                    models.PositiveSmallIntegerField(blank=True, null=True),
+                ),
+                ("expiry_date", models.DateField()),
+                ("stock", models.PositiveIntegerField()),
+                ("raised_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="InventoryAlertRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("finished_at", models.DateTimeField()),
+                ("full", models.BooleanField(default=False)),
+                ("threshold", models.PositiveIntegerField()),
+                ("windows", models.CharField(max_length=100)),
+                ("scanned", models.PositiveIntegerField(default=0)),
+                ("raised", models.PositiveIntegerField(default=0)),
+                ("cleared", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "get_latest_by": "started_at",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="medicine",
+            index=models.Index(fields=["updated_at"], name="medicine_updated_idx"),
+        ),
+        migrations.AddField(
+            model_name="inventoryalert",
+            name="medicine",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="alerts",
+                to="medicines.medicine",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inventoryalert",
+            index=models.Index(
+                fields=["kind", "expiry_date"], name="alert_kind_expiry_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="inventoryalert",
+            constraint=models.UniqueConstraint(
+                fields=("medicine", "kind"), name="unique_inventory_alert"
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-18 16:05
+
+import hashlib
+from urllib.parse import quote
+
+from django.db import migrations
+
+# Frozen copies of medicines.qr.build_payload/payload_hash as of
+# RENDER_VERSION 1, so later changes there don't change this migration
+RENDER_VERSION = 1
+BATCH_SIZE = 1000
+
+
+def build_payload(pk, name, batch_number):
+    return f"MED2:{pk}:{quote(batch_number, safe='')}:{quote(name, safe='')}"
+
+
+def payload_hash(payload):
+    return hashlib.sha256(f"{RENDER_VERSION}:{payload}".encode()).hexdigest()
+
+
+def backfill_qr_hash(apps, schema_editor):
+    # Rows saved before 0002 have no hash, so the detail card and admin show
+    # no QR code for them; the images themselves are rendered on demand
+    Medicine = apps.get_model("medicines", "Medicine")
+    rows = Medicine.objects.filter(qr_hash="").only("pk", "name", "batch_number")
+    batch = []
+    for medicine in rows.iterator(chunk_size=BATCH_SIZE):
+        medicine.qr_hash = payload_hash(
+            build_payload(medicine.pk, medicine.name, medicine.batch_number)
+        )
+        batch.append(medicine)
+        if len(batch) == BATCH_SIZE:
+            Medicine.objects.bulk_update(batch, ["qr_hash"])
+            batch = []
+    if batch:
+        Medicine.objects.bulk_update(batch, ["qr_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0008_stock_movements"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_qr_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 16:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    # Fold rows the old constraint let through into one per key, so the new
+    # constraint can be created
+    ScanRollup = apps.get_model("medicines", "ScanRollup")
+    duplicates = (
+        ScanRollup.objects.filter(medicine__isnull=True)
+        .values("day", "recognized", "user")
+        .annotate(rows=Count("pk"), keep=Min("pk"), total=Sum("count"))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        rows = ScanRollup.objects.filter(
+            medicine__isnull=True,
+            day=group["day"],
+            recognized=group["recognized"],
+            user=group["user"],
+        )
+        rows.exclude(pk=group["keep"]).delete()
+        rows.filter(pk=group["keep"]).update(count=group["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicines", "0009_backfill_qr_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="scanrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("medicine__isnull", True)),
+                fields=("day", "recognized", "user"),
+                name="unique_scan_rollup_no_medicine",
+            ),
+        ),
+    ]
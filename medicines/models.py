@@ -1,12 +1,22 @@
 # medicines/models.py
 from django.db import models
-import qrcode
-from io import BytesIO
-from django.core.files import File
-from PIL import Image
+from django.core.files.base import ContentFile
 from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
 from django.utils.encoding import force_str
 
+from .instrumentation import span
+from .qr import build_payload, payload_hash, qr_file_name, render_png
+
+# Fields that end up in the QR payload; saves that don't touch them skip QR work
+QR_PAYLOAD_FIELDS = {'name', 'batch_number'}
+
+
+def store_qr_files():
+    return getattr(settings, 'MEDICINE_QR_STORE_FILES', False)
+
+
 class Medicine(models.Model):
     name = models.CharField(max_length=255)
     generic_name = models.CharField(max_length=255, blank=True)
@@ -17,37 +27,230 @@ class Medicine(models.Model):
     stock = models.PositiveIntegerField(default=0)
     description = models.TextField(blank=True)
     qr_code = models.ImageField(upload_to='qr_codes/', blank=True)
+    qr_hash = models.CharField(max_length=64, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the medicine list, newest first
+            models.Index(fields=['created_at', 'id'], name='medicine_created_id_idx'),
+            models.Index(fields=['expiry_date'], name='medicine_expiry_idx'),
+            models.Index(fields=['stock'], name='medicine_stock_idx'),
+            models.Index(fields=['manufacturer'], name='medicine_manufacturer_idx'),
+            # Incremental inventory alert runs (see medicines.alerts)
+            models.Index(fields=['updated_at'], name='medicine_updated_idx'),
+        ]
+
     def __str__(self):
         return force_str(f"Medicine #{self.pk} - {self.name}")
 
     def save(self, *args, **kwargs):
-        # Important: This is the data format your scan view will parse
-        qr_data = f"MED-{self.id}-{self.name}-{self.batch_number}"
-        
-        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        buffer = BytesIO()
-        img.save(buffer, 'PNG')
-        buffer.seek(0)
-
-        file_name = f'qr_{self.batch_number}.png'
-        self.qr_code.save(file_name, File(buffer), save=False)
-        
         super().save(*args, **kwargs)
 
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or QR_PAYLOAD_FIELDS.intersection(update_fields):
+            self.update_qr_code()
+
+    @span('qr_update')
+    def update_qr_code(self):
+        """
+        Refresh the QR hash (and stored image) if the payload changed.
+
+        Runs after the row is saved so the payload carries the real primary
+        key. QR images are normally rendered on demand by the ``medicine_qr``
+        view and ``qr_hash`` only versions their URL; with
+        ``MEDICINE_QR_STORE_FILES`` enabled a PNG is also written to media,
+        named after the payload hash so identical payloads share one file.
+        An unchanged payload costs no image encoding or media I/O at all.
+        Returns True if anything was updated.
+        """
+        payload = build_payload(self)
+        digest = payload_hash(payload)
+        store_files = store_qr_files()
+        if digest == self.qr_hash and (self.qr_code or not store_files):
+            return False
+
+        file_name = ''
+        if store_files:
+            storage = self.qr_code.storage
+            file_name = qr_file_name(digest)
+            if not storage.exists(file_name):
+                file_name = storage.save(file_name, ContentFile(render_png(payload)))
+
+        old_name = self.qr_code.name
+        self.qr_code.name = file_name
+        self.qr_hash = digest
+        # Not a second save(): no signals, no auto_now bump, no recursion
+        Medicine.objects.filter(pk=self.pk).update(qr_code=file_name, qr_hash=digest)
+
+        if old_name and old_name != file_name:
+            delete_qr_file(old_name)
+        return True
+
+    def get_qr_url(self, fmt='png', size=None):
+        """Versioned URL of the on-demand QR image, safe to cache forever."""
+        url = reverse('medicine_qr', kwargs={'pk': self.pk, 'fmt': fmt})
+        url += f'?v={self.qr_hash[:16]}'
+        if size:
+            url += f'&size={size}'
+        return url
+
+    @property
+    def qr_url(self):
+        return self.get_qr_url()
+
+
+def delete_qr_file(name):
+    """Remove a QR image from storage unless another medicine still uses it."""
+    if not Medicine.objects.filter(qr_code=name).exists():
+        Medicine._meta.get_field('qr_code').storage.delete(name)
+
+
+class MedicineNgram(models.Model):
+    """One trigram of a medicine's batch number or name (see medicines.ngram)."""
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='ngrams')
+    gram = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            # Leading on gram so candidate lookups read only the index
+            models.UniqueConstraint(fields=['gram', 'medicine'], name='unique_medicine_ngram'),
+        ]
+
+    def __str__(self):
+        return f"{self.gram!r} -> {self.medicine_id}"
+
+
 class ScanLog(models.Model):
     scanned_data = models.TextField()
     recognized = models.BooleanField(default=False)
     medicine = models.ForeignKey(Medicine, on_delete=models.SET_NULL, null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the scan happens, not when a buffered row is finally written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='scanlog_timestamp_idx'),
+            # Unrecognized scans are the rare rows the admin filter looks for
+            models.Index(
+                fields=['timestamp'], condition=models.Q(recognized=False),
+                name='scanlog_unrecognized_ts_idx',
+            ),
+        ]
+
+    def __str__(self):
+        status = "Recognized" if self.recognized else "Unrecognized"
+        # Only use the username if it was already loaded, never query for it
+        if ScanLog.user.is_cached(self):
+            return f"Scan by {self.user.username} - {status} - {self.timestamp}"
+        return f"Scan by user #{self.user_id} - {status} - {self.timestamp}"
+
+
+class ScanRollup(models.Model):
+    """Scan counts per (day, medicine, recognized, user), kept in step with ScanLog."""
+    day = models.DateField()
+    medicine = models.ForeignKey(Medicine, on_delete=models.SET_NULL, null=True, blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    recognized = models.BooleanField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'medicine', 'recognized', 'user'], name='unique_scan_rollup',
+            ),
+            # NULLs are distinct in the constraint above, so unrecognized scans
+            # (and scans of deleted medicines) need their own. A partial index
+            # works on SQLite too, which ignores nulls_distinct=False.
+            models.UniqueConstraint(
+                fields=['day', 'recognized', 'user'], condition=models.Q(medicine__isnull=True),
+                name='unique_scan_rollup_no_medicine',
+            ),
+        ]
 
     def __str__(self):
         status = "Recognized" if self.recognized else "Unrecognized"
-        return f"Scan by {self.user.username} - {status} - {self.timestamp}"
\ No newline at end of file
+        return f"{self.day} - {status} - {self.count} scans"
+
+
+class InventoryAlert(models.Model):
+    """An open expiry or stock alert for a medicine (see medicines.alerts)."""
+    EXPIRED = 'expired'
+    EXPIRING = 'expiring'
+    LOW_STOCK = 'low_stock'
+    KIND_CHOICES = [
+        (EXPIRED, 'Expired'),
+        (EXPIRING, 'Expiring soon'),
+        (LOW_STOCK, 'Below reorder level'),
+    ]
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='alerts')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Smallest expiry window (in days) the batch falls into, for EXPIRING
+    window_days = models.PositiveSmallIntegerField(null=True, blank=True)
+    # The values that raised the alert, as of the last run
+    expiry_date = models.DateField()
+    stock = models.PositiveIntegerField()
+    raised_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'kind'], name='unique_inventory_alert'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'expiry_date'], name='alert_kind_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} - {self.medicine_id}"
+
+
+class InventoryAlertRun(models.Model):
+    """One run of the alert engine; the latest one holds the watermark."""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    full = models.BooleanField(default=False)
+    # Settings the run used; a change forces the next run to be full
+    threshold = models.PositiveIntegerField()
+    windows = models.CharField(max_length=100)
+    scanned = models.PositiveIntegerField(default=0)
+    raised = models.PositiveIntegerField(default=0)
+    cleared = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        get_latest_by = 'started_at'
+
+    def __str__(self):
+        return f"Alert run {self.started_at:%Y-%m-%d %H:%M} ({self.scanned} scanned)"
+
+
+class StockMovement(models.Model):
+    """One line of the stock ledger, written by medicines.stock."""
+    DISPENSE = 'dispense'
+    RECEIVE = 'receive'
+    KIND_CHOICES = [
+        (DISPENSE, 'Dispensed'),
+        (RECEIVE, 'Received'),
+    ]
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.SET_NULL, null=True, related_name='movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.PositiveIntegerField()
+    # Stock of the medicine right after this movement was applied
+    stock_after = models.PositiveIntegerField()
+    # Prescription, invoice or delivery note the movement belongs to
+    reference = models.CharField(max_length=100, blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['medicine', 'timestamp'], name='movement_medicine_time_idx'),
+            models.Index(fields=['timestamp'], name='movement_timestamp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity} of medicine #{self.medicine_id}"
@@ -0,0 +1,117 @@
+# medicines/ngram.py
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .instrumentation import span
+
+# Fields whose trigrams are stored in MedicineNgram
+NGRAM_FIELDS = ('batch_number', 'name')
+
+
+def extract_grams(*values):
+    """
+    Return the set of trigrams for ``values``, pg_trgm style.
+
+    Text is lowercased, punctuation becomes word breaks and every word is
+    padded with two leading and one trailing space, so short codes and word
+    starts still produce grams.
+    """
+    # RapidFuzz is imported where it is used, so django.setup() doesn't load it
+    from rapidfuzz import utils
+
+    grams = set()
+    for value in values:
+        for word in utils.default_process(value or '').split():
+            padded = f'  {word} '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def index_medicines(medicines):
+    """(Re)build the trigram rows for the given saved medicines."""
+    from .models import MedicineNgram
+
+    rows = [
+        MedicineNgram(medicine_id=medicine.pk, gram=gram)
+        for medicine in medicines
+        for gram in extract_grams(*(getattr(medicine, field) for field in NGRAM_FIELDS))
+    ]
+    with transaction.atomic():
+        MedicineNgram.objects.filter(medicine__in=[m.pk for m in medicines]).delete()
+        MedicineNgram.objects.bulk_create(rows, batch_size=2000)
+
+
+def _settings(limit, score_cutoff):
+    limit = limit or getattr(settings, 'MEDICINE_SUGGEST_LIMIT', 10)
+    if score_cutoff is None:
+        score_cutoff = getattr(settings, 'MEDICINE_SUGGEST_SCORE_CUTOFF', 60)
+    return limit, score_cutoff
+
+
+def _candidate_ids(grams, limit):
+    from .models import MedicineNgram
+
+    return (
+        MedicineNgram.objects.filter(gram__in=grams)
+        .values('medicine_id')
+        .annotate(hits=Count('medicine_id'))
+        .order_by('-hits')
+        .values_list('medicine_id', flat=True)[:limit * 5]
+    )
+
+
+def _candidates():
+    from .models import Medicine
+
+    return Medicine.objects.only('name', 'batch_number', 'manufacturer', 'expiry_date')
+
+
+def rank(query, candidates, limit, score_cutoff):
+    """Score ``candidates`` against ``query`` with RapidFuzz, best first."""
+    from rapidfuzz import fuzz, utils
+
+    normalized = utils.default_process(query)
+    scored = []
+    with span('fuzzy_suggest'):
+        for medicine in candidates:
+            score = max(
+                fuzz.ratio(normalized, utils.default_process(medicine.batch_number)),
+                fuzz.token_sort_ratio(normalized, utils.default_process(medicine.name)),
+            )
+            if score >= score_cutoff:
+                scored.append((medicine, score))
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:limit]
+
+
+def suggest(query, limit=None, score_cutoff=None):
+    """
+    Return ``[(medicine, score), ...]`` for a mistyped batch number or name.
+
+    The trigram table narrows the catalog down to the medicines sharing the
+    most grams with ``query`` using one indexed query on any backend; only
+    those candidates are fetched and re-ranked with RapidFuzz.
+    """
+    limit, score_cutoff = _settings(limit, score_cutoff)
+    grams = extract_grams(query)
+    if not grams:
+        return []
+
+    candidates = _candidates().in_bulk(list(_candidate_ids(grams, limit)))
+    return rank(query, candidates.values(), limit, score_cutoff)
+
+
+async def asuggest(query, limit=None, score_cutoff=None):
+    """Async ``suggest``; the RapidFuzz re-ranking runs in a worker thread."""
+    limit, score_cutoff = _settings(limit, score_cutoff)
+    grams = extract_grams(query)
+    if not grams:
+        return []
+
+    candidate_ids = [pk async for pk in _candidate_ids(grams, limit)]
+    candidates = await _candidates().ain_bulk(candidate_ids)
+    return await sync_to_async(rank, thread_sensitive=False)(
+        query, list(candidates.values()), limit, score_cutoff
+    )
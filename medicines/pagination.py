@@ -0,0 +1,168 @@
+# medicines/pagination.py
+import base64
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+def get_page_size():
+    return getattr(settings, 'MEDICINE_LIST_PAGE_SIZE', 50)
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: str = ''
+
+    @property
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(*values):
+    raw = '|'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the cursor's values as strings, or None if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _keyset_queryset(queryset, cursor, page_size):
+    queryset = queryset.order_by('-created_at', '-id')
+
+    values = decode_cursor(cursor)
+    if values and len(values) == 2:
+        created_at = parse_datetime(values[0])
+        last_id = values[1]
+        if created_at is not None and last_id.isdigit():
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=int(last_id))
+            )
+
+    # One extra row tells us whether there is a next page without a COUNT
+    return queryset[:page_size + 1]
+
+
+def _keyset_page(rows, page_size):
+    next_cursor = ''
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat(), last.pk)
+    return KeysetPage(rows, next_cursor)
+
+
+def keyset_paginate(queryset, cursor=None, page_size=None):
+    """
+    Page ``queryset`` newest first on ``(created_at, id)``.
+
+    Instead of an OFFSET the cursor carries the last row's sort key, so every
+    page is a bounded index range scan no matter how deep into the list it is.
+    A malformed cursor simply starts again from the first page.
+    """
+    page_size = page_size or get_page_size()
+    rows = list(_keyset_queryset(queryset, cursor, page_size))
+    return _keyset_page(rows, page_size)
+
+
+async def akeyset_paginate(queryset, cursor=None, page_size=None):
+    page_size = page_size or get_page_size()
+    rows = [row async for row in _keyset_queryset(queryset, cursor, page_size)]
+    return _keyset_page(rows, page_size)
+
+
+def _ranked_page_ids(ids, cursor, page_size):
+    start = 0
+    values = decode_cursor(cursor)
+    if values and len(values) == 1 and values[0].isdigit():
+        start = int(values[0])
+
+    next_cursor = ''
+    if start + page_size < len(ids):
+        next_cursor = encode_cursor(start + page_size)
+    return ids[start:start + page_size], next_cursor
+
+
+def ranked_paginate(ids, queryset, cursor=None, page_size=None):
+    """
+    Page an already ranked list of primary keys, e.g. search results.
+
+    The ranking lives in memory, so the cursor is the position in ``ids`` and
+    only the rows for the requested page are fetched from ``queryset``.
+    """
+    page_size = page_size or get_page_size()
+    page_ids, next_cursor = _ranked_page_ids(ids, cursor, page_size)
+    rows = queryset.in_bulk(page_ids)
+    return KeysetPage([rows[pk] for pk in page_ids if pk in rows], next_cursor)
+
+
+async def aranked_paginate(ids, queryset, cursor=None, page_size=None):
+    page_size = page_size or get_page_size()
+    page_ids, next_cursor = _ranked_page_ids(ids, cursor, page_size)
+    rows = await queryset.ain_bulk(page_ids)
+    return KeysetPage([rows[pk] for pk in page_ids if pk in rows], next_cursor)
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Return the planner's row count estimate for ``model``'s table, or None.
+
+    Reads ``pg_class.reltuples`` on Postgres and ``sqlite_stat1`` (written by
+    ANALYZE / ``PRAGMA optimize``) on SQLite; both are kept up to date by
+    routine maintenance and cost a single catalog lookup.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            except DatabaseError:
+                # No ANALYZE has run yet
+                return None
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for large admin changelists.
+
+    An unfiltered changelist over a table bigger than
+    ``MEDICINE_ADMIN_ESTIMATE_COUNT_ABOVE`` rows is counted from the planner's
+    statistics instead of a full ``COUNT(*)``; filtered ones are counted
+    exactly, as they usually are much smaller.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > getattr(settings, 'MEDICINE_ADMIN_ESTIMATE_COUNT_ABOVE', 10000):
+                return estimate
+        return super().count
@@ -0,0 +1,95 @@
+# medicines/qr.py
+import hashlib
+from functools import lru_cache
+from io import BytesIO
+from urllib.parse import quote
+
+from .instrumentation import span
+
+# Bump when the rendering parameters change so stored images get re-rendered
+RENDER_VERSION = 1
+QR_UPLOAD_DIR = 'qr_codes/'
+QR_FORMATS = ('png', 'svg')
+QR_BORDER = 4
+QR_BOX_SIZE = 10
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def build_payload(medicine):
+    # Important: This is the data format medicines.resolver.parse_payload reads.
+    # Percent-encoding keeps ':' in names and batch numbers unambiguous.
+    return f"MED2:{medicine.pk}:{quote(medicine.batch_number, safe='')}:{quote(medicine.name, safe='')}"
+
+
+def payload_hash(payload):
+    """Content address for a payload as rendered by this module."""
+    return hashlib.sha256(f"{RENDER_VERSION}:{payload}".encode()).hexdigest()
+
+
+@span('qr_render')
+def render(payload, fmt='png', size=None):
+    """
+    Encode ``payload`` as a PNG or SVG QR code.
+
+    ``size`` is the wanted edge length in pixels; the module size is picked
+    so the image is at most that big (but never less than 1px per module).
+    """
+    # qrcode pulls in Pillow; both load on the first render, not at startup
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L,
+                       box_size=QR_BOX_SIZE, border=QR_BORDER)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    if size:
+        qr.box_size = max(1, size // (qr.modules_count + 2 * QR_BORDER))
+
+    if fmt == 'svg':
+        import qrcode.image.svg
+
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        buffer = BytesIO()
+        img.save(buffer)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        buffer = BytesIO()
+        img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@span('qr_encode')
+def encode_modules(payload):
+    """
+    Encode ``payload`` as a bare module matrix, quiet zone included.
+
+    Returns ``(modules, data)``: the edge length in modules and the rows as
+    raw bytes of a 1-bit image (one pixel per module, black is dark), which
+    is compact enough to cache and can be scaled to any size losslessly.
+    """
+    import qrcode
+    from PIL import Image
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=QR_BORDER)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    image = Image.new('1', (len(matrix), len(matrix)))
+    image.putdata([0 if dark else 255 for row in matrix for dark in row])
+    return len(matrix), image.tobytes()
+
+
+def render_png(payload):
+    return render(payload, 'png')
+
+
+@lru_cache(maxsize=1024)
+def render_cached(payload, fmt='png', size=None):
+    """``render`` with a process-local LRU cache of the encoded bytes."""
+    return render(payload, fmt, size)
+
+
+def qr_file_name(digest):
+    return f'{QR_UPLOAD_DIR}{digest[:32]}.png'
@@ -0,0 +1,228 @@
+# medicines/resolver.py
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from urllib.parse import unquote
+
+from django.conf import settings
+
+from . import metrics
+
+# One parser for every payload we have ever printed:
+#   v2  MED2:<id>:<batch_number>:<name>   (batch and name percent-encoded)
+#   v1  MED-<id>-<name>-<batch_number>    (legacy, only the id is unambiguous)
+PAYLOAD_RE = re.compile(
+    r'MED(?:'
+    r'2:(?P<v2_id>\d+):(?P<v2_batch>[^:]*):(?P<v2_name>[^:]*)'
+    r'|-(?P<v1_id>\d+|None)-(?P<v1_rest>.*)'
+    r')',
+    re.DOTALL,
+)
+
+
+@dataclass(frozen=True)
+class ScanPayload:
+    version: int
+    medicine_id: int = None
+    batch_number: str = ''
+    name: str = ''
+
+
+def parse_payload(data):
+    """Parse a scanned QR payload, or return None if it isn't one of ours."""
+    match = PAYLOAD_RE.fullmatch(data)
+    if match is None:
+        return None
+    if match['v2_id'] is not None:
+        return ScanPayload(
+            version=2,
+            medicine_id=int(match['v2_id']),
+            batch_number=unquote(match['v2_batch']),
+            name=unquote(match['v2_name']),
+        )
+    # Both name and batch may contain '-', so this split is only a best guess
+    name, _, batch_number = match['v1_rest'].rpartition('-')
+    medicine_id = match['v1_id']
+    return ScanPayload(
+        version=1,
+        medicine_id=int(medicine_id) if medicine_id.isdigit() else None,
+        batch_number=batch_number,
+        name=name,
+    )
+
+
+class TTLCache:
+    """A small thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ScanResolver:
+    """
+    Map scanned data to a Medicine, remembering recent answers.
+
+    Two caches are kept: ``id -> medicine`` and ``batch_number -> id``. The
+    Medicine signals evict ids on save and delete; a cached batch mapping is
+    re-checked against the medicine it points to, so it can never resolve to
+    a row whose batch number has since changed. Every resolution records the
+    path it took in the ``scan.resolve`` metric.
+    """
+
+    # Only what the scan flow needs: the pk for the redirect and ScanLog FK
+    FIELDS = ('name', 'batch_number')
+
+    def __init__(self):
+        maxsize = getattr(settings, 'MEDICINE_SCAN_CACHE_SIZE', 1024)
+        ttl = getattr(settings, 'MEDICINE_SCAN_CACHE_TTL', 300)
+        self.by_id = TTLCache(maxsize, ttl)
+        self.by_batch = TTLCache(maxsize, ttl)
+
+    @staticmethod
+    def _batch_candidate(data, payload):
+        # Our v2 payloads carry an exact batch number; anything else may be one
+        if payload is not None and payload.version == 2:
+            return payload.batch_number
+        return data
+
+    @staticmethod
+    def _id_matches(payload, medicine):
+        # A v2 label also names its batch; don't trust an id that was reused
+        return payload.version != 2 or medicine.batch_number == payload.batch_number
+
+    def _resolve_steps(self, items):
+        """
+        Generator behind ``resolve_many`` and ``aresolve_many``.
+
+        It yields the querysets it needs, expects the fetched rows to be sent
+        back and finally returns the results, so the cache logic is shared by
+        the sync and async entry points.
+        """
+        from .models import Medicine
+
+        payloads = [parse_payload(data) for data in items]
+        results = [None] * len(items)
+        paths = ['miss'] * len(items)
+
+        # --- By id ---
+        wanted_ids = {}
+        for i, payload in enumerate(payloads):
+            if payload is None or payload.medicine_id is None:
+                continue
+            medicine = self.by_id.get(payload.medicine_id)
+            if medicine is not None and self._id_matches(payload, medicine):
+                results[i], paths[i] = medicine, 'id_cache'
+            else:
+                wanted_ids.setdefault(payload.medicine_id, []).append(i)
+
+        if wanted_ids:
+            found = yield Medicine.objects.only(*self.FIELDS).filter(pk__in=list(wanted_ids))
+            for medicine in found:
+                self.by_id.set(medicine.pk, medicine)
+                for i in wanted_ids[medicine.pk]:
+                    if self._id_matches(payloads[i], medicine):
+                        results[i], paths[i] = medicine, 'id_db'
+
+        # --- By batch number ---
+        wanted_batches = {}
+        for i, (data, payload) in enumerate(zip(items, payloads)):
+            if results[i] is not None:
+                continue
+            batch_number = self._batch_candidate(data, payload)
+            if not batch_number:
+                continue
+            medicine_id = self.by_batch.get(batch_number)
+            medicine = self.by_id.get(medicine_id) if medicine_id is not None else None
+            if medicine is not None and medicine.batch_number == batch_number:
+                results[i], paths[i] = medicine, 'batch_cache'
+            else:
+                wanted_batches.setdefault(batch_number, []).append(i)
+
+        if wanted_batches:
+            found = yield Medicine.objects.only(*self.FIELDS).filter(batch_number__in=list(wanted_batches))
+            for medicine in found:
+                self.by_id.set(medicine.pk, medicine)
+                self.by_batch.set(medicine.batch_number, medicine.pk)
+                for i in wanted_batches[medicine.batch_number]:
+                    results[i], paths[i] = medicine, 'batch_db'
+
+        for path, count in Counter(paths).items():
+            metrics.incr('scan.resolve', count, path=path)
+        return results
+
+    def resolve_many(self, items):
+        """
+        Resolve a list of scanned strings to Medicines (or None), in order.
+
+        Whatever the caches can't answer costs at most two queries for the
+        whole list: one on ids and one ``batch_number__in``.
+        """
+        steps = self._resolve_steps(items)
+        try:
+            queryset = next(steps)
+            while True:
+                queryset = steps.send(list(queryset))
+        except StopIteration as done:
+            return done.value
+
+    async def aresolve_many(self, items):
+        """Async ``resolve_many``: the same two queries, run by the async ORM."""
+        steps = self._resolve_steps(items)
+        try:
+            queryset = next(steps)
+            while True:
+                queryset = steps.send([medicine async for medicine in queryset])
+        except StopIteration as done:
+            return done.value
+
+    def resolve(self, data):
+        """Return the Medicine for ``data``, or None if nothing matches exactly."""
+        return self.resolve_many([data])[0]
+
+    async def aresolve(self, data):
+        return (await self.aresolve_many([data]))[0]
+
+    def evict(self, medicine_id):
+        self.by_id.delete(medicine_id)
+
+    def clear(self):
+        self.by_id.clear()
+        self.by_batch.clear()
+
+
+scan_resolver = ScanResolver()
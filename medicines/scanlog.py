@@ -0,0 +1,244 @@
+# medicines/scanlog.py
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rollup keys looked up per query by update_rollups
+ROLLUP_LOOKUP_BATCH = 250
+
+
+def rollup_key(scan_log):
+    return (
+        timezone.localdate(scan_log.timestamp),
+        scan_log.medicine_id,
+        scan_log.recognized,
+        scan_log.user_id,
+    )
+
+
+def update_rollups(scan_logs):
+    """Add freshly written scan logs to their ScanRollup counters."""
+    add_rollup_counts(Counter(rollup_key(scan_log) for scan_log in scan_logs))
+
+
+def add_rollup_counts(counts):
+    """
+    Add ``{(day, medicine_id, recognized, user_id): count}`` to ScanRollup.
+
+    Costs a constant number of queries per few hundred groups: missing
+    rollup rows are inserted with a zero count (ignoring rows a concurrent
+    writer just created), then every row is incremented in place by a single
+    UPDATE, so concurrent writers never lose counts.
+    """
+    from .models import ScanRollup
+
+    if not counts:
+        return
+
+    def load_ids():
+        ids = {}
+        keys = list(counts)
+        # SQLite caps expression depth at 1000, so OR at most a few hundred keys
+        for start in range(0, len(keys), ROLLUP_LOOKUP_BATCH):
+            lookup = Q()
+            for day, medicine_id, recognized, user_id in keys[start:start + ROLLUP_LOOKUP_BATCH]:
+                lookup |= Q(day=day, medicine_id=medicine_id, recognized=recognized, user_id=user_id)
+            rows = ScanRollup.objects.filter(lookup).values_list(
+                'pk', 'day', 'medicine_id', 'recognized', 'user_id'
+            )
+            for pk, *key in rows:
+                ids[tuple(key)] = pk
+        return ids
+
+    ids = load_ids()
+    missing = [key for key in counts if key not in ids]
+    if missing:
+        ScanRollup.objects.bulk_create(
+            [
+                ScanRollup(day=day, medicine_id=medicine_id, recognized=recognized, user_id=user_id, count=0)
+                for day, medicine_id, recognized, user_id in missing
+            ],
+            ignore_conflicts=True,
+        )
+        ids = load_ids()
+
+    ScanRollup.objects.filter(pk__in=ids.values()).update(
+        count=F('count') + Case(
+            *[When(pk=pk, then=Value(counts[key])) for key, pk in ids.items()],
+            default=Value(0),
+        )
+    )
+
+
+def fold_medicine_rollups(medicine_ids):
+    """
+    Move the rollups of medicines about to be deleted into the no-medicine bucket.
+
+    Nulling their foreign key instead would give two deleted medicines'
+    rollups for the same day, user and outcome the same key, which
+    ``unique_scan_rollup_no_medicine`` rejects.
+    """
+    from .models import ScanRollup
+
+    with transaction.atomic():
+        rows = ScanRollup.objects.filter(medicine_id__in=medicine_ids)
+        counts = Counter()
+        for day, recognized, user_id, count in rows.values_list('day', 'recognized', 'user_id', 'count'):
+            counts[day, None, recognized, user_id] += count
+        rows.delete()
+        add_rollup_counts(counts)
+
+
+def save_scan_logs(scan_logs):
+    """Persist a list of ScanLog instances with a single INSERT and roll them up."""
+    from .models import ScanLog
+
+    if scan_logs:
+        with transaction.atomic():
+            ScanLog.objects.bulk_create(scan_logs)
+            update_rollups(scan_logs)
+
+
+class ScanLogBuffer:
+    """
+    Write-behind buffer for ScanLog rows.
+
+    ``add`` only enqueues the row; a daemon thread drains the queue and writes
+    rows with one ``bulk_create`` whenever ``flush_size`` rows are waiting or
+    ``flush_interval`` seconds have passed. If the queue is full the row is
+    written synchronously instead, so scans are never dropped. Anything still
+    queued is flushed at interpreter exit. Depth, flush latency and the number
+    of flushed and fallback rows are published through ``medicines.metrics``.
+    """
+
+    def __init__(self, max_size=10000, flush_size=500, flush_interval=1.0):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='scanlog-flusher', daemon=True
+                )
+                self._thread.start()
+
+    def add(self, scan_log):
+        self.start()
+        try:
+            self._queue.put_nowait(scan_log)
+        except queue.Full:
+            metrics.incr('scanlog.buffer.sync_fallback')
+            save_scan_logs([scan_log])
+        metrics.set_gauge('scanlog.buffer.depth', self.depth)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            save_scan_logs(batch)
+        except Exception:
+            logger.exception("Bulk ScanLog flush of %d rows failed, saving one by one", len(batch))
+            for scan_log in batch:
+                try:
+                    save_scan_logs([scan_log])
+                except Exception:
+                    metrics.incr('scanlog.buffer.dropped')
+                    logger.exception("Dropping ScanLog for %r", scan_log.scanned_data)
+        metrics.incr('scanlog.buffer.flushes')
+        metrics.incr('scanlog.buffer.flushed_rows', len(batch))
+        metrics.set_gauge('scanlog.buffer.flush_seconds', time.monotonic() - started)
+        metrics.set_gauge('scanlog.buffer.depth', self.depth)
+
+    def flush(self):
+        """Write everything currently queued; safe to call from any thread."""
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.flush_size)
+                if not batch:
+                    break
+                self._write(batch)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            while len(batch) < self.flush_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                with self._flush_lock:
+                    self._write(batch)
+                close_old_connections()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ScanLogBuffer(
+                max_size=getattr(settings, 'MEDICINE_SCANLOG_BUFFER_SIZE', 10000),
+                flush_size=getattr(settings, 'MEDICINE_SCANLOG_FLUSH_SIZE', 500),
+                flush_interval=getattr(settings, 'MEDICINE_SCANLOG_FLUSH_INTERVAL', 1.0),
+            )
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def record_scan(scan_log):
+    """Save a ScanLog now, or hand it to the write-behind buffer if enabled."""
+    if getattr(settings, 'MEDICINE_SCANLOG_WRITE_BEHIND', False):
+        get_buffer().add(scan_log)
+    else:
+        save_scan_logs([scan_log])
+
+
+async def arecord_scan(scan_log):
+    """Async ``record_scan``; the write needs a transaction, so it runs in a thread."""
+    await sync_to_async(record_scan)(scan_log)
@@ -0,0 +1,205 @@
+# medicines/search.py
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .instrumentation import span
+
+# Fields that take part in the fuzzy search, in the order they are indexed
+SEARCH_FIELDS = ('name', 'generic_name', 'batch_number')
+
+
+def normalize(value):
+    """Lowercase and strip punctuation the same way for rows and queries."""
+    # RapidFuzz is imported where it is used, so django.setup() doesn't load it
+    from rapidfuzz import utils
+
+    return utils.default_process(value or '')
+
+
+class CatalogIndex:
+    """
+    Base for the process-local indexes over the Medicine catalog.
+
+    Subclasses build their tables from ``_rows()`` in ``_replace`` and
+    install them with ``_swap``; writes go through ``_change``. Changes made
+    while a reload reads the table are collected by ``_reloading`` and
+    replayed onto the new tables, so a reload never drops them.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        # One list of changes per reload in progress (see _reloading)
+        self._journals = []
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'MEDICINE_SEARCH_INDEX_TTL', 300)
+
+    def _is_stale(self):
+        if self._loaded_at is None:
+            return True
+        return self.ttl is not None and time.monotonic() - self._loaded_at > self.ttl
+
+    @contextmanager
+    def _reloading(self):
+        """Collect the changes made while a reload reads the table."""
+        journal = []
+        with self._lock:
+            self._journals.append(journal)
+        try:
+            yield journal
+        finally:
+            with self._lock:
+                self._journals.remove(journal)
+
+    def _swap(self, install, journal):
+        """Install freshly built tables with ``install()``, then replay ``journal``."""
+        with self._lock:
+            install()
+            self._loaded_at = time.monotonic()
+            # The rows may predate these; replaying them in order is safe
+            # for the ones they already include
+            for change, args in journal:
+                change(*args)
+
+    def _change(self, change, *args):
+        with self._lock:
+            for journal in self._journals:
+                journal.append((change, args))
+            # Before the first load there is nothing to change; the load
+            # reads the row (or replays the change) itself
+            if self._loaded_at is not None:
+                change(*args)
+
+
+class MedicineSearchIndex(CatalogIndex):
+    """
+    Process-local fuzzy search index over the Medicine catalog.
+
+    Each indexed field is stored pre-normalized under a ``(pk, field)`` key,
+    so a query is scored against the whole catalog in a single RapidFuzz call
+    instead of a Python loop over model instances. The index is loaded lazily
+    on first use, kept current by the ``post_save``/``post_delete`` signals in
+    ``medicines.signals`` and reloaded after ``MEDICINE_SEARCH_INDEX_TTL``
+    seconds so changes made by other worker processes are picked up too.
+
+    ``_choices`` is copied on write and never changed in place, so a search
+    scores a snapshot of it without holding the lock.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._choices = {}
+
+    def _rows(self):
+        from .models import Medicine
+
+        return Medicine.objects.values_list('pk', *SEARCH_FIELDS)
+
+    def _replace(self, rows, journal):
+        choices = {}
+        for pk, *values in rows:
+            for field, value in zip(SEARCH_FIELDS, values):
+                value = normalize(value)
+                if value:
+                    choices[(pk, field)] = value
+
+        def install():
+            self._choices = choices
+        self._swap(install, journal)
+
+    def load(self):
+        with span('search_index_load'), self._reloading() as journal:
+            self._replace(self._rows().iterator(chunk_size=2000), journal)
+
+    async def aload(self):
+        with self._reloading() as journal:
+            self._replace([row async for row in self._rows()], journal)
+
+    def clear(self):
+        with self._lock:
+            self._choices = {}
+            self._loaded_at = None
+
+    def add(self, medicine):
+        """Index (or re-index) a single medicine."""
+        values = {field: normalize(getattr(medicine, field)) for field in SEARCH_FIELDS}
+        self._change(self._index, medicine.pk, values)
+
+    def _index(self, pk, values):
+        choices = dict(self._choices)
+        for field, value in values.items():
+            if value:
+                choices[(pk, field)] = value
+            else:
+                choices.pop((pk, field), None)
+        self._choices = choices
+
+    def remove(self, pk):
+        self._change(self._unindex, pk)
+
+    def _unindex(self, pk):
+        if any((pk, field) in self._choices for field in SEARCH_FIELDS):
+            choices = dict(self._choices)
+            for field in SEARCH_FIELDS:
+                choices.pop((pk, field), None)
+            self._choices = choices
+
+    def search(self, query, limit=None, score_cutoff=None):
+        """
+        Return up to ``limit`` medicine primary keys, best match first.
+        """
+        from rapidfuzz import fuzz, process
+
+        if limit is None:
+            limit = getattr(settings, 'MEDICINE_SEARCH_LIMIT', 200)
+        if score_cutoff is None:
+            score_cutoff = getattr(settings, 'MEDICINE_SEARCH_SCORE_CUTOFF', 60)
+
+        query = normalize(query)
+        if not query:
+            return []
+
+        if self._is_stale():
+            self.load()
+
+        with self._lock:
+            choices = self._choices
+        with span('fuzzy_search'):
+            # A pk can appear once per field, so ask for enough hits to still
+            # have ``limit`` distinct medicines after de-duplication.
+            hits = process.extract(
+                query,
+                choices,
+                scorer=fuzz.token_sort_ratio,
+                processor=None,
+                limit=limit * len(SEARCH_FIELDS),
+                score_cutoff=score_cutoff,
+            )
+
+        ids = []
+        seen = set()
+        for _value, _score, (pk, _field) in hits:
+            if pk not in seen:
+                seen.add(pk)
+                ids.append(pk)
+                if len(ids) == limit:
+                    break
+        return ids
+
+    async def asearch(self, query, limit=None, score_cutoff=None):
+        """
+        Async ``search``: (re)loads through the async ORM, then runs the
+        CPU-bound scoring in a worker thread so the event loop stays free.
+        """
+        if self._is_stale():
+            await self.aload()
+        return await sync_to_async(self.search, thread_sensitive=False)(query, limit, score_cutoff)
+
+
+search_index = MedicineSearchIndex()
@@ -0,0 +1,56 @@
+# medicines/signals.py
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .instrumentation import record_query
+from .models import Medicine, delete_qr_file
+from .ngram import NGRAM_FIELDS, index_medicines
+from .resolver import scan_resolver
+from .scanlog import fold_medicine_rollups
+from .search import search_index
+from .stats import invalidate_inventory_stats
+from .typeahead import typeahead_index
+
+
+@receiver(post_save, sender=Medicine)
+def index_medicine(sender, instance, update_fields=None, **kwargs):
+    search_index.add(instance)
+    typeahead_index.add(instance)
+    if update_fields is None or set(NGRAM_FIELDS).intersection(update_fields):
+        index_medicines([instance])
+    scan_resolver.evict(instance.pk)
+    invalidate_inventory_stats()
+
+
+@receiver(pre_delete, sender=Medicine)
+def fold_rollups(sender, instance, **kwargs):
+    fold_medicine_rollups([instance.pk])
+
+
+@receiver(post_delete, sender=Medicine)
+def unindex_medicine(sender, instance, **kwargs):
+    search_index.remove(instance.pk)
+    typeahead_index.remove(instance.pk)
+    scan_resolver.evict(instance.pk)
+    invalidate_inventory_stats()
+    if instance.qr_code:
+        delete_qr_file(instance.qr_code.name)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Stays installed for the connection's lifetime; it is a no-op outside
+    # requests handled by RequestMetricsMiddleware
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -0,0 +1,92 @@
+# medicines/stats.py
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+VERSION_KEY = 'medicines:stats:version'
+
+
+def get_low_stock_threshold():
+    return getattr(settings, 'MEDICINE_LOW_STOCK_THRESHOLD', 5)
+
+
+def _get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_KEY, version, timeout=None)
+    return version
+
+
+async def _aget_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        version = 1
+        await cache.aadd(VERSION_KEY, version, timeout=None)
+    return version
+
+
+def invalidate_inventory_stats():
+    """Bump the stats version so every cached snapshot becomes unreachable."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, timeout=None)
+
+
+def _stats_aggregates(today, threshold):
+    return {
+        'total_count': Count('pk'),
+        'active_count': Count('pk', filter=Q(expiry_date__gt=today)),
+        'in_stock_count': Count('pk', filter=Q(stock__gte=threshold)),
+        'low_stock_count': Count('pk', filter=Q(stock__lt=threshold)),
+    }
+
+
+def compute_inventory_stats(today=None, threshold=None):
+    """Return the dashboard counters using a single aggregate query."""
+    from .models import Medicine
+
+    today = today or timezone.localdate()
+    threshold = get_low_stock_threshold() if threshold is None else threshold
+    return Medicine.objects.aggregate(**_stats_aggregates(today, threshold))
+
+
+def _stats_key(version, today, threshold):
+    return f'medicines:stats:{version}:{today.isoformat()}:{threshold}'
+
+
+def _stats_timeout():
+    return getattr(settings, 'MEDICINE_STATS_CACHE_TIMEOUT', 300)
+
+
+def get_inventory_stats():
+    """
+    Return the cached dashboard counters.
+
+    The cache key includes the current date, so "active" rolls over at
+    midnight, and a version number that the Medicine save/delete signals
+    bump whenever the underlying rows change.
+    """
+    today = timezone.localdate()
+    threshold = get_low_stock_threshold()
+    key = _stats_key(_get_version(), today, threshold)
+    return cache.get_or_set(
+        key, lambda: compute_inventory_stats(today, threshold), timeout=_stats_timeout()
+    )
+
+
+async def aget_inventory_stats():
+    """Async ``get_inventory_stats`` using the async cache and ORM APIs."""
+    from .models import Medicine
+
+    today = timezone.localdate()
+    threshold = get_low_stock_threshold()
+    key = _stats_key(await _aget_version(), today, threshold)
+
+    stats = await cache.aget(key)
+    if stats is None:
+        stats = await Medicine.objects.aaggregate(**_stats_aggregates(today, threshold))
+        await cache.aset(key, stats, timeout=_stats_timeout())
+    return stats
@@ -0,0 +1,96 @@
+# medicines/stock.py
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .stats import invalidate_inventory_stats
+from .typeahead import typeahead_index
+
+
+class StockError(ValueError):
+    """A batch of movements that cannot be applied; nothing was changed."""
+
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index
+
+
+class InsufficientStock(StockError):
+    pass
+
+
+@dataclass(frozen=True)
+class Movement:
+    medicine_id: int
+    kind: str
+    quantity: int
+    reference: str = ''
+
+
+def apply_movements(movements, user=None):
+    """
+    Apply ``movements`` atomically and record them in the stock ledger.
+
+    Every line is a single conditional ``UPDATE ... SET stock = stock +/- n``,
+    so concurrent counters never lose each other's changes and no model is
+    loaded, saved or re-rendered. A dispense only matches while the row
+    still holds enough stock; if any line fails the whole batch is rolled
+    back and StockError (or InsufficientStock) names the failing line.
+    Rows are updated in medicine id order so concurrent batches lock them
+    in the same order. Returns the StockMovement rows, in input order.
+    """
+    from .models import Medicine, StockMovement
+
+    now = timezone.now()
+    # Stable sort: lines for the same medicine keep their relative order
+    order = sorted(range(len(movements)), key=lambda i: movements[i].medicine_id)
+
+    with transaction.atomic():
+        for i in order:
+            movement = movements[i]
+            rows = Medicine.objects.filter(pk=movement.medicine_id)
+            if movement.kind == StockMovement.DISPENSE:
+                delta = -movement.quantity
+                rows = rows.filter(stock__gte=movement.quantity)
+            else:
+                delta = movement.quantity
+            # updated_at keeps alert runs and detail page ETags in step
+            if not rows.update(stock=F('stock') + delta, updated_at=now):
+                if not Medicine.objects.filter(pk=movement.medicine_id).exists():
+                    raise StockError(f"Medicine {movement.medicine_id} does not exist.", index=i)
+                raise InsufficientStock(
+                    f"Not enough stock of medicine {movement.medicine_id} to dispense {movement.quantity}.",
+                    index=i,
+                )
+
+        # One read of the final levels; walking the lines backwards from them
+        # gives the level after each line
+        stock = dict(
+            Medicine.objects.filter(pk__in={movement.medicine_id for movement in movements})
+            .values_list('pk', 'stock')
+        )
+        # Stock updates bypass the model signals that keep the typeahead current
+        final_stock = dict(stock)
+        transaction.on_commit(lambda: typeahead_index.update_stock(final_stock))
+        ledger = [None] * len(movements)
+        for i in reversed(order):
+            movement = movements[i]
+            ledger[i] = StockMovement(
+                medicine_id=movement.medicine_id, kind=movement.kind, quantity=movement.quantity,
+                stock_after=stock[movement.medicine_id], reference=movement.reference,
+                user=user, timestamp=now,
+            )
+            if movement.kind == StockMovement.DISPENSE:
+                stock[movement.medicine_id] += movement.quantity
+            else:
+                stock[movement.medicine_id] -= movement.quantity
+        StockMovement.objects.bulk_create(ledger)
+        transaction.on_commit(invalidate_inventory_stats)
+
+    for movement in movements:
+        metrics.incr('stock.movements', kind=movement.kind)
+        metrics.incr('stock.units', movement.quantity, kind=movement.kind)
+    return ledger
@@ -0,0 +1,128 @@
+# medicines/synthetic.py
+import datetime
+import io
+import random
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Medicine, ScanLog
+from .qr import build_payload, payload_hash
+
+# Building blocks for realistic catalog rows
+STEMS = (
+    'Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Metformin', 'Atorvastatin', 'Omeprazole',
+    'Amlodipine', 'Cetirizine', 'Azithromycin', 'Losartan', 'Salbutamol', 'Diclofenac',
+    'Ciprofloxacin', 'Pantoprazole', 'Levothyroxine', 'Prednisolone', 'Metronidazole',
+    'Simvastatin', 'Clopidogrel', 'Loratadine', 'Doxycycline', 'Furosemide', 'Montelukast',
+    'Aspirin', 'Naproxen', 'Fluconazole', 'Sertraline', 'Gabapentin', 'Insulin Glargine',
+    'Hydrochlorothiazide',
+)
+STRENGTHS = ('5mg', '10mg', '20mg', '25mg', '50mg', '100mg', '250mg', '500mg', '1g')
+FORMS = ('Tablets', 'Capsules', 'Syrup', 'Suspension', 'Injection', 'Cream', 'Drops', 'Inhaler')
+MANUFACTURERS = (
+    'Sun Pharma', 'Cipla', 'Pfizer', 'GSK', 'Novartis', 'Sanofi', 'Teva', 'Mylan',
+    "Dr. Reddy's", 'Lupin', 'Abbott', 'Bayer',
+)
+
+
+def batch_code(stem, index, year):
+    """A batch number like ``PAR24-000123``; unique per index."""
+    return f"{stem[:3].upper()}{year % 100:02d}-{index:06d}"
+
+
+def typo(rng, value):
+    """``value`` with one character dropped, doubled or swapped."""
+    if len(value) < 3:
+        return value + 'x'
+    i = rng.randrange(1, len(value) - 1)
+    edit = rng.choice(('drop', 'double', 'swap'))
+    if edit == 'drop':
+        return value[:i] + value[i + 1:]
+    if edit == 'double':
+        return value[:i] + value[i] + value[i:]
+    return value[:i - 1] + value[i] + value[i - 1] + value[i + 1:]
+
+
+def make_medicines(count, rng, start=0):
+    today = timezone.localdate()
+    medicines = []
+    for index in range(start, start + count):
+        stem = rng.choice(STEMS)
+        expiry_date = today + datetime.timedelta(days=rng.randint(-60, 900))
+        # About one in ten batches is below a typical reorder level
+        stock = rng.randint(0, 4) if rng.random() < 0.1 else rng.randint(5, 500)
+        medicines.append(Medicine(
+            name=f"{stem} {rng.choice(STRENGTHS)} {rng.choice(FORMS)}",
+            generic_name=stem,
+            manufacturer=rng.choice(MANUFACTURERS),
+            batch_number=batch_code(stem, index, expiry_date.year - 2),
+            expiry_date=expiry_date,
+            price=Decimal(rng.randint(50, 50000)) / 100,
+            stock=stock,
+        ))
+    return medicines
+
+
+def scan_inputs(rng, medicines):
+    """
+    Return ``(data, medicine_or_None)`` for one plausible scan: a QR payload,
+    a typed batch number, a batch number with a typo or plain garbage.
+    """
+    medicine = rng.choice(medicines)
+    roll = rng.random()
+    if roll < 0.5:
+        return build_payload(medicine), medicine
+    if roll < 0.7:
+        return medicine.batch_number, medicine
+    if roll < 0.9:
+        return typo(rng, medicine.batch_number), None
+    return ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789') for _ in range(10)), None
+
+
+def seed(medicines=5000, scans=20000, users=5, seed=42, batch_size=2000):
+    """
+    Fill the database with a reproducible synthetic catalog and scan history.
+
+    Everything goes through ``bulk_create``; the QR hashes, trigram index and
+    scan rollups that signals would normally maintain are filled in bulk too.
+    Returns ``(medicines, users)``.
+    """
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    from .ngram import index_medicines
+
+    rng = random.Random(seed)
+    User = get_user_model()
+    staff = User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(users)
+    ])
+    staff = list(User.objects.filter(username__in=[user.username for user in staff]))
+
+    created = []
+    for start in range(0, medicines, batch_size):
+        batch = Medicine.objects.bulk_create(make_medicines(min(batch_size, medicines - start), rng, start))
+        for medicine in batch:
+            medicine.qr_hash = payload_hash(build_payload(medicine))
+        Medicine.objects.bulk_update(batch, ['qr_hash'])
+        index_medicines(batch)
+        created.extend(batch)
+
+    now = timezone.now()
+    logs = []
+    for _ in range(scans):
+        data, medicine = scan_inputs(rng, created)
+        logs.append(ScanLog(
+            scanned_data=data,
+            medicine=medicine,
+            recognized=medicine is not None,
+            user=rng.choice(staff),
+            timestamp=now - datetime.timedelta(seconds=rng.randint(0, 90 * 86400)),
+        ))
+        if len(logs) >= batch_size:
+            ScanLog.objects.bulk_create(logs)
+            logs = []
+    ScanLog.objects.bulk_create(logs)
+    call_command('backfill_scan_rollups', stdout=io.StringIO())
+    return created, staff
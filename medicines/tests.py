@@ -1,3 +1,1726 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q, Sum
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from . import labels, metrics
+from .alerts import run_alerts
+from .archive import COLUMNS as ARCHIVE_COLUMNS, HEADER, archive_scanlogs, iter_archived_scans, write_segment
+from .forms import MedicineForm
+from .models import InventoryAlert, InventoryAlertRun, Medicine, MedicineNgram, ScanLog, ScanRollup, StockMovement
+from .ngram import asuggest, extract_grams, suggest
+from .pagination import akeyset_paginate, decode_cursor, encode_cursor, keyset_paginate, ranked_paginate
+from .qr import build_payload, payload_hash
+from .resolver import TTLCache, parse_payload, scan_resolver
+from .scanlog import ScanLogBuffer, get_buffer, update_rollups
+from .search import SEARCH_FIELDS, MedicineSearchIndex, search_index
+from .stats import aget_inventory_stats, get_inventory_stats
+from .stock import InsufficientStock, Movement, StockError, apply_movements
+from .typeahead import TYPEAHEAD_FIELDS, MedicinePrefixIndex, typeahead_index
+from .views import QR_MAX_SIZE, QR_MIN_SIZE
+
+
+class QueryPlanTests(TestCase):
+    """
+    Guard the hot filters against silently falling back to full table scans.
+
+    Each test EXPLAINs the query a view or admin page runs and checks that the
+    planner reaches the rows through an index. On Postgres sequential scans
+    are disabled for the test so that an empty table still shows whether a
+    usable index exists.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', 'planner@example.com', 'pw')
+        cls.medicine = Medicine.objects.create(
+            name='Paracetamol', manufacturer='ACME', batch_number='PLAN-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=3,
+        )
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            self.assertRegex(plan, r'USING (COVERING )?INDEX', plan)
+            self.assertNotIn('USE TEMP B-TREE', plan)
+        elif connection.vendor == 'postgresql':
+            self.assertRegex(plan, r'Index (Only )?Scan|Bitmap Index Scan', plan)
+            self.assertNotIn('Seq Scan', plan)
+            self.assertIsNone(re.search(r'Sort\b', plan), plan)
+        else:
+            self.skipTest(f'No plan assertions for {connection.vendor}')
+        if index:
+            self.assertIn(index, plan)
+
+    def test_medicine_list_first_page(self):
+        queryset = Medicine.objects.order_by('-created_at', '-id')[:51]
+        self.assertUsesIndex(queryset, 'medicine_created_id_idx')
+
+    def test_medicine_list_keyset_page(self):
+        created_at = self.medicine.created_at
+        queryset = Medicine.objects.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=self.medicine.pk)
+        ).order_by('-created_at', '-id')[:51]
+        self.assertUsesIndex(queryset, 'medicine_created_id_idx')
+
+    def test_active_filter(self):
+        queryset = Medicine.objects.filter(expiry_date__gt=timezone.localdate()).values('pk')
+        self.assertUsesIndex(queryset, 'medicine_expiry_idx')
+
+    def test_low_stock_filter(self):
+        queryset = Medicine.objects.filter(stock__lt=5).values('pk')
+        self.assertUsesIndex(queryset, 'medicine_stock_idx')
+
+    def test_manufacturer_filter(self):
+        queryset = Medicine.objects.filter(manufacturer='ACME')
+        self.assertUsesIndex(queryset, 'medicine_manufacturer_idx')
+
+    def test_alert_watermark_filter(self):
+        since = timezone.now() - datetime.timedelta(minutes=5)
+        queryset = Medicine.objects.filter(updated_at__gt=since).values_list('pk', 'expiry_date', 'stock')
+        self.assertUsesIndex(queryset, 'medicine_updated_idx')
+
+    def test_batch_number_lookup(self):
+        self.assertUsesIndex(Medicine.objects.filter(batch_number='PLAN-1'))
+
+    def test_scanlog_recognized_filter(self):
+        queryset = ScanLog.objects.filter(recognized=False).order_by('-timestamp')
+        self.assertUsesIndex(queryset, 'scanlog_unrecognized_ts_idx')
+
+    def test_scanlog_recognized_and_date_filter(self):
+        since = timezone.now() - datetime.timedelta(days=7)
+        self.assertUsesIndex(ScanLog.objects.filter(recognized=False, timestamp__gte=since))
+
+    def test_scanlog_timestamp_filter(self):
+        since = timezone.now() - datetime.timedelta(days=7)
+        queryset = ScanLog.objects.filter(timestamp__gte=since).order_by('-timestamp')
+        self.assertUsesIndex(queryset, 'scanlog_timestamp_idx')
+
+    def test_scanlog_by_user(self):
+        self.assertUsesIndex(ScanLog.objects.filter(user=self.user))
+
+
+class AdminChangelistQueryTests(TestCase):
+    """
+    The admin changelists must cost a fixed number of queries per page,
+    however many related users and medicines the listed rows point at.
+    """
+
+    CHANGELISTS = (
+        'admin:medicines_medicine_changelist',
+        'admin:medicines_scanlog_changelist',
+        'admin:medicines_scanrollup_changelist',
+        'admin:medicines_inventoryalert_changelist',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count):
+        today = timezone.localdate()
+        for _ in range(count):
+            i = self.rows = self.rows + 1
+            user = User.objects.create_user(f'scanner{i}', f'scanner{i}@example.com', 'pw')
+            medicine = Medicine.objects.create(
+                name=f'Medicine {i}', manufacturer='ACME', batch_number=f'ADM-{i}',
+                expiry_date=today + datetime.timedelta(days=i), price=1, stock=1,
+            )
+            ScanLog.objects.create(scanned_data=f'ADM-{i}', medicine=medicine, recognized=True, user=user)
+        run_alerts(full=True)
+
+    def changelist_queries(self, name):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_rows(2)
+        before = {name: self.changelist_queries(name) for name in self.CHANGELISTS}
+        self.add_rows(8)
+        for name in self.CHANGELISTS:
+            with self.subTest(changelist=name):
+                self.assertEqual(self.changelist_queries(name), before[name])
+                self.assertLessEqual(before[name], 12)
+
+
+class ScanConcurrencyTests(TransactionTestCase):
+    """Hammer scan_medicine from several threads, each on its own connection."""
+
+    THREADS = 8
+    SCANS_PER_THREAD = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Shared-cache in-memory SQLite uses table locks, not WAL')
+        self.medicine = Medicine.objects.create(
+            name='Ibuprofen', manufacturer='ACME', batch_number='CONC-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=10,
+        )
+        self.users = [
+            User.objects.create_user(f'counter{i}', f'counter{i}@example.com', 'pw')
+            for i in range(self.THREADS)
+        ]
+
+    def scan_repeatedly(self, user):
+        try:
+            client = Client()
+            client.force_login(user)
+            statuses = []
+            for i in range(self.SCANS_PER_THREAD):
+                data = 'CONC-1' if i % 2 else build_payload(self.medicine)
+                statuses.append(client.post(reverse('scan_medicine'), {'qr_data': data}).status_code)
+            return statuses
+        finally:
+            connection.close()
+
+    def test_concurrent_scans_are_all_logged(self):
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            results = list(executor.map(self.scan_repeatedly, self.users))
+
+        self.assertEqual([status for statuses in results for status in statuses],
+                         [302] * self.THREADS * self.SCANS_PER_THREAD)
+        total = self.THREADS * self.SCANS_PER_THREAD
+        self.assertEqual(ScanLog.objects.filter(medicine=self.medicine).count(), total)
+        self.assertEqual(
+            ScanRollup.objects.filter(medicine=self.medicine).aggregate(total=Sum('count'))['total'],
+            total,
+        )
+
+
+class ScanLogBufferTests(TransactionTestCase):
+    """The write-behind buffer never drops a scan, full or not."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('The flusher thread needs its own connection to a file database')
+        self.user = User.objects.create_user('buffered', 'buffered@example.com', 'pw')
+        self.medicine = Medicine.objects.create(
+            name='Buffered', manufacturer='ACME', batch_number='BUF-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+
+    def scans(self, count):
+        return [
+            ScanLog(scanned_data='BUF-1', recognized=True, medicine=self.medicine, user=self.user)
+            for _ in range(count)
+        ]
+
+    def assertAllWritten(self, count):
+        self.assertEqual(ScanLog.objects.count(), count)
+        self.assertEqual(ScanRollup.objects.get().count, count)
+
+    def test_full_buffer_writes_synchronously(self):
+        buffer = ScanLogBuffer(max_size=3, flush_size=100, flush_interval=60)
+        with mock.patch.object(buffer, 'start'):
+            for scan_log in self.scans(10):
+                buffer.add(scan_log)
+        self.assertEqual(buffer.depth, 3)
+        self.assertEqual(ScanLog.objects.count(), 7)
+        buffer.flush()
+        self.assertEqual(buffer.depth, 0)
+        self.assertAllWritten(10)
+
+    def test_flusher_thread_writes_in_the_background(self):
+        buffer = ScanLogBuffer(max_size=100, flush_size=4, flush_interval=0.05)
+        self.addCleanup(buffer.stop)
+        for scan_log in self.scans(10):
+            buffer.add(scan_log)
+        deadline = time.monotonic() + 10
+        while ScanLog.objects.count() < 10 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertAllWritten(10)
+        self.assertTrue(buffer._thread.is_alive())
+
+    def test_exit_flushes_what_is_queued(self):
+        with mock.patch('medicines.scanlog._buffer', None), \
+                mock.patch('medicines.scanlog.atexit.register') as register:
+            buffer = get_buffer()
+        register.assert_called_once_with(buffer.stop)
+        # No flusher thread, so only the exit hook can write these
+        with mock.patch.object(buffer, 'start'):
+            for scan_log in self.scans(5):
+                buffer.add(scan_log)
+        self.assertEqual(ScanLog.objects.count(), 0)
+        buffer.stop()
+        self.assertAllWritten(5)
+
+
+class StockMovementTests(TestCase):
+    """apply_movements and the medicine edit form around it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pharmacist', 'pharmacist@example.com', 'pw')
+
+    def setUp(self):
+        self.first = self.add('STOCK-1', 10)
+        self.second = self.add('STOCK-2', 4)
+
+    def add(self, batch_number, stock):
+        return Medicine.objects.create(
+            name=batch_number, manufacturer='ACME', batch_number=batch_number,
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=stock,
+        )
+
+    def stock(self, medicine):
+        return Medicine.objects.values_list('stock', flat=True).get(pk=medicine.pk)
+
+    def test_dispense_needs_enough_stock(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            apply_movements([Movement(self.second.pk, StockMovement.DISPENSE, 5)])
+        self.assertEqual(raised.exception.index, 0)
+        self.assertEqual(self.stock(self.second), 4)
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_one_bad_line_rolls_back_the_batch(self):
+        movements = [
+            Movement(self.first.pk, StockMovement.RECEIVE, 5),
+            Movement(self.second.pk, StockMovement.DISPENSE, 1),
+            Movement(self.second.pk + 1000, StockMovement.RECEIVE, 1),
+        ]
+        with self.assertRaises(StockError) as raised:
+            apply_movements(movements)
+        self.assertEqual(raised.exception.index, 2)
+        self.assertEqual((self.stock(self.first), self.stock(self.second)), (10, 4))
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_stock_after_follows_each_line(self):
+        ledger = apply_movements([
+            Movement(self.second.pk, StockMovement.DISPENSE, 3),
+            Movement(self.first.pk, StockMovement.DISPENSE, 3),
+            Movement(self.first.pk, StockMovement.RECEIVE, 5),
+            Movement(self.second.pk, StockMovement.RECEIVE, 1),
+            Movement(self.first.pk, StockMovement.DISPENSE, 12),
+        ], user=self.user)
+        self.assertEqual([movement.stock_after for movement in ledger], [1, 7, 12, 2, 0])
+        self.assertEqual((self.stock(self.first), self.stock(self.second)), (0, 2))
+        self.assertEqual(StockMovement.objects.filter(user=self.user).count(), 5)
+
+    def test_api_answers_conflict_when_stock_is_short(self):
+        self.client.force_login(self.user)
+        url = reverse('stock_movement_api', args=['dispense'])
+        response = self.client.post(
+            url, json.dumps({'medicine': self.second.pk, 'quantity': 5}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(
+            url, json.dumps({'items': [{'medicine': self.second.pk, 'quantity': 4}], 'reference': 'RX-1'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['movements'][0]['stock'], 0)
+
+    def edit_form_data(self, medicine):
+        # What the browser posts back from a freshly rendered edit form
+        form = MedicineForm(instance=medicine)
+        data = {}
+        for field in form:
+            value = field.value()
+            data[field.html_name] = data[field.html_initial_name] = '' if value is None else value
+        return data
+
+    def test_unchanged_edit_form_keeps_stock_moved_meanwhile(self):
+        self.client.force_login(self.user)
+        data = self.edit_form_data(self.first)
+        apply_movements([Movement(self.first.pk, StockMovement.DISPENSE, 3)])
+
+        data['name'] = 'Renamed'
+        response = self.client.post(reverse('medicine_update', args=[self.first.pk]), data)
+
+        self.assertEqual(response.status_code, 302)
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.name, self.first.stock), ('Renamed', 7))
+
+    def test_stock_edited_over_a_moved_value_is_a_conflict(self):
+        self.client.force_login(self.user)
+        url = reverse('medicine_update', args=[self.first.pk])
+        data = self.edit_form_data(self.first)
+        apply_movements([Movement(self.first.pk, StockMovement.DISPENSE, 3)])
+
+        data['stock'] = 12
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('stock', response.context['form'].errors)
+        self.assertEqual(self.stock(self.first), 7)
+
+        # The re-rendered form carries the current level; saving again wins
+        response = self.client.post(url, response.context['form'].data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stock(self.first), 12)
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    """Dispense the same medicine from several threads, each on its own connection."""
+
+    THREADS = 8
+    DISPENSES_PER_THREAD = 10
+    STOCK = 50
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Shared-cache in-memory SQLite uses table locks, not WAL')
+        self.medicine = Medicine.objects.create(
+            name='Amoxicillin', manufacturer='ACME', batch_number='CONC-STOCK',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=self.STOCK,
+        )
+
+    def dispense_repeatedly(self, _thread):
+        try:
+            dispensed = 0
+            for _ in range(self.DISPENSES_PER_THREAD):
+                try:
+                    apply_movements([Movement(self.medicine.pk, StockMovement.DISPENSE, 1)])
+                except InsufficientStock:
+                    continue
+                dispensed += 1
+            return dispensed
+        finally:
+            connection.close()
+
+    def test_concurrent_dispenses_lose_nothing(self):
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            dispensed = sum(executor.map(self.dispense_repeatedly, range(self.THREADS)))
+
+        # 80 attempts on 50 units: exactly 50 succeed and none go below zero
+        self.assertEqual(dispensed, self.STOCK)
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.stock, 0)
+        ledger = StockMovement.objects.filter(medicine=self.medicine)
+        self.assertEqual(ledger.count(), self.STOCK)
+        self.assertEqual(sorted(ledger.values_list('stock_after', flat=True)), list(range(self.STOCK)))
+
+
+@override_settings(MEDICINE_LOW_STOCK_THRESHOLD=5, MEDICINE_EXPIRY_ALERT_WINDOWS=(30, 60, 90))
+class AlertEngineTests(TestCase):
+    """run_alerts: what it raises and clears, and which rows each run reads."""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+
+    def add(self, batch_number, days, stock=50):
+        return Medicine.objects.create(
+            name=batch_number, manufacturer='ACME', batch_number=batch_number,
+            expiry_date=self.today + datetime.timedelta(days=days), price=1, stock=stock,
+        )
+
+    def backdate(self):
+        # Outside the watermark overlap, as if saved long before the last run
+        Medicine.objects.update(updated_at=timezone.now() - datetime.timedelta(days=7))
+
+    def open_alerts(self):
+        return set(InventoryAlert.objects.values_list('medicine__batch_number', 'kind', 'window_days'))
+
+    def test_full_run_raises_each_kind(self):
+        self.add('EXPIRED', -1)
+        self.add('TODAY', 0)
+        self.add('SOON', 20)
+        self.add('LATER', 45, stock=2)
+        self.add('HEALTHY', 200)
+        self.add('LOW', 200, stock=4)
+
+        run = run_alerts(full=True)
+
+        self.assertTrue(run.full)
+        self.assertEqual(self.open_alerts(), {
+            ('EXPIRED', InventoryAlert.EXPIRED, None),
+            ('TODAY', InventoryAlert.EXPIRED, None),
+            ('SOON', InventoryAlert.EXPIRING, 30),
+            ('LATER', InventoryAlert.EXPIRING, 60),
+            ('LATER', InventoryAlert.LOW_STOCK, None),
+            ('LOW', InventoryAlert.LOW_STOCK, None),
+        })
+        self.assertEqual((run.scanned, run.raised, run.cleared), (5, 6, 0))
+
+    def test_incremental_run_reads_only_changed_rows(self):
+        medicine = self.add('LOW', 200, stock=4)
+        self.add('HEALTHY', 200)
+        self.backdate()
+        run_alerts(full=True)
+        self.backdate()
+
+        run = run_alerts()
+        self.assertFalse(run.full)
+        self.assertEqual(run.scanned, 0)
+
+        medicine.stock = 10
+        medicine.save()
+        run = run_alerts()
+        self.assertEqual((run.scanned, run.raised, run.cleared), (1, 0, 1))
+        self.assertEqual(self.open_alerts(), set())
+
+    def test_incremental_run_catches_expiry_crossing_a_window(self):
+        self.add('EXPIRES-TODAY', 0)
+        self.add('ENTERS-30', 30)
+        self.add('ENTERS-60', 60)
+        self.add('INSIDE-30', 10)
+        self.backdate()
+        # The previous run was yesterday; nothing has been edited since
+        InventoryAlertRun.objects.create(
+            started_at=timezone.now() - datetime.timedelta(days=1), finished_at=timezone.now(),
+            threshold=5, windows='30,60,90',
+        )
+
+        run = run_alerts()
+
+        self.assertFalse(run.full)
+        self.assertEqual(run.scanned, 3)
+        self.assertEqual(self.open_alerts(), {
+            ('EXPIRES-TODAY', InventoryAlert.EXPIRED, None),
+            ('ENTERS-30', InventoryAlert.EXPIRING, 30),
+            ('ENTERS-60', InventoryAlert.EXPIRING, 60),
+        })
+
+    def test_changed_settings_force_a_full_run(self):
+        self.add('SOON', 20)
+        run_alerts(full=True)
+        with self.settings(MEDICINE_EXPIRY_ALERT_WINDOWS=(7,)):
+            run = run_alerts()
+        self.assertTrue(run.full)
+        self.assertEqual(self.open_alerts(), set())
+
+    def test_full_run_clears_alerts_of_rows_it_no_longer_reads(self):
+        expired = self.add('EXPIRED', -1)
+        low = self.add('LOW', 200, stock=1)
+        run_alerts(full=True)
+        # Queryset updates send no signals and leave updated_at alone
+        Medicine.objects.filter(pk=expired.pk).update(expiry_date=self.today + datetime.timedelta(days=365))
+        Medicine.objects.filter(pk=low.pk).update(stock=100)
+
+        run = run_alerts(full=True)
+
+        self.assertEqual(run.scanned, 0)
+        self.assertEqual(run.cleared, 2)
+        self.assertEqual(self.open_alerts(), set())
+
+
+class PaginationTests(TestCase):
+    """Keyset and ranked cursors walk every row once and shrug off tampering."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pager', 'pager@example.com', 'pw')
+        Medicine.objects.bulk_create([
+            Medicine(
+                name=f'Paged {i}', manufacturer='ACME', batch_number=f'PAGE-{i}',
+                expiry_date=datetime.date(2030, 1, 1), price=1,
+            )
+            for i in range(7)
+        ])
+        # Two rows share a created_at, so the id has to break the tie
+        start = timezone.now() - datetime.timedelta(days=1)
+        for i, medicine in enumerate(Medicine.objects.order_by('pk')):
+            Medicine.objects.filter(pk=medicine.pk).update(created_at=start + datetime.timedelta(hours=min(i, 5)))
+        cls.newest_first = list(Medicine.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def walk(self, paginate):
+        seen, cursor = [], ''
+        for _ in range(10):
+            page = paginate(cursor)
+            seen.extend(medicine.pk for medicine in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+        self.fail('Pagination did not end')
+
+    def test_keyset_cursor_round_trip(self):
+        seen = self.walk(lambda cursor: keyset_paginate(Medicine.objects.all(), cursor, page_size=3))
+        self.assertEqual(seen, self.newest_first)
+
+    async def test_async_keyset_cursor_round_trip(self):
+        pages, cursor = [], ''
+        while True:
+            page = await akeyset_paginate(Medicine.objects.all(), cursor, page_size=3)
+            pages.append([medicine.pk for medicine in page])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual([pk for page in pages for pk in page], self.newest_first)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+
+    def test_invalid_cursors_start_over(self):
+        first = [medicine.pk for medicine in keyset_paginate(Medicine.objects.all(), page_size=3)]
+        for cursor in ('%%%', 'not base64!', encode_cursor('yesterday', 4), encode_cursor('2020-01-01T00:00:00', 'x'),
+                       encode_cursor(1, 2, 3), 'gICA'):
+            with self.subTest(cursor=cursor):
+                page = keyset_paginate(Medicine.objects.all(), cursor, page_size=3)
+                self.assertEqual([medicine.pk for medicine in page], first)
+        self.assertIsNone(decode_cursor('gICA'))
+
+    def test_ranked_pages_keep_the_ranking(self):
+        ranked = list(reversed(self.newest_first))
+        Medicine.objects.filter(pk=ranked[1]).delete()
+        seen = self.walk(lambda cursor: ranked_paginate(ranked, Medicine.objects.all(), cursor, page_size=2))
+        # A row deleted after ranking is skipped, the rest keep their order
+        self.assertEqual(seen, [ranked[0]] + ranked[2:])
+        page = ranked_paginate(ranked, Medicine.objects.all(), encode_cursor('x'), page_size=2)
+        self.assertEqual(page.object_list[0].pk, ranked[0])
+
+    def test_list_view_follows_cursors(self):
+        self.client.force_login(self.user)
+        with override_settings(MEDICINE_LIST_PAGE_SIZE=3):
+            response = self.client.get(reverse('medicine_list'))
+            page = response.context['page']
+            self.assertTrue(page.has_next)
+            response = self.client.get(reverse('medicine_list'), {'cursor': page.next_cursor})
+            self.assertEqual([medicine.pk for medicine in response.context['medicines']], self.newest_first[3:6])
+            self.assertEqual(self.client.get(reverse('medicine_list'), {'cursor': '%%%'}).status_code, 200)
+
+    def test_search_results_page_in_rank_order(self):
+        search_index.clear()
+        self.addCleanup(search_index.clear)
+        self.client.force_login(self.user)
+        ranked = search_index.search('paged 4')
+        with override_settings(MEDICINE_LIST_PAGE_SIZE=3):
+            response = self.client.get(reverse('medicine_list'), {'q': 'paged 4'})
+            self.assertEqual(response.context['total_count'], len(ranked))
+            self.assertEqual([medicine.pk for medicine in response.context['medicines']], ranked[:3])
+            cursor = response.context['page'].next_cursor
+            response = self.client.get(reverse('medicine_list'), {'q': 'paged 4', 'cursor': cursor})
+            self.assertEqual([medicine.pk for medicine in response.context['medicines']], ranked[3:6])
+
+
+@override_settings(MEDICINE_LOW_STOCK_THRESHOLD=5)
+class InventoryStatsTests(TestCase):
+    """The dashboard counters are cached until a medicine or its stock changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.medicine = Medicine.objects.create(
+            name='Counted', manufacturer='ACME', batch_number='STAT-1',
+            expiry_date=today + datetime.timedelta(days=30), price=1, stock=6,
+        )
+        Medicine.objects.create(
+            name='Expired', manufacturer='ACME', batch_number='STAT-2',
+            expiry_date=today - datetime.timedelta(days=1), price=1, stock=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def stats(self):
+        stats = get_inventory_stats()
+        return stats['total_count'], stats['active_count'], stats['in_stock_count'], stats['low_stock_count']
+
+    def test_counters_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.stats(), (2, 1, 1, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.stats(), (2, 1, 1, 1))
+
+    def test_save_and_delete_invalidate(self):
+        self.stats()
+        medicine = Medicine.objects.create(
+            name='New', manufacturer='ACME', batch_number='STAT-3',
+            expiry_date=timezone.localdate() + datetime.timedelta(days=30), price=1, stock=10,
+        )
+        self.assertEqual(self.stats(), (3, 2, 2, 1))
+        medicine.delete()
+        self.assertEqual(self.stats(), (2, 1, 1, 1))
+
+    def test_committed_stock_movements_invalidate(self):
+        self.stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_movements([Movement(self.medicine.pk, StockMovement.DISPENSE, 2)])
+        self.assertEqual(self.stats(), (2, 1, 0, 2))
+
+    async def test_async_counters_share_the_cache(self):
+        stats = await aget_inventory_stats()
+        self.assertEqual((stats['total_count'], stats['low_stock_count']), (2, 1))
+
+        # The async call filled the entry the sync one reads
+        def cached_stats():
+            with self.assertNumQueries(0):
+                return self.stats()
+        self.assertEqual(await sync_to_async(cached_stats)(), (2, 1, 1, 1))
+
+
+class MedicineDetailTests(TestCase):
+    """medicine_detail answers revalidations with 304 until the medicine changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', 'reader@example.com', 'pw')
+        cls.medicine = Medicine.objects.create(
+            name='Loratadine', manufacturer='ACME', batch_number='DET-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=10,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('medicine_detail', args=[self.medicine.pk])
+
+    def test_revalidation_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('private', response['Cache-Control'])
+
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(self.url, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_on_save(self):
+        etag = self.client.get(self.url)['ETag']
+        self.medicine.name = 'Loratadine 10mg'
+        self.medicine.save()
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Loratadine 10mg')
+
+    def test_etag_is_stale_after_stock_movement(self):
+        etag = self.client.get(self.url)['ETag']
+        apply_movements([Movement(self.medicine.pk, StockMovement.DISPENSE, 3)])
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_card_cache_follows_the_row_version(self):
+        self.assertContains(self.client.get(self.url), 'Loratadine')
+        # update() leaves updated_at alone, so the cached card is still current
+        Medicine.objects.filter(pk=self.medicine.pk).update(name='Desloratadine')
+        self.assertNotContains(self.client.get(self.url), 'Desloratadine')
+        self.medicine.refresh_from_db()
+        self.medicine.save()
+        self.assertContains(self.client.get(self.url), 'Desloratadine')
+
+    def test_missing_medicine(self):
+        self.assertEqual(self.client.get(reverse('medicine_detail', args=[10 ** 6])).status_code, 404)
+
+
+class MedicineQrTests(TestCase):
+    """medicine_qr serves strong validators and keeps images out of shared caches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('printer', 'printer@example.com', 'pw')
+        cls.medicine = Medicine.objects.create(
+            name='Omeprazole', manufacturer='ACME', batch_number='QR-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, fmt='png', headers=None, **params):
+        url = reverse('medicine_qr', args=[self.medicine.pk, fmt])
+        return self.client.get(url, params, headers=headers or {})
+
+    def cache_control(self, response):
+        return {directive.strip() for directive in response['Cache-Control'].split(',')}
+
+    def test_versioned_url_is_private_and_immutable(self):
+        self.medicine.refresh_from_db()
+        response = self.client.get(self.medicine.qr_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(self.cache_control(response), {'private', 'max-age=31536000', 'immutable'})
+
+    def test_unversioned_url_must_revalidate(self):
+        response = self.get(v='stale')
+        self.assertEqual(self.cache_control(response), {'private', 'max-age=0', 'must-revalidate'})
+
+    def test_strong_etag_and_not_modified(self):
+        response = self.get()
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertEqual(self.get(headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.get(headers={'If-None-Match': '*'}).status_code, 304)
+        self.assertEqual(self.get('svg', headers={'If-None-Match': etag}).status_code, 200)
+
+        self.medicine.batch_number = 'QR-2'
+        self.medicine.save()
+        response = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_size_is_clamped(self):
+        from PIL import Image
+
+        def width(size):
+            response = self.get(size=size)
+            return Image.open(BytesIO(response.content)).width, response['ETag']
+
+        small, small_etag = width(1)
+        large, large_etag = width(100000)
+        self.assertLessEqual(small, QR_MIN_SIZE * 2)
+        self.assertLessEqual(large, QR_MAX_SIZE)
+        self.assertEqual(width(QR_MIN_SIZE)[1], small_etag)
+        self.assertEqual(width(QR_MAX_SIZE)[1], large_etag)
+        self.assertEqual(width('big')[1], self.get()['ETag'])
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.get().status_code, 302)
+
+
+class AsyncViewTests(TestCase):
+    """Drive the async views through AsyncClient, where sync-only ORM calls fail."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('async', 'async@example.com', 'pw')
+        cls.medicine = Medicine.objects.create(
+            name='Cefalexin', manufacturer='ACME', batch_number='ASY-2024-0042',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=9,
+        )
+
+    def setUp(self):
+        cache.clear()
+        for index in (search_index, typeahead_index, scan_resolver):
+            index.clear()
+            self.addCleanup(index.clear)
+        self.async_client.force_login(self.user)
+
+    async def test_medicine_list(self):
+        response = await self.async_client.get(reverse('medicine_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Cefalexin')
+        response = await self.async_client.get(reverse('medicine_list'), {'q': 'cefalexn'})
+        self.assertEqual([medicine.pk for medicine in response.context['medicines']], [self.medicine.pk])
+
+    async def test_medicine_detail(self):
+        url = reverse('medicine_detail', args=[self.medicine.pk])
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Cefalexin')
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_scan_medicine(self):
+        url = reverse('scan_medicine')
+        self.assertEqual((await self.async_client.get(url)).status_code, 200)
+
+        response = await self.async_client.post(url, {'qr_data': build_payload(self.medicine)})
+        self.assertRedirects(response, reverse('medicine_detail', args=[self.medicine.pk]), fetch_redirect_response=False)
+        response = await self.async_client.post(url, {'qr_data': 'ASY-2024-0043'})
+        self.assertEqual(list(response.context['matches']), [self.medicine])
+        response = await self.async_client.post(url, {'qr_data': 'zzz'})
+        self.assertContains(response, 'Medicine not found')
+
+        recognized = [scan.recognized async for scan in ScanLog.objects.order_by('pk')]
+        self.assertEqual(recognized, [True, False, False])
+
+    async def test_typeahead_api(self):
+        response = await self.async_client.get(reverse('typeahead_api'), {'q': 'cef'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(result['id'], result['stock']) for result in response.json()['results']], [(self.medicine.pk, 9)],
+        )
+
+
+class ExportStreamingTests(TestCase):
+    """export_data streams with an iterator that suits the handler serving it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('auditor', 'auditor@example.com', 'pw', is_staff=True)
+        Medicine.objects.bulk_create([
+            Medicine(
+                name=f'Export {i}', manufacturer='ACME', batch_number=f'EXP-{i}',
+                expiry_date=datetime.date(2030, 1, 1), price=1, stock=i,
+            )
+            for i in range(1200)
+        ])
+
+    def url(self, **params):
+        return f"{reverse('export_data', args=['medicines', 'csv'])}?{urlencode(params)}"
+
+    def check_csv(self, content):
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'name'])
+        self.assertEqual(len(lines), 1201)
+
+    def test_wsgi_gets_a_sync_stream(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url(gzip=1))
+        self.assertFalse(response.is_async)
+        self.check_csv(gzip.decompress(b''.join(response.streaming_content)))
+
+    async def test_asgi_gets_an_async_stream(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(self.url(gzip=1))
+        self.assertTrue(response.is_async)
+        self.check_csv(gzip.decompress(b''.join([chunk async for chunk in response.streaming_content])))
+
+    def test_invalid_filter(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(self.url(since='yesterday')).status_code, 400)
+
+
+@override_settings(MEDICINE_LABEL_DPI=72, MEDICINE_LABEL_SYNC_MAX_ITEMS=60)
+class LabelSheetTests(TestCase):
+    """Label sheets render through a bounded window of jobs on either handler."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('labeller', 'labeller@example.com', 'pw')
+        Medicine.objects.bulk_create([
+            Medicine(
+                name=f'Label {i}', manufacturer='ACME', batch_number=f'LBL-{i}',
+                expiry_date=datetime.date(2030, 1, 1), price=1, stock=i,
+            )
+            for i in range(50)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        labels._modules_cache = None
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+        patcher = mock.patch.object(labels, 'get_pool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rows(self):
+        return Medicine.objects.order_by('pk').values_list('pk', 'name', 'batch_number', 'expiry_date')
+
+    def url(self, fmt, **params):
+        return f"{reverse('label_sheets', args=[fmt])}?{urlencode(params)}"
+
+    def check_pdf(self, content, pages):
+        self.assertTrue(content.startswith(b'%PDF-'))
+        self.assertTrue(content.rstrip().endswith(b'%%EOF'))
+        self.assertEqual(len(re.findall(rb'/Type /Page\b', content)), pages)
+
+    def test_rows_are_read_one_window_ahead(self):
+        per_page = labels.PAPERS['a4'].per_page
+        read = []
+
+        def rows():
+            for row in self.rows().iterator():
+                read.append(row)
+                yield row
+
+        pages = labels.iter_pages(rows(), copies=4, window=2)
+        next(pages)
+        # Only the two sheets in flight were built, not all nine
+        self.assertEqual(len(read) * 4, 2 * per_page)
+        self.assertEqual(1 + sum(1 for _ in pages), 9)
+        self.assertEqual(len(read), 50)
+
+    def test_pdf_holds_every_sheet(self):
+        content = b''.join(labels.stream_labels(self.rows().iterator(), copies=2))
+        self.check_pdf(content, 5)
+
+    def test_encoded_qr_codes_expire_from_the_shared_cache(self):
+        with override_settings(MEDICINE_LABEL_QR_CACHE_TTL=600), \
+                mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            list(labels.iter_pages(self.rows().iterator()))
+        self.assertTrue(set_many.called)
+        for call_args in set_many.call_args_list:
+            self.assertEqual(call_args.kwargs['timeout'], 600)
+
+        # A reprint takes every QR code from the cache
+        with mock.patch.object(labels, 'encode_modules') as encode_modules:
+            list(labels.iter_pages(self.rows().iterator()))
+        encode_modules.assert_not_called()
+
+    def test_png_is_one_sheet(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url('png', page=3))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertEqual(self.client.get(self.url('png', page=4)).status_code, 404)
+
+    def test_wsgi_streams_small_pdfs(self):
+        self.client.force_login(self.user)
+        ids = ','.join(str(pk) for pk in Medicine.objects.values_list('pk', flat=True)[:3])
+        response = self.client.get(self.url('pdf', ids=ids, copies=20))
+        self.assertFalse(response.is_async)
+        self.check_pdf(b''.join(response.streaming_content), 3)
+
+    def test_wsgi_leaves_large_pdfs_to_print_labels(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url('pdf', copies=2))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'print_labels', response.content)
+
+    async def test_asgi_streams_large_pdfs(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url('pdf', copies=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.check_pdf(b''.join([chunk async for chunk in response.streaming_content]), 5)
+
+    def test_invalid_requests(self):
+        self.client.force_login(self.user)
+        for params in ({'paper': 'a3'}, {'copies': '0'}, {'copies': '101'}, {'page': '0'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url('png', **params)).status_code, 400)
+
+
+class ScanArchiveTests(TestCase):
+    """archive_scanlogs writes segments that iter_archived_scans reads back."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('archivist', 'archivist@example.com', 'pw')
+        cls.medicine = Medicine.objects.create(
+            name='Cetirizine', manufacturer='ACME', batch_number='ARCH-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=1,
+        )
+
+    def setUp(self):
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.start = timezone.now() - datetime.timedelta(days=400)
+        ScanLog.objects.bulk_create([
+            ScanLog(
+                scanned_data=f'scan {i}', user=self.user, recognized=i % 2 == 0,
+                medicine=self.medicine if i % 2 == 0 else None,
+                timestamp=self.start + datetime.timedelta(hours=i),
+            )
+            for i in range(25)
+        ])
+        self.recent = ScanLog.objects.create(scanned_data='today', user=self.user, recognized=False)
+
+    def archive(self):
+        return archive_scanlogs(
+            datetime.timedelta(days=365), directory=self.directory, fmt='jsonl', chunk_size=10, delete_batch=4,
+        )
+
+    def test_round_trip(self):
+        expected = list(ScanLog.objects.exclude(pk=self.recent.pk).order_by('pk').values_list(
+            'pk', 'timestamp', 'scanned_data', 'recognized', 'medicine_id',
+        ))
+        result = self.archive()
+
+        self.assertEqual((result.rows, len(result.segments), result.recovered), (25, 3, 0))
+        self.assertEqual(list(ScanLog.objects.values_list('pk', flat=True)), [self.recent.pk])
+        scans = list(iter_archived_scans(directory=self.directory))
+        self.assertEqual(
+            [(s['id'], s['timestamp'], s['scanned_data'], s['recognized'], s['medicine_id']) for s in scans],
+            expected,
+        )
+        self.assertEqual({s['user'] for s in scans}, {'archivist'})
+        self.assertEqual(scans[0]['batch_number'], 'ARCH-1')
+
+        since = self.start + datetime.timedelta(hours=5)
+        until = self.start + datetime.timedelta(hours=15)
+        window = [s['scanned_data'] for s in iter_archived_scans(since, until, directory=self.directory)]
+        self.assertEqual(window, [f'scan {i}' for i in range(5, 15)])
+
+        out = StringIO()
+        call_command('read_scan_archive', directory=str(self.directory), medicine=self.medicine.pk, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(','), HEADER)
+        self.assertEqual(len(lines), 1 + 13)
+
+    def test_interrupted_run_is_not_archived_twice(self):
+        # A crash after writing a segment but before its rows were deleted
+        lookups = [lookup for _name, lookup in ARCHIVE_COLUMNS]
+        rows = list(ScanLog.objects.exclude(pk=self.recent.pk).order_by('pk').values_list(*lookups)[:10])
+        write_segment(rows, self.directory, 'jsonl')
+        ScanLog.objects.filter(pk__in=[row[0] for row in rows[:3]]).delete()
+
+        result = self.archive()
+
+        self.assertEqual((result.recovered, result.rows), (7, 15))
+        ids = [scan['id'] for scan in iter_archived_scans(directory=self.directory)]
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_reused_ids_are_not_taken_for_survivors(self):
+        lookups = [lookup for _name, lookup in ARCHIVE_COLUMNS]
+        rows = list(ScanLog.objects.exclude(pk=self.recent.pk).order_by('pk').values_list(*lookups)[:10])
+        write_segment(rows, self.directory, 'jsonl')
+        ScanLog.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        # SQLite gives a deleted rowid to a new scan
+        reused = ScanLog.objects.create(pk=rows[-1][0], scanned_data='fresh', user=self.user, recognized=False)
+
+        result = self.archive()
+
+        self.assertEqual((result.recovered, result.rows), (0, 15))
+        self.assertEqual(ScanLog.objects.get(pk=reused.pk).scanned_data, 'fresh')
+
+    def test_backfill_skips_archived_days(self):
+        update_rollups(ScanLog.objects.all())
+        self.archive()
+
+        out = StringIO()
+        call_command('backfill_scan_rollups', archive_dir=str(self.directory), stdout=out)
+        self.assertIn('are archived', out.getvalue())
+        self.assertEqual(ScanRollup.objects.aggregate(total=Sum('count'))['total'], 26)
+        old_days = ScanRollup.objects.filter(day__lt=timezone.localdate() - datetime.timedelta(days=365))
+        self.assertEqual(old_days.aggregate(total=Sum('count'))['total'], 25)
+
+
+class ScanResolverTests(TestCase):
+    """parse_payload reads every label we printed; ScanResolver caches safely."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.medicine = Medicine.objects.create(
+            name='Vitamin D: 1000 IU', manufacturer='ACME', batch_number='VD:24-7',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+        cls.other = Medicine.objects.create(
+            name='Zinc', manufacturer='ACME', batch_number='ZN-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+
+    def setUp(self):
+        scan_resolver.clear()
+        self.addCleanup(scan_resolver.clear)
+
+    def test_parse_v2_payload_with_colons(self):
+        payload = parse_payload(build_payload(self.medicine))
+        self.assertEqual(
+            (payload.version, payload.medicine_id, payload.batch_number, payload.name),
+            (2, self.medicine.pk, 'VD:24-7', 'Vitamin D: 1000 IU'),
+        )
+
+    def test_parse_v1_payload(self):
+        payload = parse_payload('MED-12-Co-codamol-CC-9')
+        self.assertEqual((payload.version, payload.medicine_id, payload.batch_number), (1, 12, '9'))
+        self.assertIsNone(parse_payload('MED-None-Zinc-ZN-1').medicine_id)
+        self.assertIsNone(parse_payload('ZN-1'))
+        self.assertIsNone(parse_payload('MED2:12:only-batch'))
+
+    def test_resolve_many_costs_two_queries(self):
+        items = [
+            build_payload(self.medicine), 'ZN-1', 'unknown',
+            f'MED-{self.other.pk}-Zinc-ZN-1', 'MED-None-Zinc-ZN-1',
+        ]
+        with self.assertNumQueries(2):
+            results = scan_resolver.resolve_many(items)
+        # A v1 label without an id is only tried as a whole batch number
+        expected = [self.medicine.pk, self.other.pk, None, self.other.pk, None]
+        self.assertEqual([medicine and medicine.pk for medicine in results], expected)
+        with self.assertNumQueries(1):
+            # Only the strings that matched nothing are looked up again
+            results = scan_resolver.resolve_many(items)
+        self.assertEqual([medicine and medicine.pk for medicine in results], expected)
+
+    def test_v2_id_must_match_the_batch(self):
+        # A label naming a batch that the id no longer carries
+        stale = f'MED2:{self.other.pk}:VD%3A24-7:Zinc'
+        self.assertEqual(scan_resolver.resolve(stale).pk, self.medicine.pk)
+
+    def test_save_and_delete_evict(self):
+        payload = build_payload(self.medicine)
+        scan_resolver.resolve(payload)
+        self.medicine.batch_number = 'VD:25-1'
+        self.medicine.save()
+        self.assertIsNone(scan_resolver.resolve(payload))
+        self.assertIsNone(scan_resolver.resolve('VD:24-7'))
+        self.assertEqual(scan_resolver.resolve(build_payload(self.medicine)).pk, self.medicine.pk)
+
+        scan_resolver.resolve('ZN-1')
+        self.other.delete()
+        with self.assertNumQueries(1):
+            self.assertIsNone(scan_resolver.resolve('ZN-1'))
+
+    def test_ttl_cache_expires_and_evicts_least_recent(self):
+        ttl_cache = TTLCache(maxsize=2, ttl=10)
+        with mock.patch('medicines.resolver.time.monotonic', return_value=100):
+            ttl_cache.set('a', 1)
+            ttl_cache.set('b', 2)
+            ttl_cache.get('a')
+            ttl_cache.set('c', 3)
+            self.assertEqual((ttl_cache.get('a'), ttl_cache.get('b'), ttl_cache.get('c')), (1, None, 3))
+        with mock.patch('medicines.resolver.time.monotonic', return_value=111):
+            self.assertIsNone(ttl_cache.get('a'))
+        self.assertEqual(len(ttl_cache), 1)
+
+
+class ScanBatchApiTests(TestCase):
+    """scan_batch_api and the ScanResolver.resolve_many behind it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('handheld', 'handheld@example.com', 'pw')
+        cls.medicines = Medicine.objects.bulk_create([
+            Medicine(
+                name=f'Medicine {i}', manufacturer='ACME', batch_number=f'BATCH-{i}',
+                expiry_date=datetime.date(2030, 1, 1), price=1, stock=1,
+            )
+            for i in range(999)
+        ])
+
+    def setUp(self):
+        scan_resolver.clear()
+        self.client.force_login(self.user)
+
+    def post_items(self, items, **extra):
+        return self.client.post(
+            reverse('scan_batch_api'), json.dumps({'items': items}), content_type='application/json', **extra,
+        )
+
+    def test_resolve_many_costs_at_most_two_queries(self):
+        first, second = self.medicines[:2]
+        items = [build_payload(first), 'BATCH-1', 'unknown', f'MED-{second.pk}-{second.name}-{second.batch_number}']
+        with self.assertNumQueries(2):
+            resolved = scan_resolver.resolve_many(items)
+        self.assertEqual(resolved, [first, second, None, second])
+        with self.assertNumQueries(1):
+            # Only the miss is looked up again
+            self.assertEqual(scan_resolver.resolve_many(items), resolved)
+
+    def test_results_follow_item_order(self):
+        medicine = self.medicines[0]
+        response = self.post_items([build_payload(medicine), ' BATCH-5 ', 'garbage', ''])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([result['recognized'] for result in body['results']], [True, True, False, False])
+        self.assertEqual(body['results'][1]['medicine']['batch_number'], 'BATCH-5')
+        self.assertEqual(body['summary']['recognized'], 2)
+        # Blank items are answered but not logged
+        self.assertEqual(ScanLog.objects.count(), 3)
+
+    def test_ndjson_ends_with_summary(self):
+        response = self.post_items(['BATCH-1', 'nope'], HTTP_ACCEPT='application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[-1]['summary']['count'], 2)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post_items('BATCH-1').status_code, 400)
+        response = self.client.post(reverse('scan_batch_api'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        with self.settings(MEDICINE_SCAN_BATCH_MAX_ITEMS=2):
+            self.assertEqual(self.post_items(['a', 'b', 'c']).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.post_items(['BATCH-1']).status_code, 401)
+
+    def test_full_batch_of_distinct_rollup_keys(self):
+        # 999 medicines and one miss make 1000 rollup groups in one request
+        items = [f'BATCH-{i}' for i in range(999)] + ['unknown']
+        response = self.post_items(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['summary']['recognized'], 999)
+        self.assertEqual(ScanRollup.objects.count(), 1000)
+        self.assertEqual(ScanRollup.objects.aggregate(total=Sum('count'))['total'], 1000)
+
+        # A second pass increments the existing rows in place
+        self.post_items(items)
+        self.assertEqual(ScanRollup.objects.count(), 1000)
+        self.assertEqual(set(ScanRollup.objects.values_list('count', flat=True)), {2})
+
+
+class SearchIndexTests(TestCase):
+    """The fuzzy search index forgives typos and follows every write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.paracetamol = Medicine.objects.create(
+            name='Paracetamol', generic_name='Paracetamol', manufacturer='ACME', batch_number='SRCH-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+        cls.ibuprofen = Medicine.objects.create(
+            name='Ibuprofen', manufacturer='ACME', batch_number='SRCH-2',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+
+    def setUp(self):
+        search_index.clear()
+        self.addCleanup(search_index.clear)
+
+    def test_typos_still_match(self):
+        self.assertEqual(search_index.search('paracetmol'), [self.paracetamol.pk])
+        self.assertEqual(search_index.search('ibuprofin'), [self.ibuprofen.pk])
+        self.assertEqual(search_index.search('zzzzzz'), [])
+
+    def test_each_medicine_is_returned_once(self):
+        # Name and generic name both match, but the pk is listed once
+        self.assertEqual(search_index.search('paracetamol', limit=5), [self.paracetamol.pk])
+
+    def test_signals_keep_the_loaded_index_current(self):
+        search_index.search('paracetamol')
+        medicine = Medicine.objects.create(
+            name='Amoxicillin', manufacturer='ACME', batch_number='SRCH-3',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(search_index.search('amoxicilin'), [medicine.pk])
+        medicine.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(search_index.search('amoxicilin'), [])
+
+    def test_changes_during_a_reload_are_kept(self):
+        index = MedicineSearchIndex()
+        index.load()
+        added = Medicine(pk=10 ** 6, name='Amoxicillin', batch_number='SRCH-3')
+
+        def rows():
+            # Written after the reload read its rows, and signalled meanwhile
+            index.add(added)
+            index.remove(self.ibuprofen.pk)
+            yield from Medicine.objects.values_list('pk', *SEARCH_FIELDS)
+
+        with mock.patch.object(index, '_rows') as rows_query:
+            rows_query.return_value.iterator.return_value = rows()
+            index.load()
+        self.assertEqual(index.search('amoxicillin'), [added.pk])
+        self.assertEqual(index.search('ibuprofen'), [])
+
+
+class NgramSuggestTests(TestCase):
+    """suggest finds the medicine a mistyped scan meant, from the trigram table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.amoxicillin = Medicine.objects.create(
+            name='Amoxicillin 250mg', manufacturer='ACME', batch_number='AMX-2024-0117',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+        cls.neighbour = Medicine.objects.create(
+            name='Amoxicillin 500mg', manufacturer='ACME', batch_number='AMX-2024-0171',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+        cls.ibuprofen = Medicine.objects.create(
+            name='Ibuprofen', manufacturer='ACME', batch_number='IBU-2023-5500',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+
+    def grams(self, medicine):
+        return set(MedicineNgram.objects.filter(medicine=medicine).values_list('gram', flat=True))
+
+    def test_misspelled_batch_number_ranks_its_medicine_first(self):
+        suggestions = suggest('AMX-2024-0118')
+        self.assertEqual(suggestions[0][0].pk, self.amoxicillin.pk)
+        self.assertNotIn(self.ibuprofen.pk, [medicine.pk for medicine, _score in suggestions])
+        self.assertEqual(suggest(''), [])
+
+    async def test_async_suggest_agrees(self):
+        suggestions = await asuggest('AMX-2024-0118')
+        self.assertEqual(suggestions[0][0].pk, self.amoxicillin.pk)
+
+    def test_index_rows_follow_save_and_delete(self):
+        self.assertEqual(self.grams(self.ibuprofen), extract_grams('IBU-2023-5500', 'Ibuprofen'))
+        self.ibuprofen.batch_number = 'NUR-2025-0042'
+        self.ibuprofen.save()
+        self.assertEqual(self.grams(self.ibuprofen), extract_grams('NUR-2025-0042', 'Ibuprofen'))
+        self.assertEqual(suggest('NUR-2025-0043')[0][0].pk, self.ibuprofen.pk)
+
+        self.ibuprofen.delete()
+        self.assertFalse(MedicineNgram.objects.filter(medicine_id=self.ibuprofen.pk).exists())
+        self.assertEqual(suggest('NUR-2025-0043'), [])
+
+
+class TypeaheadTests(TestCase):
+    """The prefix index ranks field starts first and follows every write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('typist', 'typist@example.com', 'pw')
+        cls.calpol = Medicine.objects.create(
+            name='Calpol Paracetamol', manufacturer='ACME', batch_number='CAL-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=4,
+        )
+        cls.paracetamol = Medicine.objects.create(
+            name='Paracetamol 500mg', manufacturer='ACME', batch_number='PAR24-000123',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=10,
+        )
+
+    def setUp(self):
+        typeahead_index.clear()
+        self.addCleanup(typeahead_index.clear)
+
+    def names(self, query, limit=None):
+        return [result['name'] for result in typeahead_index.lookup(query, limit)]
+
+    def test_field_starts_rank_before_word_starts(self):
+        self.assertEqual(self.names('para'), ['Paracetamol 500mg', 'Calpol Paracetamol'])
+        self.assertEqual(self.names('000123'), ['Paracetamol 500mg'])
+        self.assertEqual(self.names('para', limit=1), ['Paracetamol 500mg'])
+
+    def test_signals_keep_the_loaded_index_current(self):
+        self.names('para')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('parx'), [])
+        medicine = Medicine.objects.create(
+            name='Parx', manufacturer='ACME', batch_number='PRX-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('parx'), ['Parx'])
+        medicine.name = 'Ibuprofen'
+        medicine.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('parx'), [])
+            self.assertEqual(self.names('ibu'), ['Ibuprofen'])
+        medicine.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('ibu'), [])
+
+    def test_stock_follows_committed_movements(self):
+        def stock():
+            return typeahead_index.lookup('paracetamol 5')[0]['stock']
+
+        self.assertEqual(stock(), 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_movements([Movement(self.paracetamol.pk, StockMovement.DISPENSE, 3)])
+            self.assertEqual(stock(), 10)
+        self.assertEqual(stock(), 7)
+
+    def test_changes_during_a_reload_are_kept(self):
+        index = MedicinePrefixIndex()
+        index.load()
+        added = Medicine(pk=10 ** 6, name='Parx', batch_number='PRX-1', stock=1)
+
+        def rows():
+            # Written after the reload read its rows, and signalled meanwhile
+            index.add(added)
+            index.remove(self.calpol.pk)
+            index.update_stock({self.paracetamol.pk: 2})
+            yield from Medicine.objects.values_list('pk', 'stock', *TYPEAHEAD_FIELDS)
+
+        with mock.patch.object(index, '_rows') as rows_query:
+            rows_query.return_value.iterator.return_value = rows()
+            index.load()
+        self.assertEqual(
+            [(result['name'], result['stock']) for result in index.lookup('par')],
+            [('Paracetamol 500mg', 2), ('Parx', 1)],
+        )
+
+    def test_api_clamps_the_limit(self):
+        Medicine.objects.bulk_create([
+            Medicine(
+                name=f'Paradol {i}', manufacturer='ACME', batch_number=f'PDL-{i}',
+                expiry_date=datetime.date(2030, 1, 1), price=1,
+            )
+            for i in range(10)
+        ])
+        self.client.force_login(self.user)
+
+        def count(**params):
+            response = self.client.get(f"{reverse('typeahead_api')}?{urlencode({'q': 'para', **params})}")
+            self.assertEqual(response.status_code, 200)
+            return len(response.json()['results'])
+
+        with override_settings(MEDICINE_TYPEAHEAD_LIMIT=3, MEDICINE_TYPEAHEAD_MAX_LIMIT=5):
+            self.assertEqual(count(), 3)
+            self.assertEqual(count(limit=4), 4)
+            self.assertEqual(count(limit=500), 5)
+            self.assertEqual(count(limit=0), 1)
+            self.assertEqual(count(limit='-2'), 3)
+        self.assertEqual(count(limit=500), 12)
+
+    def test_api_requires_login(self):
+        self.assertEqual(self.client.get(reverse('typeahead_api'), {'q': 'para'}).status_code, 401)
+
+
+class ScanRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('roller', 'roller@example.com', 'pw')
+
+    def test_rollups_without_medicine_are_unique(self):
+        today = timezone.localdate()
+        rows = [ScanRollup(day=today, medicine=None, recognized=False, user=self.user) for _ in range(2)]
+        ScanRollup.objects.bulk_create(rows, ignore_conflicts=True)
+        update_rollups([ScanLog(scanned_data='??', recognized=False, user=self.user, timestamp=timezone.now())] * 3)
+        self.assertEqual(
+            list(ScanRollup.objects.values_list('medicine', 'recognized', 'count')), [(None, False, 3)],
+        )
+
+    def test_deleting_scanned_medicines_keeps_daily_totals(self):
+        today = timezone.localdate()
+        medicines = Medicine.objects.bulk_create([
+            Medicine(
+                name=f'Rolled {i}', manufacturer='ACME', batch_number=f'ROL-{i}',
+                expiry_date=datetime.date(2030, 1, 1), price=1,
+            )
+            for i in range(3)
+        ])
+        update_rollups([
+            ScanLog(scanned_data='x', recognized=True, medicine=medicine, user=self.user, timestamp=timezone.now())
+            for medicine in (medicines[0], medicines[0], medicines[1], medicines[2])
+        ])
+        ScanRollup.objects.create(day=today, medicine=None, recognized=True, user=self.user, count=5)
+
+        def totals():
+            return dict(ScanRollup.objects.values_list('day').annotate(Sum('count')))
+
+        before = totals()
+        medicines[0].delete()
+        medicines[1].delete()
+        Medicine.objects.filter(pk=medicines[2].pk).delete()
+        self.assertEqual(totals(), before)
+        self.assertEqual(
+            list(ScanRollup.objects.values_list('medicine', 'recognized', 'count')), [(None, True, 9)],
+        )
+
+
+class RequestMetricsTests(TestCase):
+    """RequestMetricsMiddleware counts every request; metrics_view exposes them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('observer', 'observer@example.com', 'pw')
+        cls.staff = User.objects.create_user('operator', 'operator@example.com', 'pw', is_staff=True)
+        cls.medicine = Medicine.objects.create(
+            name='Metered', manufacturer='ACME', batch_number='MET-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1,
+        )
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_metrics_need_staff_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    @override_settings(MEDICINE_METRICS_TOKEN='s3cret')
+    def test_metrics_need_the_token_when_set(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 403)
+        self.client.logout()
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_prometheus_text_format(self):
+        metrics.incr('scan.resolve', 2, path='id "db"')
+        metrics.set_gauge('scanlog.buffer.depth', 7)
+        metrics.observe('span.seconds', 0.2, buckets=(0.1, 0.5), span='qr')
+        metrics.observe('span.seconds', 0.7, buckets=(0.1, 0.5), span='qr')
+        lines = metrics.render_prometheus().splitlines()
+        for line in (
+            '# TYPE medicines_scan_resolve_total counter',
+            'medicines_scan_resolve_total{path="id \\"db\\""} 2',
+            '# TYPE medicines_scanlog_buffer_depth gauge',
+            'medicines_scanlog_buffer_depth 7',
+            '# TYPE medicines_span_seconds histogram',
+            'medicines_span_seconds_bucket{span="qr",le="0.1"} 0',
+            'medicines_span_seconds_bucket{span="qr",le="0.5"} 1',
+            'medicines_span_seconds_bucket{span="qr",le="+Inf"} 2',
+            'medicines_span_seconds_count{span="qr"} 2',
+        ):
+            self.assertIn(line, lines)
+
+    def test_sync_request_queries_are_counted(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('medicine_qr', args=[self.medicine.pk, 'svg']))
+        self.assertEqual(response.status_code, 200)
+        queries = metrics.get_histogram('http.request.queries', view='medicine_qr')
+        self.assertEqual((queries['count'], queries['sum']), (1, len(captured)))
+        self.assertEqual(metrics.get_counter('http.requests', view='medicine_qr', method='GET', status='2xx'), 1)
+
+    async def test_async_request_queries_are_counted(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('typeahead_api'), {'q': 'met'})
+        self.assertEqual(response.status_code, 200)
+        queries = metrics.get_histogram('http.request.queries', view='typeahead_api')
+        # The session and user lookups run in sync_to_async threads
+        self.assertEqual(queries['count'], 1)
+        self.assertGreaterEqual(queries['sum'], 2)
+
+    @override_settings(MEDICINE_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('medicines.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('medicine_qr', args=[self.medicine.pk, 'svg']))
+        self.assertIn('Slow request GET', logs.output[0])
+        self.assertIn('(medicine_qr)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class ImportMedicinesTests(TestCase):
+    """import_medicines upserts on batch_number and reports rows it rejects."""
+
+    HEADER = 'name,generic_name,manufacturer,batch_number,expiry_date,price,stock,description\n'
+
+    def setUp(self):
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def write(self, name, text):
+        path = self.directory / name
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+
+    def import_file(self, path, **options):
+        call_command('import_medicines', path, workers=1, verbosity=0, stdout=StringIO(), **options)
+
+    def test_existing_batch_numbers_are_updated(self):
+        Medicine.objects.create(
+            name='Old name', manufacturer='ACME', batch_number='IMP-1',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=1,
+        )
+        path = self.write('medicines.csv', self.HEADER + (
+            'Paracetamol,,ACME,IMP-1,2031-01-01,2.50,5,\n'
+            'Ibuprofen,,ACME,IMP-2,2031-01-01,3.00,7,\n'
+            'Ibuprofen forte,,ACME,IMP-2,2031-01-01,3.00,9,\n'
+        ))
+        self.import_file(path)
+
+        self.assertEqual(
+            sorted(Medicine.objects.values_list('batch_number', 'name', 'stock')),
+            [('IMP-1', 'Paracetamol', 5), ('IMP-2', 'Ibuprofen forte', 9)],
+        )
+        for medicine in Medicine.objects.all():
+            self.assertEqual(medicine.qr_hash, payload_hash(build_payload(medicine)))
+
+    def test_invalid_rows_are_rejected(self):
+        path = self.write('medicines.jsonl', '\n'.join([
+            json.dumps({'name': 'Aspirin', 'manufacturer': 'ACME', 'batch_number': 'IMP-3',
+                        'expiry_date': '2031-01-01', 'price': '1.00', 'stock': 2}),
+            json.dumps({'name': 'No price', 'manufacturer': 'ACME', 'batch_number': 'IMP-4',
+                        'expiry_date': '2031-01-01', 'price': 'free', 'stock': 2}),
+            '{not json',
+            '[1, 2]',
+        ]))
+        rejects = self.directory / 'rejects.jsonl'
+        self.import_file(path, rejects=str(rejects))
+
+        self.assertEqual(list(Medicine.objects.values_list('batch_number', flat=True)), ['IMP-3'])
+        rejected = [json.loads(line) for line in rejects.read_text().splitlines()]
+        self.assertEqual([row['line'] for row in rejected], [2, 3, 4])
+        self.assertIn('price', rejected[0]['errors'])
+        self.assertIn('__all__', rejected[1]['errors'])
+
+    def test_replaced_qr_files_are_deleted_on_commit(self):
+        media = self.directory / 'media'
+        with self.settings(MEDICINE_QR_STORE_FILES=True, MEDIA_ROOT=str(media)):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.import_file(self.write('first.csv', self.HEADER + 'Aspirin,,ACME,IMP-5,2031-01-01,1,1,\n'))
+            old_file = Medicine.objects.get().qr_code.name
+            self.assertTrue((media / old_file).exists())
+
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.import_file(self.write('second.csv', self.HEADER + 'Aspirin C,,ACME,IMP-5,2031-01-01,1,1,\n'))
+            new_file = Medicine.objects.get().qr_code.name
+            self.assertNotEqual(new_file, old_file)
+            self.assertTrue((media / new_file).exists())
+            # Still there until the transaction that repointed the row commits
+            self.assertTrue((media / old_file).exists())
+            for callback in callbacks:
+                callback()
+            self.assertFalse((media / old_file).exists())
+
+    def test_no_qr_still_stores_qr_hashes(self):
+        self.import_file(self.write('medicines.csv', self.HEADER + 'Aspirin,,ACME,IMP-6,2031-01-01,1,1,\n'), no_qr=True)
+
+        medicine = Medicine.objects.get()
+        self.assertEqual(medicine.qr_hash, payload_hash(build_payload(medicine)))
+        # The next save doesn't take the imported row for a changed payload
+        self.assertFalse(medicine.update_qr_code())
+
+    def test_no_qr_unlinks_images_of_changed_payloads(self):
+        media = self.directory / 'media'
+        with self.settings(MEDICINE_QR_STORE_FILES=True, MEDIA_ROOT=str(media)):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.import_file(self.write('first.csv', self.HEADER + 'Aspirin,,ACME,IMP-7,2031-01-01,1,1,\n'))
+            old_file = Medicine.objects.get().qr_code.name
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.import_file(
+                    self.write('second.csv', self.HEADER + 'Aspirin C,,ACME,IMP-7,2031-01-01,1,1,\n'), no_qr=True,
+                )
+            medicine = Medicine.objects.get()
+            self.assertEqual(medicine.qr_code.name, '')
+            self.assertEqual(medicine.qr_hash, payload_hash(build_payload(medicine)))
+            self.assertFalse((media / old_file).exists())
+
+    def test_loaded_indexes_see_imported_rows(self):
+        existing = Medicine.objects.create(
+            name='Aspirin', manufacturer='ACME', batch_number='IMP-8',
+            expiry_date=datetime.date(2030, 1, 1), price=1, stock=1,
+        )
+        for index in (search_index, typeahead_index, scan_resolver):
+            index.clear()
+            self.addCleanup(index.clear)
+        search_index.load()
+        typeahead_index.load()
+        self.assertEqual(scan_resolver.resolve(build_payload(existing)).stock, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_file(self.write('medicines.csv', self.HEADER + (
+                'Aspirin,,ACME,IMP-8,2030-01-01,1,4,\n'
+                'Metformin,,ACME,IMP-9,2031-01-01,1,2,\n'
+            )))
+
+        metformin = Medicine.objects.get(batch_number='IMP-9')
+        self.assertEqual(search_index.search('metformin'), [metformin.pk])
+        self.assertEqual([row['id'] for row in typeahead_index.lookup('metf')], [metformin.pk])
+        self.assertEqual(scan_resolver.resolve(build_payload(existing)).stock, 4)
+
+
+class ImportTimeTests(SimpleTestCase):
+    """
+    Keep ``django.setup()`` cheap for manage.py commands and worker boot.
+
+    A fresh interpreter runs ``django.setup()`` under ``-X importtime``; the
+    modules it loads and the time spent importing them must stay within
+    ``MEDICINE_IMPORT_MODULE_BUDGET`` and ``MEDICINE_IMPORT_TIME_BUDGET_MS``.
+    """
+
+    # Only the code paths that render QR codes or fuzzy match may load these
+    DEFERRED = ('qrcode', 'PIL', 'rapidfuzz', 'Levenshtein')
+    RUNS = 3
+    LINE = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)$')
+
+    def import_times(self):
+        """Return ``{module: microseconds}`` for one cold ``django.setup()``."""
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import django; django.setup()'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        return {
+            match[2]: int(match[1])
+            for match in map(self.LINE.match, result.stderr.splitlines())
+            if match
+        }
+
+    def test_setup_stays_within_budget(self):
+        runs = [self.import_times() for _ in range(self.RUNS)]
+        modules = runs[0]
+
+        loaded = sorted(name for name in modules if name.split('.')[0] in self.DEFERRED)
+        self.assertEqual(loaded, [], "heavy libraries are imported by django.setup()")
+
+        budget = getattr(settings, 'MEDICINE_IMPORT_MODULE_BUDGET', 800)
+        self.assertLessEqual(len(modules), budget, f"django.setup() imports {len(modules)} modules")
+
+        # The fastest run is the least disturbed by whatever else the machine is doing
+        elapsed_ms = min(sum(run.values()) for run in runs) / 1000
+        budget_ms = getattr(settings, 'MEDICINE_IMPORT_TIME_BUDGET_MS', 1000)
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:10]
+        self.assertLessEqual(
+            elapsed_ms, budget_ms,
+            f"django.setup() spends {elapsed_ms:.0f} ms importing; slowest: {slowest}",
+        )
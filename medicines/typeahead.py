@@ -0,0 +1,204 @@
+# medicines/typeahead.py
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .instrumentation import span
+from .search import CatalogIndex, normalize
+
+# Fields whose values (and the words inside them) are matched by prefix
+TYPEAHEAD_FIELDS = ('name', 'generic_name', 'batch_number')
+
+
+def get_typeahead_limit():
+    return getattr(settings, 'MEDICINE_TYPEAHEAD_LIMIT', 8)
+
+
+class SortedKeys:
+    """
+    A sorted list of string keys, each mapped to a compact array of ids.
+
+    Prefix lookups are two bisections and a walk over the matching slice;
+    adding or removing a key keeps the list sorted in place.
+    """
+
+    def __init__(self, mapping=None):
+        self.ids = {key: array('q', pks) for key, pks in (mapping or {}).items()}
+        self.keys = sorted(self.ids)
+
+    def add(self, key, pk):
+        ids = self.ids.get(key)
+        if ids is None:
+            insort(self.keys, key)
+            ids = self.ids[key] = array('q')
+        if pk not in ids:
+            ids.append(pk)
+
+    def discard(self, key, pk):
+        ids = self.ids.get(key)
+        if ids is None or pk not in ids:
+            return
+        ids.remove(pk)
+        if not ids:
+            del self.ids[key]
+            del self.keys[bisect_left(self.keys, key)]
+
+    def prefixed(self, prefix):
+        """Yield the ids of every key starting with ``prefix``, keys in order."""
+        index = bisect_left(self.keys, prefix)
+        while index < len(self.keys) and self.keys[index].startswith(prefix):
+            yield from self.ids[self.keys[index]]
+            index += 1
+
+
+def index_keys(medicine_values):
+    """
+    Return ``(starts, words)`` for a medicine's TYPEAHEAD_FIELDS values.
+
+    ``starts`` are the normalized values themselves; ``words`` the tails of
+    those values beginning at each later word, so "500" finds
+    "Paracetamol 500mg" and "000123" finds batch "PAR24-000123".
+    """
+    starts, words = set(), set()
+    for value in medicine_values:
+        value = normalize(value)
+        if not value:
+            continue
+        starts.add(value)
+        position = value.find(' ')
+        while position != -1:
+            words.add(value[position + 1:])
+            position = value.find(' ', position + 1)
+    return starts, words - starts
+
+
+class MedicinePrefixIndex(CatalogIndex):
+    """
+    Process-local prefix index for typeahead over the Medicine catalog.
+
+    Field starts and word starts live in two SortedKeys, so matches at the
+    start of a name or batch number rank before matches further in. The
+    name, batch number and stock of every medicine are kept alongside, so
+    answering a keystroke never touches the database. Like the fuzzy search
+    index it loads lazily, follows the Medicine signals (and stock
+    movements, which bypass them) and reloads after
+    ``MEDICINE_SEARCH_INDEX_TTL`` seconds to pick up other processes' writes.
+    Both share the reload journal of ``CatalogIndex``.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._starts = SortedKeys()
+        self._words = SortedKeys()
+        self._records = {}
+        self._keys = {}
+
+    def _rows(self):
+        from .models import Medicine
+
+        return Medicine.objects.values_list('pk', 'stock', *TYPEAHEAD_FIELDS)
+
+    def _replace(self, rows, journal):
+        starts, words, records, keys = {}, {}, {}, {}
+        for pk, stock, *values in rows:
+            medicine_starts, medicine_words = index_keys(values)
+            for key in medicine_starts:
+                starts.setdefault(key, []).append(pk)
+            for key in medicine_words:
+                words.setdefault(key, []).append(pk)
+            name, _generic_name, batch_number = values
+            records[pk] = (name, batch_number, stock)
+            keys[pk] = (medicine_starts, medicine_words)
+        starts, words = SortedKeys(starts), SortedKeys(words)
+
+        def install():
+            self._starts, self._words = starts, words
+            self._records, self._keys = records, keys
+        self._swap(install, journal)
+
+    def load(self):
+        with span('typeahead_index_load'), self._reloading() as journal:
+            self._replace(self._rows().iterator(chunk_size=2000), journal)
+
+    async def aload(self):
+        with self._reloading() as journal:
+            self._replace([row async for row in self._rows()], journal)
+
+    def clear(self):
+        with self._lock:
+            self._starts, self._words = SortedKeys(), SortedKeys()
+            self._records, self._keys = {}, {}
+            self._loaded_at = None
+
+    def add(self, medicine):
+        """Index (or re-index) a single saved medicine."""
+        starts, words = index_keys(getattr(medicine, field) for field in TYPEAHEAD_FIELDS)
+        record = (medicine.name, medicine.batch_number, medicine.stock)
+        self._change(self._index, medicine.pk, starts, words, record)
+
+    def _index(self, pk, starts, words, record):
+        self._unindex(pk)
+        for key in starts:
+            self._starts.add(key, pk)
+        for key in words:
+            self._words.add(key, pk)
+        self._records[pk] = record
+        self._keys[pk] = (starts, words)
+
+    def _unindex(self, pk):
+        starts, words = self._keys.pop(pk, ((), ()))
+        for key in starts:
+            self._starts.discard(key, pk)
+        for key in words:
+            self._words.discard(key, pk)
+        self._records.pop(pk, None)
+
+    def remove(self, pk):
+        self._change(self._unindex, pk)
+
+    def update_stock(self, stock):
+        """Apply ``{pk: stock}`` from writes that bypass the model signals."""
+        self._change(self._set_stock, dict(stock))
+
+    def _set_stock(self, stock):
+        for pk, value in stock.items():
+            record = self._records.get(pk)
+            if record is not None:
+                self._records[pk] = (*record[:2], value)
+
+    def _lookup(self, query, limit):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            for keys in (self._starts, self._words):
+                for pk in keys.prefixed(prefix):
+                    if pk in seen:
+                        continue
+                    seen.add(pk)
+                    name, batch_number, stock = self._records[pk]
+                    results.append({'id': pk, 'name': name, 'batch_number': batch_number, 'stock': stock})
+                    if len(results) == limit:
+                        return results
+        return results
+
+    def lookup(self, query, limit=None):
+        """
+        Return up to ``limit`` medicines whose name, generic name or batch
+        number (or a word in them) starts with ``query``, as dicts with
+        ``id``, ``name``, ``batch_number`` and ``stock``.
+        """
+        if self._is_stale():
+            self.load()
+        return self._lookup(query, limit or get_typeahead_limit())
+
+    async def alookup(self, query, limit=None):
+        """Async ``lookup``; only a (re)load awaits the database."""
+        if self._is_stale():
+            await self.aload()
+        return self._lookup(query, limit or get_typeahead_limit())
+
+
+typeahead_index = MedicinePrefixIndex()
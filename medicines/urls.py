@@ -1,12 +1,21 @@
 # medicines/urls.py
-from django.urls import path
+from django.urls import path, re_path
 from . import views
 
 urlpatterns = [
     path('', views.medicine_list, name='medicine_list'),
     path('medicine/new/', views.medicine_create, name='medicine_create'),
     path('medicine/<int:pk>/', views.medicine_detail, name='medicine_detail'),
+    re_path(r'^medicine/(?P<pk>\d+)/qr\.(?P<fmt>png|svg)$', views.medicine_qr, name='medicine_qr'),
     path('medicine/<int:pk>/edit/', views.medicine_update, name='medicine_update'),
     path('medicine/<int:pk>/delete/', views.medicine_delete, name='medicine_delete'),
     path('scan/', views.scan_medicine, name='scan_medicine'),
+    path('scan/analytics/', views.scan_analytics, name='scan_analytics'),
+    path('alerts/', views.inventory_alerts, name='inventory_alerts'),
+    re_path(r'^export/(?P<dataset>medicines|scans)\.(?P<fmt>csv|ndjson)$', views.export_data, name='export_data'),
+    re_path(r'^labels\.(?P<fmt>pdf|png)$', views.label_sheets, name='label_sheets'),
+    path('api/scan/batch/', views.scan_batch_api, name='scan_batch_api'),
+    re_path(r'^api/stock/(?P<kind>dispense|receive)/$', views.stock_movement_api, name='stock_movement_api'),
+    path('api/typeahead/', views.typeahead_api, name='typeahead_api'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,63 +1,175 @@
 # medicines/views.py
-from django.shortcuts import render, redirect, get_object_or_404, reverse
+import datetime
+import hashlib
+import hmac
+import json
+import time
+
+from django.shortcuts import render, redirect, aget_object_or_404, get_object_or_404, reverse
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db.models import Count, Q, Sum
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags, urlencode
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
-
-from .models import Medicine, ScanLog
+from . import export, labels, metrics
+from .alerts import get_expiry_windows
+from .models import InventoryAlert, InventoryAlertRun, Medicine, ScanLog, ScanRollup
 from .forms import MedicineForm
+from .ngram import asuggest
+from .pagination import akeyset_paginate, aranked_paginate
+from .qr import CONTENT_TYPES, build_payload, payload_hash, render_cached
+from .resolver import parse_payload, scan_resolver
+from .scanlog import arecord_scan, save_scan_logs
+from .search import search_index
+from .stats import aget_inventory_stats, get_low_stock_threshold
+from .stock import InsufficientStock, Movement, StockError, apply_movements
+from .typeahead import get_typeahead_limit, typeahead_index
+
+
+# Columns rendered by medicine_list.html (created_at is the paging key)
+LIST_COLUMNS = (
+    'name', 'batch_number', 'manufacturer', 'expiry_date', 'stock', 'price', 'created_at',
+)
+
+
+async def _aload_user(request):
+    """
+    Resolve ``request.user`` through the async auth API.
 
-# Optional: For Postgres Trigram search
-try:
-    from django.contrib.postgres.search import TrigramSimilarity
-    POSTGRES_AVAILABLE = True
-except ImportError:
-    POSTGRES_AVAILABLE = False
+    Templates read ``user`` via the auth context processor; replacing the lazy
+    object keeps that from running a synchronous query inside an async view.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+def _serves_async(request):
+    """
+    Whether ``request`` came in through the ASGI handler.
+
+    A StreamingHttpResponse is only streamed if its iterator matches the
+    handler: ASGI reads a sync iterator to the end before sending anything,
+    and WSGI does the same with an async one.
+    """
+    return isinstance(request, ASGIRequest)
 
 
 @login_required
-def medicine_list(request):
+async def medicine_list(request):
+    await _aload_user(request)
     query = request.GET.get('q', '')
-    medicines = Medicine.objects.all().order_by('-created_at')
-    today = timezone.now().date()
+    cursor = request.GET.get('cursor', '')
+    medicines = Medicine.objects.only(*LIST_COLUMNS)
 
     if query:
-        scored_medicines = []
-        for med in medicines:
-            name_score = fuzz.token_sort_ratio(query.lower(), med.name.lower())
-            batch_score = fuzz.token_sort_ratio(query.lower(), med.batch_number.lower())
-            max_score = max(name_score, batch_score)
-
-            if max_score > 60:
-                scored_medicines.append((-max_score, med))
-
-        scored_medicines.sort()
-        medicines = [med for (score, med) in scored_medicines]
+        # Score against the in-memory index, then fetch only the page's rows
+        ids = await search_index.asearch(query)
+        page = await aranked_paginate(ids, medicines, cursor)
+    else:
+        page = await akeyset_paginate(medicines, cursor)
 
-    # Calculate statistics
-    total_count = medicines.count() if query else Medicine.objects.count()
-    active_count = Medicine.objects.filter(expiry_date__gt=today).count()
-    in_stock_count = Medicine.objects.filter(stock__gte=5).count()
-    low_stock_count = Medicine.objects.filter(stock__lt=5).count()
+    stats = await aget_inventory_stats()
+    if query:
+        stats = dict(stats, total_count=len(ids))
 
     return render(request, 'medicines/medicine_list.html', {
-        'medicines': medicines,
+        'medicines': page.object_list,
+        'page': page,
         'query': query,
-        'total_count': total_count,
-        'active_count': active_count,
-        'in_stock_count': in_stock_count,
-        'low_stock_count': low_stock_count,
+        'low_stock_threshold': get_low_stock_threshold(),
+        **stats,
     })
 
 
 @login_required
-def medicine_detail(request, pk):
-    medicine = get_object_or_404(Medicine, pk=pk)
-    return render(request, 'medicines/medicine_detail.html', {'medicine': medicine})
+async def medicine_detail(request, pk):
+    user = await _aload_user(request)
+
+    # One primary key lookup decides between a 304, a cached card and a render
+    version = await Medicine.objects.filter(pk=pk).values_list('updated_at', 'qr_hash').afirst()
+    if version is None:
+        raise Http404('No Medicine matches the given query.')
+    updated_at, qr_hash = version
+    today = timezone.localdate()
+    threshold = get_low_stock_threshold()
+    # The card shows expiry relative to today and stock against the threshold
+    card_key = (
+        f'medicines:detail:{pk}:{updated_at.timestamp():.6f}:{qr_hash[:16]}:'
+        f'{today.isoformat()}:{threshold}'
+    )
+
+    # Around the card the page shows the user and any flash messages
+    etag = last_modified = None
+    if not len(messages.get_messages(request)):
+        etag = 'W/"%s"' % hashlib.sha256(f'{card_key}:{user.pk}'.encode()).hexdigest()[:32]
+        midnight = timezone.make_aware(datetime.datetime.combine(today, datetime.time.min))
+        last_modified = int(max(updated_at, midnight).timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            return response
+
+    card = await cache.aget(card_key)
+    if card is None:
+        medicine = await aget_object_or_404(Medicine, pk=pk)
+        card = (medicine.name, render_to_string('medicines/medicine_detail_card.html', {
+            'medicine': medicine, 'low_stock_threshold': threshold,
+        }))
+        await cache.aset(card_key, card, getattr(settings, 'MEDICINE_DETAIL_CACHE_TIMEOUT', 86400))
+
+    name, html = card
+    response = render(request, 'medicines/medicine_detail.html', {
+        'medicine_name': name, 'card': mark_safe(html),
+    })
+    if etag:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    return response
+
+
+# Bounds for the ?size= thumbnail parameter of medicine_qr, in pixels
+QR_MIN_SIZE = 32
+QR_MAX_SIZE = 1024
+
+
+@login_required
+def medicine_qr(request, pk, fmt):
+    medicine = get_object_or_404(Medicine.objects.only('name', 'batch_number'), pk=pk)
+    payload = build_payload(medicine)
+    digest = payload_hash(payload)
+
+    size = request.GET.get('size', '')
+    size = min(max(int(size), QR_MIN_SIZE), QR_MAX_SIZE) if size.isdigit() else None
+
+    # The bytes depend only on payload, format and size
+    etag = f'"{digest[:32]}-{size or 0}.{fmt}"'
+    # Only logged-in users may see it, so no shared cache may keep a copy
+    if request.GET.get('v') == digest[:16]:
+        # Versioned URL: a payload change produces a different URL
+        cache_control = {'private': True, 'max_age': 31536000, 'immutable': True}
+    else:
+        cache_control = {'private': True, 'max_age': 0, 'must_revalidate': True}
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(render_cached(payload, fmt, size), content_type=CONTENT_TYPES[fmt])
+    response['ETag'] = etag
+    patch_cache_control(response, **cache_control)
+    return response
 
 
 @login_required
@@ -66,11 +178,10 @@ def medicine_create(request):
     scanned_data = request.GET.get('data', '')
 
     # Pre-fill form if QR data is provided
-    if scanned_data:
-        parts = scanned_data.split('-')
-        if len(parts) >= 4 and parts[0] == 'MED':
-            initial_data['name'] = parts[2]
-            initial_data['batch_number'] = parts[3]
+    payload = parse_payload(scanned_data) if scanned_data else None
+    if payload is not None:
+        initial_data['name'] = payload.name
+        initial_data['batch_number'] = payload.batch_number
 
     if request.method == 'POST':
         form = MedicineForm(request.POST)
@@ -92,7 +203,11 @@ def medicine_update(request, pk):
     if request.method == 'POST':
         form = MedicineForm(request.POST, instance=medicine)
         if form.is_valid():
-            medicine = form.save()
+            medicine = form.save(commit=False)
+            # Write only what was edited, so stock dispensed or received
+            # through the stock API while the form was open is kept
+            if form.changed_data:
+                medicine.save(update_fields=[*form.changed_data, 'updated_at'])
             messages.success(request, f"Medicine '{medicine.name}' updated successfully!")
             return redirect('medicine_detail', pk=medicine.pk)
     else:
@@ -114,56 +229,45 @@ def medicine_delete(request, pk):
 
 
 @login_required
-def scan_medicine(request):
+async def scan_medicine(request):
+    user = await _aload_user(request)
     if request.method == 'POST':
         qr_data = request.POST.get('qr_data', '').strip()
         medicine = None
         error_message = None
         suggestions = []
 
-        scan_log = ScanLog(user=request.user, scanned_data=qr_data)
+        scan_log = ScanLog(user=user, scanned_data=qr_data)
 
         if not qr_data:
             error_message = "No data was scanned or entered. Please try again."
         else:
             # --- Recognition Logic ---
-            try:
-                parts = qr_data.split('-')
-                if len(parts) >= 2 and parts[0] == 'MED':
-                    medicine_id = int(parts[1])
-                    medicine = Medicine.objects.get(pk=medicine_id)
-            except (IndexError, ValueError, Medicine.DoesNotExist):
-                # Fallback to batch number exact match
-                try:
-                    medicine = Medicine.objects.get(batch_number=qr_data)
-                except Medicine.DoesNotExist:
-                    # Optional: fuzzy search using Postgres TrigramSimilarity
-                    if POSTGRES_AVAILABLE:
-                        fuzzy_matches = Medicine.objects.annotate(
-                            similarity=TrigramSimilarity('batch_number', qr_data)
-                        ).filter(similarity__gt=0.3).order_by('-similarity')
-
-                        if fuzzy_matches.exists():
-                            scan_log.recognized = False
-                            scan_log.save()
-                            return render(request, 'medicines/scan_results.html', {
-                                'matches': fuzzy_matches,
-                                'search_term': qr_data,
-                            })
+            medicine = await scan_resolver.aresolve(qr_data)
+            if medicine is None:
+                # Fuzzy fallback: trigram candidates re-ranked with RapidFuzz
+                fuzzy_matches = await asuggest(qr_data)
+                if fuzzy_matches:
+                    scan_log.recognized = False
+                    await arecord_scan(scan_log)
+                    return render(request, 'medicines/scan_results.html', {
+                        'matches': [match for match, score in fuzzy_matches],
+                        'search_term': qr_data,
+                    })
 
         # --- Post-Recognition Actions ---
         if medicine:
             scan_log.recognized = True
             scan_log.medicine = medicine
-            scan_log.save()
+            await arecord_scan(scan_log)
             return redirect('medicine_detail', pk=medicine.pk)
         else:
             scan_log.recognized = False
-            scan_log.save()
+            await arecord_scan(scan_log)
             error_message = f"Medicine not found for the scanned data: '{qr_data}'"
             suggestions.append("Check if the QR code is clear and undamaged.")
             suggestions.append("Verify if the medicine has been registered in the system.")
-            create_url = f"{reverse('medicine_create')}?data={qr_data}"
+            create_url = f"{reverse('medicine_create')}?{urlencode({'data': qr_data})}"
             suggestions.append(f"If this is a new medicine, you can <a href='{create_url}'>add it now</a>.")
 
         return render(request, 'medicines/scan_medicine.html', {
@@ -173,3 +277,359 @@ def scan_medicine(request):
         })
 
     return render(request, 'medicines/scan_medicine.html')
+
+
+def _scan_result(index, data, medicine):
+    result = {'index': index, 'data': data, 'recognized': medicine is not None}
+    if medicine is not None:
+        result['medicine'] = {
+            'id': medicine.pk,
+            'name': medicine.name,
+            'batch_number': medicine.batch_number,
+            'url': reverse('medicine_detail', args=[medicine.pk]),
+        }
+    return result
+
+
+@require_POST
+def scan_batch_api(request):
+    """
+    Resolve many scans in one request, for handheld and conveyor scanners.
+
+    Body: ``{"items": ["MED2:...", "BATCH-123", ...]}``. Resolution costs a
+    constant number of queries and all ScanLog rows are written with one
+    bulk insert. Responds with JSON, or NDJSON (one result per line and a
+    summary line) for ``?format=ndjson`` or ``Accept: application/x-ndjson``.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Request body must be JSON.'}, status=400)
+    items = body.get('items') if isinstance(body, dict) else body
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        return JsonResponse({'error': '"items" must be a list of strings.'}, status=400)
+    max_items = getattr(settings, 'MEDICINE_SCAN_BATCH_MAX_ITEMS', 1000)
+    if len(items) > max_items:
+        return JsonResponse({'error': f'At most {max_items} items per request.'}, status=400)
+
+    started = time.monotonic()
+    items = [item.strip() for item in items]
+    medicines = scan_resolver.resolve_many(items)
+    save_scan_logs([
+        ScanLog(user=request.user, scanned_data=data, medicine=medicine, recognized=medicine is not None)
+        for data, medicine in zip(items, medicines)
+        if data
+    ])
+    elapsed = time.monotonic() - started
+
+    recognized = sum(medicine is not None for medicine in medicines)
+    summary = {
+        'count': len(items),
+        'recognized': recognized,
+        'unrecognized': len(items) - recognized,
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'scans_per_second': round(len(items) / elapsed) if elapsed else None,
+    }
+    metrics.incr('scan.batch.requests')
+    metrics.incr('scan.batch.items', len(items))
+
+    results = (
+        _scan_result(index, data, medicine)
+        for index, (data, medicine) in enumerate(zip(items, medicines))
+    )
+    wants_ndjson = (
+        request.GET.get('format') == 'ndjson'
+        or 'application/x-ndjson' in request.headers.get('Accept', '')
+    )
+    if wants_ndjson:
+        def lines():
+            for result in results:
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'summary': summary}) + '\n'
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+    return JsonResponse({'results': list(results), 'summary': summary})
+
+
+def _parse_movement_line(line, kind):
+    if not isinstance(line, dict):
+        raise ValueError("Each item must be an object.")
+    medicine_id, quantity = line.get('medicine'), line.get('quantity')
+    reference = line.get('reference', '')
+    if not isinstance(medicine_id, int) or isinstance(medicine_id, bool):
+        raise ValueError('"medicine" must be a medicine id.')
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise ValueError('"quantity" must be a positive integer.')
+    if not isinstance(reference, str) or len(reference) > 100:
+        raise ValueError('"reference" must be a string of at most 100 characters.')
+    return Movement(medicine_id, kind, quantity, reference)
+
+
+@require_POST
+def stock_movement_api(request, kind):
+    """
+    Dispense or receive stock without touching anything else on the rows.
+
+    Body: ``{"medicine": 1, "quantity": 2, "reference": "RX-9"}`` for one
+    line, or ``{"items": [...], "reference": "..."}`` for a batch applied in
+    one transaction (a line's own reference wins over the batch's). Each line
+    is one conditional UPDATE; a dispense that would take stock below zero
+    fails the whole batch with 409 and changes nothing.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Request body must be JSON.'}, status=400)
+    if not isinstance(body, dict):
+        return JsonResponse({'error': 'Request body must be a JSON object.'}, status=400)
+    lines = body['items'] if 'items' in body else [body]
+    if not isinstance(lines, list) or not lines:
+        return JsonResponse({'error': '"items" must be a non-empty list.'}, status=400)
+    max_items = getattr(settings, 'MEDICINE_STOCK_BATCH_MAX_ITEMS', 1000)
+    if len(lines) > max_items:
+        return JsonResponse({'error': f'At most {max_items} items per request.'}, status=400)
+
+    default_reference = body.get('reference', '') if 'items' in body else ''
+    movements = []
+    for index, line in enumerate(lines):
+        if isinstance(line, dict) and 'reference' not in line:
+            line = {**line, 'reference': default_reference}
+        try:
+            movements.append(_parse_movement_line(line, kind))
+        except ValueError as error:
+            return JsonResponse({'error': str(error), 'index': index}, status=400)
+
+    try:
+        ledger = apply_movements(movements, user=request.user)
+    except InsufficientStock as error:
+        return JsonResponse({'error': str(error), 'index': error.index}, status=409)
+    except StockError as error:
+        return JsonResponse({'error': str(error), 'index': error.index}, status=400)
+
+    return JsonResponse({
+        'movements': [
+            {
+                'id': movement.pk,
+                'medicine': movement.medicine_id,
+                'kind': movement.kind,
+                'quantity': movement.quantity,
+                'stock': movement.stock_after,
+                'reference': movement.reference,
+            }
+            for movement in ledger
+        ],
+    })
+
+
+async def typeahead_api(request):
+    """
+    Autocomplete medicines by name, generic name or batch number prefix.
+
+    ``?q=para&limit=8`` answers from the in-memory prefix index, so a request
+    per keystroke costs no queries beyond the session and user lookups.
+    """
+    user = await _aload_user(request)
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+
+    query = request.GET.get('q', '').strip()
+    limit = request.GET.get('limit', '')
+    max_limit = getattr(settings, 'MEDICINE_TYPEAHEAD_MAX_LIMIT', 50)
+    limit = min(max(int(limit), 1), max_limit) if limit.isdigit() else get_typeahead_limit()
+
+    results = await typeahead_index.alookup(query, limit) if query else []
+    for result in results:
+        result['url'] = reverse('medicine_detail', args=[result['id']])
+    response = JsonResponse({'query': query, 'results': results})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def scan_analytics(request):
+    days = request.GET.get('days', '')
+    days = min(max(int(days), 1), 366) if days.isdigit() else 30
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+
+    # Rollups hold one row per (day, medicine, recognized, user), so these
+    # queries scale with the window, not with the size of the scan history.
+    rollups = ScanRollup.objects.filter(day__gte=since)
+    unrecognized = Sum('count', filter=Q(recognized=False))
+
+    daily = list(
+        rollups.values('day')
+        .annotate(total=Sum('count'), unrecognized=unrecognized)
+        .order_by('-day')
+    )
+    for row in daily:
+        row['unrecognized'] = row['unrecognized'] or 0
+        row['unrecognized_rate'] = 100 * row['unrecognized'] / row['total'] if row['total'] else 0
+
+    top_medicines = (
+        rollups.filter(medicine__isnull=False)
+        .values('medicine_id', 'medicine__name')
+        .annotate(total=Sum('count'))
+        .order_by('-total')[:10]
+    )
+
+    totals = rollups.aggregate(total=Sum('count'), unrecognized=unrecognized)
+    total = totals['total'] or 0
+    total_unrecognized = totals['unrecognized'] or 0
+
+    return render(request, 'medicines/scan_analytics.html', {
+        'days': days,
+        'windows': (7, 30, 90),
+        'daily': daily,
+        'top_medicines': top_medicines,
+        'total_scans': total,
+        'unrecognized_scans': total_unrecognized,
+        'unrecognized_rate': 100 * total_unrecognized / total if total else 0,
+    })
+
+
+@login_required
+def inventory_alerts(request):
+    # The alert table is kept current by `manage.py inventory_alerts`
+    limit = getattr(settings, 'MEDICINE_ALERT_LIST_LIMIT', 200)
+    alerts = InventoryAlert.objects.select_related('medicine').only(
+        'kind', 'window_days', 'expiry_date', 'stock', 'raised_at',
+        'medicine__name', 'medicine__batch_number', 'medicine__manufacturer',
+    )
+
+    window = request.GET.get('window', '')
+    expiring = alerts.filter(kind=InventoryAlert.EXPIRING)
+    if window.isdigit():
+        expiring = expiring.filter(window_days__lte=int(window))
+
+    counts = InventoryAlert.objects.values('kind', 'window_days').annotate(total=Count('pk'))
+    window_counts = {days: 0 for days in get_expiry_windows()}
+    kind_counts = {kind: 0 for kind, _label in InventoryAlert.KIND_CHOICES}
+    for row in counts:
+        kind_counts[row['kind']] += row['total']
+        if row['kind'] == InventoryAlert.EXPIRING:
+            # Each window also counts the batches of the narrower ones
+            for days in window_counts:
+                if row['window_days'] <= days:
+                    window_counts[days] += row['total']
+
+    return render(request, 'medicines/inventory_alerts.html', {
+        'expired': alerts.filter(kind=InventoryAlert.EXPIRED).order_by('expiry_date')[:limit],
+        'expiring': expiring.order_by('expiry_date')[:limit],
+        'low_stock': alerts.filter(kind=InventoryAlert.LOW_STOCK).order_by('stock', 'medicine__name')[:limit],
+        'expired_count': kind_counts[InventoryAlert.EXPIRED],
+        'low_stock_count': kind_counts[InventoryAlert.LOW_STOCK],
+        'window_counts': window_counts.items(),
+        'window': int(window) if window.isdigit() else None,
+        'last_run': InventoryAlertRun.objects.order_by('-started_at').first(),
+        'limit': limit,
+    })
+
+
+@staff_member_required
+def export_data(request, dataset, fmt):
+    """
+    Stream a full dump of ``dataset`` as CSV or NDJSON, optionally gzipped.
+
+    Query parameters are the filters of ``medicines.export.filter_rows``
+    plus ``gzip=1``. Rows are streamed as they are read, so memory use stays
+    flat however many there are, under WSGI and ASGI alike.
+    """
+    gzip = request.GET.get('gzip') in ('1', 'true', 'yes')
+    stream_export = export.astream_export if _serves_async(request) else export.stream_export
+    try:
+        content = stream_export(dataset, fmt, request.GET, gzip=gzip)
+    except ValueError as error:
+        return HttpResponse(str(error), status=400, content_type='text/plain')
+
+    filename = f"{dataset}-{timezone.localdate().isoformat()}.{fmt}"
+    if gzip:
+        filename += '.gz'
+    response = StreamingHttpResponse(
+        content, content_type='application/gzip' if gzip else export.CONTENT_TYPES[fmt]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def label_sheets(request, fmt):
+    """
+    Printable QR label sheets for a selection of medicines.
+
+    Medicines are picked with ``ids=1,2,3``, ``reference`` (a delivery
+    reference from the stock ledger) or the filters of the medicine export;
+    ``paper`` is ``a4`` or ``letter`` and ``copies`` the labels per medicine.
+    Sheets are composed in the label process pool. A PDF holds every sheet
+    and is streamed as they finish; a PNG is one sheet, chosen by ``page``.
+    Under ASGI the PDF streams from an async iterator, so no thread waits on
+    the pool. Under WSGI a worker is held for the whole render, so PDFs
+    over ``MEDICINE_LABEL_SYNC_MAX_ITEMS`` labels are left to
+    ``manage.py print_labels``.
+    """
+    paper = request.GET.get('paper', 'a4')
+    if paper not in labels.PAPERS:
+        return HttpResponse(f"paper must be one of {', '.join(labels.PAPERS)}", status=400, content_type='text/plain')
+    copies = request.GET.get('copies', '1')
+    page = request.GET.get('page', '1')
+    if not copies.isdigit() or not 1 <= int(copies) <= 100:
+        return HttpResponse("copies must be a number from 1 to 100", status=400, content_type='text/plain')
+    if not page.isdigit() or int(page) < 1:
+        return HttpResponse("page must be a positive number", status=400, content_type='text/plain')
+    try:
+        rows = labels.select_medicines(request.GET)
+    except ValueError as error:
+        return HttpResponse(str(error), status=400, content_type='text/plain')
+    max_items = labels.get_label_max_items()
+    count = rows.count() * int(copies)
+    if count > max_items:
+        return HttpResponse(f"At most {max_items} labels per request.", status=400, content_type='text/plain')
+    sync_max_items = labels.get_label_sync_max_items()
+    if fmt == 'pdf' and not _serves_async(request) and count > sync_max_items:
+        return HttpResponse(
+            f"At most {sync_max_items} labels per PDF on this server; "
+            "print larger batches with manage.py print_labels.",
+            status=400, content_type='text/plain',
+        )
+
+    filename = f"labels-{timezone.localdate().isoformat()}"
+    if fmt == 'png':
+        sheet = next(labels.iter_pages(
+            rows.iterator(), paper, 'png', copies=int(copies), first_page=int(page), max_pages=1,
+        ), None)
+        if sheet is None:
+            raise Http404("No such label sheet.")
+        response = HttpResponse(sheet, content_type=labels.CONTENT_TYPES['png'])
+        filename += f'-{page}'
+    else:
+        rows = rows.iterator(chunk_size=2000)
+        response = StreamingHttpResponse(
+            labels.astream_labels(rows, paper, copies=int(copies)) if _serves_async(request)
+            else labels.stream_labels(rows, paper, 'pdf', copies=int(copies)),
+            content_type=labels.CONTENT_TYPES['pdf'],
+        )
+    response['Content-Disposition'] = f'inline; filename="{filename}.{fmt}"'
+    return response
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint for this process's metrics.
+
+    Scrapers authenticate with ``Authorization: Bearer <MEDICINE_METRICS_TOKEN>``;
+    without a configured token only logged-in staff can read it.
+    """
+    token = getattr(settings, 'MEDICINE_METRICS_TOKEN', None)
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        allowed = hmac.compare_digest(supplied.encode(), token.encode())
+    else:
+        allowed = request.user.is_active and request.user.is_staff
+    if not allowed:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')